@@ -0,0 +1,321 @@
+import os
+import sys
+import json
+import math
+import time
+import random
+import asyncio
+from typing import Dict, List, Optional, Tuple
+import zmq
+import zmq.asyncio
+import msgpack
+
+# Byte de formato opcional (mesmos valores de server/python/serde.py)
+TAG_JSON = 0x01
+TAG_MSGPACK = 0x02
+# Primeiros bytes de um JSON sem byte de formato (mesmo conjunto do servidor)
+JSON_LEAD = (b"{", b"[", b" ", b"\t", b"\r", b"\n")
+
+SERVICES = ("login", "channel", "publish", "message")
+
+
+def encode(data: Dict, fmt: str, tagged: bool) -> bytes:
+    if fmt == "MSGPACK":
+        payload, tag = msgpack.packb(data), TAG_MSGPACK
+    else:
+        payload, tag = json.dumps(data, ensure_ascii=False).encode('utf-8'), TAG_JSON
+    return bytes((tag,)) + payload if tagged else payload
+
+
+def decode(payload: bytes) -> Dict:
+    """JSON ou MessagePack, com ou sem byte de formato"""
+    if payload[:1] == bytes((TAG_JSON,)):
+        return json.loads(payload[1:])
+    if payload[:1] == bytes((TAG_MSGPACK,)):
+        return msgpack.unpackb(payload[1:], raw=False)
+    if payload[:1] in JSON_LEAD:
+        return json.loads(payload)
+    return msgpack.unpackb(payload, raw=False)
+
+
+def fnv1a(data: bytes) -> int:
+    """Hash dos shards de pub/sub (mesmo de server/python/shards.py)"""
+    h = 0x811c9dc5
+    for byte in data:
+        h = ((h ^ byte) * 0x01000193) & 0xffffffff
+    return h
+
+
+def parse_mix(text: str) -> List[Tuple[str, float]]:
+    """`login:1,publish:6,...` -> [(serviço, peso)]"""
+    mix = []
+    for part in text.split(","):
+        service, _, weight = part.strip().partition(":")
+        if service not in SERVICES:
+            raise ValueError(f"Serviço desconhecido no BENCH_MIX: {service}")
+        mix.append((service, float(weight or 1)))
+    return mix
+
+
+def percentile(ordered: List[float], q: float) -> Optional[float]:
+    if not ordered:
+        return None
+    # Nearest-rank
+    return ordered[max(0, math.ceil(q * len(ordered)) - 1)]
+
+
+def summarize(latencies: List[float], duration: float) -> Dict:
+    """Contagem, vazão e percentis (em ms)"""
+    ordered = sorted(latencies)
+    ms = lambda v: None if v is None else round(v * 1000, 3)
+    return {
+        "count": len(ordered),
+        "throughput": round(len(ordered) / duration, 2) if duration > 0 else 0.0,
+        "mean": ms(sum(ordered) / len(ordered)) if ordered else None,
+        "p50": ms(percentile(ordered, 0.50)),
+        "p99": ms(percentile(ordered, 0.99)),
+        "p999": ms(percentile(ordered, 0.999)),
+        "max": ms(ordered[-1]) if ordered else None,
+    }
+
+
+class Config:
+    """Parâmetros do benchmark (variáveis de ambiente BENCH_*)"""
+
+    def __init__(self):
+        self.broker = os.getenv("BENCH_BROKER", "tcp://broker:5555")
+        shards = max(1, int(os.getenv("PUBSUB_SHARDS", "1")))
+        hosts = os.getenv("PUBSUB_HOSTS")
+        self.proxies = ([h.strip() for h in hosts.split(",") if h.strip()] if hosts
+                        else ["proxy"] + [f"proxy-{i}" for i in range(1, shards)])
+        self.users = int(os.getenv("BENCH_USERS", "1000"))
+        self.channels = int(os.getenv("BENCH_CHANNELS", "20"))
+        self.duration = float(os.getenv("BENCH_DURATION", "30"))
+        self.warmup = float(os.getenv("BENCH_WARMUP", "2"))
+        self.think = int(os.getenv("BENCH_THINK_MS", "0")) / 1000.0
+        self.timeout = int(os.getenv("BENCH_TIMEOUT_MS", "5000"))
+        self.mix = parse_mix(os.getenv("BENCH_MIX", "login:1,channel:1,publish:6,message:2"))
+        self.formats = [f.strip().upper() for f in os.getenv("BENCH_SERDE", "JSON,MSGPACK").split(",") if f.strip()]
+        self.tagged = os.getenv("SERDE_TAG", "0") == "1"
+        self.subscribe = os.getenv("BENCH_SUBSCRIBE", "1") == "1"
+        self.output = os.getenv("BENCH_OUTPUT", "results")
+        self.baseline = os.getenv("BENCH_BASELINE")
+
+    def as_dict(self) -> Dict:
+        return {k: v for k, v in vars(self).items()}
+
+
+class Run:
+    """Uma rodada de carga com um formato de serialização"""
+
+    def __init__(self, config: Config, fmt: str, run_id: str):
+        self.config = config
+        self.fmt = fmt
+        self.run_id = run_id
+        self.context = zmq.asyncio.Context.instance()
+        self.names = [f"bench-{run_id}-{i}" for i in range(config.users)]
+        self.channel_names = [f"bench-{run_id}-c{i}" for i in range(config.channels)]
+        self.services = [s for s, _ in config.mix]
+        self.weights = [w for _, w in config.mix]
+
+        self.latencies: Dict[str, List[float]] = {s: [] for s in SERVICES}
+        self.errors: Dict[str, int] = {s: 0 for s in SERVICES}
+        self.timeouts: Dict[str, int] = {s: 0 for s in SERVICES}
+        self.expected_deliveries = 0
+        self.deliveries: List[float] = []
+        self.recording = False
+
+    def _socket(self) -> zmq.asyncio.Socket:
+        socket = self.context.socket(zmq.DEALER)
+        socket.setsockopt(zmq.LINGER, 0)
+        socket.connect(self.config.broker)
+        return socket
+
+    def _request(self, service: str, user: str) -> Dict:
+        data = {"timestamp": time.time(), "clock": 0}
+        if service == "login":
+            data["user"] = user
+        elif service == "channel":
+            data["channel"] = random.choice(self.channel_names)
+        elif service == "publish":
+            data.update(user=user, channel=random.choice(self.channel_names),
+                        message=f"bench {data['timestamp']}")
+        elif service == "message":
+            data.update(src=user, dst=random.choice(self.names), message=f"bench {data['timestamp']}")
+        return {"service": service, "data": data}
+
+    async def _call(self, socket, request: Dict) -> Tuple[Optional[Dict], float]:
+        """Envia [vazio, payload] pelo DEALER (envelope de REQ) e espera a resposta"""
+        payload = encode(request, self.fmt, self.config.tagged)
+        started = time.perf_counter()
+        await socket.send_multipart([b"", payload])
+        if not await socket.poll(self.config.timeout, zmq.POLLIN):
+            return None, time.perf_counter() - started
+        frames = await socket.recv_multipart()
+        return decode(frames[-1]), time.perf_counter() - started
+
+    def _record(self, service: str, response: Optional[Dict], elapsed: float):
+        if not self.recording:
+            return
+        if response is None:
+            self.timeouts[service] += 1
+            return
+        self.latencies[service].append(elapsed)
+        status = response.get("data", {}).get("status")
+        if status in ("erro", "error"):
+            self.errors[service] += 1
+        elif service in ("publish", "message"):
+            self.expected_deliveries += 1
+
+    async def _user(self, user: str, deadline: float):
+        socket = self._socket()
+        try:
+            while time.time() < deadline:
+                service = random.choices(self.services, self.weights)[0]
+                response, elapsed = await self._call(socket, self._request(service, user))
+                self._record(service, response, elapsed)
+                if response is None:
+                    # Sem resposta: descarta o socket (resposta atrasada não confunde a próxima)
+                    socket.close()
+                    socket = self._socket()
+                if self.config.think:
+                    await asyncio.sleep(self.config.think)
+        finally:
+            socket.close()
+
+    async def _subscriber(self, stop: asyncio.Event):
+        """Conta entregas nos tópicos dos canais e dos usuários do benchmark"""
+        socket = self.context.socket(zmq.SUB)
+        socket.setsockopt(zmq.RCVHWM, 0)
+        topics = self.channel_names + self.names
+        proxies = self.config.proxies
+        for index in sorted({fnv1a(t.encode('utf-8')) % len(proxies) for t in topics}):
+            socket.connect(f"tcp://{proxies[index]}:5558")
+        for topic in topics:
+            socket.setsockopt_string(zmq.SUBSCRIBE, topic)
+        try:
+            while not stop.is_set():
+                if not await socket.poll(200, zmq.POLLIN):
+                    continue
+                _, payload = await socket.recv_multipart()
+                if not self.recording:
+                    continue
+                sent = decode(payload).get("timestamp")
+                if isinstance(sent, (int, float)):
+                    self.deliveries.append(max(0.0, time.time() - sent))
+        finally:
+            socket.close()
+
+    async def _setup(self):
+        """Login de todos os usuários e criação dos canais antes da medição"""
+        socket = self._socket()
+        try:
+            for channel in self.channel_names:
+                await self._call(socket, {"service": "channel",
+                                          "data": {"channel": channel, "timestamp": time.time(), "clock": 0}})
+        finally:
+            socket.close()
+
+        async def login(user: str):
+            user_socket = self._socket()
+            try:
+                await self._call(user_socket, self._request("login", user))
+            finally:
+                user_socket.close()
+
+        for start in range(0, len(self.names), 200):
+            await asyncio.gather(*(login(u) for u in self.names[start:start + 200]))
+
+    async def execute(self) -> Dict:
+        print(f"[{self.fmt}] preparando {len(self.names)} usuários e {len(self.channel_names)} canais...")
+        await self._setup()
+
+        stop = asyncio.Event()
+        subscriber = asyncio.create_task(self._subscriber(stop)) if self.config.subscribe else None
+        await asyncio.sleep(0.5)  # assinaturas chegam ao proxy
+
+        print(f"[{self.fmt}] carga por {self.config.duration:.0f}s (+{self.config.warmup:.0f}s de aquecimento)...")
+        started = time.time()
+        deadline = started + self.config.warmup + self.config.duration
+        users = [asyncio.create_task(self._user(u, deadline)) for u in self.names]
+
+        await asyncio.sleep(self.config.warmup)
+        self.recording = True
+        measured_from = time.time()
+        await asyncio.gather(*users)
+        duration = time.time() - measured_from
+        await asyncio.sleep(1.0)  # últimas entregas em trânsito
+        self.recording = False
+        stop.set()
+        if subscriber:
+            await subscriber
+
+        services = {}
+        for service in self.services:
+            stats = summarize(self.latencies[service], duration)
+            stats.update(errors=self.errors[service], timeouts=self.timeouts[service])
+            services[service] = stats
+        total = summarize([v for s in self.services for v in self.latencies[s]], duration)
+        total.update(errors=sum(self.errors.values()), timeouts=sum(self.timeouts.values()))
+
+        result = {"serde": self.fmt, "tagged": self.config.tagged, "duration": round(duration, 3),
+                  "services": services, "total": total}
+        if self.config.subscribe:
+            deliveries = summarize(self.deliveries, duration)
+            deliveries["expected"] = self.expected_deliveries
+            deliveries["ratio"] = (round(len(self.deliveries) / self.expected_deliveries, 4)
+                                   if self.expected_deliveries else None)
+            result["deliveries"] = deliveries
+        return result
+
+
+def print_report(runs: List[Dict], baseline: Optional[Dict]):
+    previous = {r["serde"]: r for r in (baseline or {}).get("runs", [])}
+    header = f"{'serde':<8}{'serviço':<10}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'p999 ms':>10}{'erros':>8}{'timeouts':>9}"
+    print(header)
+    print("-" * len(header))
+    for run in runs:
+        rows = list(run["services"].items()) + [("total", run["total"])]
+        if "deliveries" in run:
+            rows.append(("entregas", run["deliveries"]))
+        for name, stats in rows:
+            fmt_ms = lambda v: "-" if v is None else f"{v:.2f}"
+            line = (f"{run['serde']:<8}{name:<10}{stats['throughput']:>10.1f}{fmt_ms(stats['p50']):>10}"
+                    f"{fmt_ms(stats['p99']):>10}{fmt_ms(stats['p999']):>10}"
+                    f"{stats.get('errors', 0):>8}{stats.get('timeouts', 0):>9}")
+            old = previous.get(run["serde"], {}).get("services", {}).get(name)
+            if name == "total":
+                old = previous.get(run["serde"], {}).get("total")
+            if old and old.get("p99") and stats["p99"] is not None:
+                line += f"   (p99 {stats['p99'] - old['p99']:+.2f} ms, req/s {stats['throughput'] - old['throughput']:+.1f})"
+            if name == "entregas":
+                line += f"   recebidas {stats['count']}/{stats['expected']}"
+            print(line)
+
+
+async def main():
+    config = Config()
+    run_id = time.strftime("%Y%m%d-%H%M%S")
+    runs = []
+    for fmt in config.formats:
+        runs.append(await Run(config, fmt, f"{run_id}-{fmt.lower()}").execute())
+
+    results = {"run_id": run_id, "config": config.as_dict(), "runs": runs}
+    os.makedirs(config.output, exist_ok=True)
+    path = os.path.join(config.output, f"bench-{run_id}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+
+    baseline = None
+    if config.baseline:
+        with open(config.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(runs, baseline)
+    print(f"Resultados salvos em {path}")
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        sys.exit(1)
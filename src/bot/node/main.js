@@ -1,18 +1,24 @@
 const zmq = require('zeromq');
 const serializer = require('./serde');
 const LamportClock = require('./clock');
+const ShardMap = require('./shards');
 
 class Bot {
     constructor() {
         this.reqSocket = new zmq.Request();
         this.reqSocket.connect('tcp://broker:5555');
 
-        this.subSocket = new zmq.Subscriber();
-        this.subSocket.connect('tcp://proxy:5558');
-
         // Gerar nome aleatório
         this.username = `Bot${Math.floor(Math.random() * 1000)}`;
+
+        // O bot só assina o próprio nome: conecta ao shard desse tópico
+        this.shards = new ShardMap();
+        this.subSocket = new zmq.Subscriber();
+        this.subSocket.connect(this.shards.subEndpoint(this.username));
         this.channels = [];
+        // Versão da listagem de canais e réplica que a emitiu (pedidos incrementais)
+        this.channelsVersion = null;
+        this.channelsReplica = null;
         this.loggedIn = false;
         this.clock = new LamportClock();
     }
@@ -57,23 +63,37 @@ class Bot {
     async getChannels() {
         try {
             const clock = this.clock.tick();
+            const data = {
+                timestamp: Date.now(),
+                clock: clock
+            };
+            // Depois da primeira listagem, pede só os canais criados desde então
+            if (this.channelsVersion !== null) {
+                data.since_version = this.channelsVersion;
+                data.replica = this.channelsReplica;
+            }
             const response = await this.sendRequest({
                 service: 'channels',
-                data: {
-                    timestamp: Date.now(),
-                    clock: clock
-                }
+                data: data
             });
 
             if (response.data.clock) {
                 this.clock.update(response.data.clock);
             }
 
-            this.channels = response.data.channels || [];
-            console.log(`Bot ${this.username} encontrou ${this.channels.length} canais: ${this.channels.join(', ')}`);
+            const channels = response.data.channels || [];
+            if (data.since_version === undefined || response.data.reset || response.data.version === undefined) {
+                this.channels = channels;
+            } else {
+                this.channels = this.channels.concat(channels);
+            }
+            this.channelsVersion = response.data.version === undefined ? null : response.data.version;
+            this.channelsReplica = response.data.replica || null;
+            console.log(`Bot ${this.username} encontrou ${this.channels.length} canais (${channels.length} novos)`);
         } catch (error) {
             console.error(`Erro ao obter canais do bot ${this.username}:`, error.message);
             this.channels = [];
+            this.channelsVersion = null;
         }
     }
 
@@ -128,6 +148,7 @@ class Bot {
 
     async run() {
         console.log(`Iniciando bot ${this.username}...`);
+        await this.shards.check(this.username);
 
         // Tentar login
         if (!(await this.login())) {
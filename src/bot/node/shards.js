@@ -0,0 +1,57 @@
+// Distribuição de tópicos de pub/sub entre os proxies (mesmo hash de server/python/shards.py)
+const dns = require('dns').promises;
+
+const FNV_OFFSET = 0x811c9dc5;
+const FNV_PRIME = 0x01000193;
+
+function fnv1a(text) {
+    let h = FNV_OFFSET;
+    for (const byte of Buffer.from(text, 'utf8')) {
+        h = Math.imul(h ^ byte, FNV_PRIME) >>> 0;
+    }
+    return h;
+}
+
+class ShardMap {
+    constructor() {
+        if (process.env.PUBSUB_HOSTS) {
+            this.hosts = process.env.PUBSUB_HOSTS.split(',').map(h => h.trim()).filter(h => h);
+        } else {
+            const count = Math.max(1, parseInt(process.env.PUBSUB_SHARDS || '1', 10));
+            this.hosts = ['proxy'];
+            for (let i = 1; i < count; i++) {
+                this.hosts.push(`proxy-${i}`);
+            }
+        }
+    }
+
+    // Falha se o host do shard do tópico não resolver em PUBSUB_CHECK_SECONDS
+    // (sem o perfil `sharded`, proxy-1/proxy-2 não existem)
+    async check(topic) {
+        const host = this.hosts[this.index(topic)];
+        const timeout = parseFloat(process.env.PUBSUB_CHECK_SECONDS || '10') * 1000;
+        const deadline = Date.now() + timeout;
+        for (;;) {
+            try {
+                await dns.lookup(host);
+                return;
+            } catch (error) {
+                if (Date.now() >= deadline) {
+                    throw new Error(`Shard de pub/sub inacessível: ${host} ` +
+                        `(PUBSUB_SHARDS=${this.hosts.length}; use o perfil sharded ou ajuste PUBSUB_SHARDS)`);
+                }
+                await new Promise(resolve => setTimeout(resolve, 500));
+            }
+        }
+    }
+
+    index(topic) {
+        return this.hosts.length === 1 ? 0 : fnv1a(topic) % this.hosts.length;
+    }
+
+    subEndpoint(topic) {
+        return `tcp://${this.hosts[this.index(topic)]}:5558`;
+    }
+}
+
+module.exports = ShardMap;
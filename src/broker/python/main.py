@@ -1,15 +1,393 @@
+import os
+import json
+import time
+import bisect
+import hashlib
+import itertools
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional, Tuple
 import zmq
+try:
+    import msgpack
+    MSGPACK_AVAILABLE = True
+except ImportError:
+    MSGPACK_AVAILABLE = False
 
-context = zmq.Context()
+# Protocolo broker <-> servidor (primeiro frame após a identidade)
+READY = b"\x01"      # servidor disponível: [READY, capacidade]
+REQUEST = b"\x02"    # broker -> servidor: [REQUEST, id, envelope..., payload]
+REPLY = b"\x03"      # servidor -> broker: [REPLY, id, envelope..., payload]
+HEARTBEAT = b"\x04"  # servidor -> broker: [HEARTBEAT, capacidade]
 
-client_socket = context.socket(zmq.ROUTER)
-client_socket.bind("tcp://*:5555")
+TAG_JSON = 0x01
+TAG_MSGPACK = 0x02
+# Primeiros bytes de um JSON sem byte de formato (mesmo conjunto do servidor)
+JSON_LEAD = (b"{", b"[", b" ", b"\t", b"\r", b"\n")
 
-server_socket = context.socket(zmq.DEALER)
-server_socket.bind("tcp://*:5556")
 
-zmq.proxy(client_socket, server_socket)
+def decode(payload: bytes) -> Dict:
+    """Desserializa requisição em JSON ou MessagePack (com ou sem byte de formato)"""
+    tagged = payload[:1] in (bytes((TAG_JSON,)), bytes((TAG_MSGPACK,)))
+    body = payload[1:] if tagged else payload
+    if payload[:1] == bytes((TAG_JSON,)) or (not tagged and body[:1] in JSON_LEAD):
+        return json.loads(body.decode('utf-8'))
+    return msgpack.unpackb(body, raw=False)
 
-client_socket.close()
-server_socket.close()
-context.term()
+
+def encode_like(request_payload: bytes, data: Dict) -> bytes:
+    """Serializa resposta no mesmo formato da requisição"""
+    first = request_payload[:1]
+    tag = first if first in (bytes((TAG_JSON,)), bytes((TAG_MSGPACK,))) else b""
+    as_json = first == bytes((TAG_JSON,)) or (not tag and first in JSON_LEAD)
+    if as_json or not MSGPACK_AVAILABLE:
+        return tag + json.dumps(data, ensure_ascii=False).encode('utf-8')
+    return tag + msgpack.packb(data)
+
+
+def ring_hash(key: bytes) -> int:
+    return int.from_bytes(hashlib.md5(key).digest()[:8], 'big')
+
+
+def request_key(request: Dict) -> Optional[str]:
+    """Chave de afinidade de uma requisição: usuário (`user`) ou remetente (`src`).
+    Um `batch` usa a chave dos itens (o primeiro que tiver uma)."""
+    data = request.get("data") if isinstance(request, dict) else None
+    if not isinstance(data, dict):
+        return None
+    if request.get("service") == "batch" and isinstance(data.get("requests"), list):
+        return next(filter(None, map(request_key, data["requests"])), None)
+    return data.get("user") or data.get("src") or None
+
+
+def route_key(payload: bytes) -> Optional[str]:
+    """Chave de afinidade do payload de uma requisição"""
+    try:
+        return request_key(decode(payload))
+    except Exception:
+        return None
+
+
+def split_batch(payload: bytes) -> Optional[Tuple[Dict, List[Tuple[List[int], bytes]]]]:
+    """Divide um `batch` com itens de mais de uma chave em um `batch` por chave.
+
+    Retorna (requisição original, [(posições dos itens, payload da parte)]) ou
+    None se não for um `batch` misto. Cada parte mantém a ordem dos itens.
+    """
+    try:
+        request = decode(payload)
+    except Exception:
+        return None
+    data = request.get("data") if isinstance(request, dict) else None
+    if request.get("service") != "batch" or not isinstance(data, dict) \
+            or not isinstance(data.get("requests"), list):
+        return None
+    groups: "OrderedDict[Optional[str], List[int]]" = OrderedDict()
+    for index, item in enumerate(data["requests"]):
+        groups.setdefault(request_key(item), []).append(index)
+    if len(groups) < 2:
+        return None
+    parts = []
+    for indices in groups.values():
+        part = {"service": "batch", "data": dict(data, requests=[data["requests"][i] for i in indices])}
+        parts.append((indices, encode_like(payload, part)))
+    return request, parts
+
+
+class ServerState:
+    """Estado de um servidor conhecido pelo broker"""
+
+    def __init__(self, identity: bytes, capacity: int):
+        self.identity = identity
+        self.capacity = capacity
+        self.last_seen = time.time()
+        # id da requisição -> (instante do despacho, frames do cliente)
+        self.inflight: Dict[bytes, Tuple[float, List[bytes]]] = {}
+
+    @property
+    def load(self) -> float:
+        return len(self.inflight) / self.capacity
+
+
+class SplitBatch:
+    """Respostas parciais de um `batch` misto, juntadas na ordem original"""
+
+    def __init__(self, envelope: List[bytes], payload: bytes, request: Dict):
+        self.envelope = envelope
+        self.payload = payload
+        items = request["data"]["requests"]
+        self.services = [item.get("service") if isinstance(item, dict) else None for item in items]
+        self.results: List[Optional[Dict]] = [None] * len(items)
+        self.timestamp = request["data"].get("timestamp", time.time())
+        self.clock = 0
+        self.parts: Dict[bytes, List[int]] = {}  # marcador da parte -> posições dos itens
+
+
+class Broker:
+    """Broker com balanceamento por carga (padrão ready-worker).
+
+    Servidores se anunciam com READY/HEARTBEAT informando a capacidade.
+    Requisições com usuário (`user`/`src`) são roteadas por hash consistente
+    (anel com nós virtuais): o mesmo usuário cai sempre no mesmo servidor e,
+    quando um servidor entra ou sai, só as chaves do trecho dele mudam. Se o
+    dono da chave estiver no limite, segue para o próximo servidor do anel.
+    As demais vão para o servidor vivo com menor fila (requisições em
+    andamento / capacidade). Se todos estiverem no limite, a requisição
+    espera em uma fila limitada; fila cheia, espera longa, servidor que
+    morre ou reinicia com a requisição ou resposta além do prazo resultam em
+    resposta de erro imediata ao cliente (a resposta tardia é descartada).
+    Um `batch` com itens de vários usuários é dividido em um `batch` por
+    usuário, cada um roteado pela sua chave; as respostas são juntadas na
+    ordem original antes de voltar ao cliente.
+    """
+
+    def __init__(self):
+        self.heartbeat_interval = int(os.getenv("BROKER_HEARTBEAT_MS", "1000")) / 1000.0
+        self.liveness = int(os.getenv("BROKER_LIVENESS", "3"))
+        self.max_per_server = int(os.getenv("BROKER_SERVER_QUEUE", "32"))
+        self.max_queue = int(os.getenv("BROKER_MAX_QUEUE", "1000"))
+        self.queue_timeout = int(os.getenv("BROKER_QUEUE_TIMEOUT_MS", "5000")) / 1000.0
+        self.request_timeout = int(os.getenv("BROKER_REQUEST_TIMEOUT_MS", "10000")) / 1000.0
+        self.sticky = os.getenv("BROKER_ROUTING", "sticky").lower() == "sticky"
+        self.vnodes = int(os.getenv("BROKER_VNODES", "64"))
+
+        self.context = zmq.Context()
+        self.frontend = self.context.socket(zmq.ROUTER)
+        self.frontend.bind("tcp://*:5555")
+        self.backend = self.context.socket(zmq.ROUTER)
+        # Servidor que reconecta com a mesma identidade assume a conexão
+        self.backend.setsockopt(zmq.ROUTER_HANDOVER, 1)
+        self.backend.bind("tcp://*:5556")
+
+        self.servers: "OrderedDict[bytes, ServerState]" = OrderedDict()
+        self.queue: deque = deque()  # (instante de chegada, frames do cliente, chave)
+        self.ring: List[Tuple[int, bytes]] = []
+        # Id por requisição despachada: o servidor o devolve como parte do envelope,
+        # então várias requisições do mesmo cliente (DEALER) não se confundem
+        self.request_ids = itertools.count(1)
+        # Partes de `batch` misto: marcador (penúltimo frame das partes) -> lote original
+        self.splits: Dict[bytes, SplitBatch] = {}
+        self.split_ids = itertools.count(1)
+
+    def _register(self, identity: bytes, capacity_frame: Optional[bytes], ready: bool = False):
+        try:
+            capacity = int(capacity_frame) if capacity_frame else 1
+        except ValueError:
+            capacity = 1
+        capacity = max(1, min(capacity, self.max_per_server))
+
+        server = self.servers.get(identity)
+        if server is None:
+            server = self.servers[identity] = ServerState(identity, capacity)
+            print(f"Servidor conectado: {identity!r} (capacidade {capacity})")
+            self._rebuild_ring()
+        elif ready and server.inflight:
+            # Servidor reiniciado com a mesma identidade: o que estava em andamento se perdeu
+            print(f"Servidor {identity!r} reiniciado; {len(server.inflight)} requisições falharam")
+            self._fail_inflight(server, "Servidor reiniciado")
+        server.capacity = capacity
+        server.last_seen = time.time()
+
+    def _rebuild_ring(self):
+        """Recalcula o anel de hash consistente com os servidores vivos"""
+        self.ring = sorted(
+            (ring_hash(identity + b"#" + str(i).encode()), identity)
+            for identity in self.servers
+            for i in range(self.vnodes)
+        )
+
+    def _pick_server(self, key: Optional[str] = None) -> Optional[ServerState]:
+        """Dono da chave no anel (ou o seguinte com espaço); sem chave, o menos carregado"""
+        if key is not None and self.ring:
+            start = bisect.bisect(self.ring, (ring_hash(key.encode('utf-8')),))
+            tried = set()
+            for i in range(len(self.ring)):
+                identity = self.ring[(start + i) % len(self.ring)][1]
+                if identity in tried:
+                    continue
+                tried.add(identity)
+                server = self.servers[identity]
+                if len(server.inflight) < server.capacity:
+                    return server
+                if len(tried) == len(self.servers):
+                    break
+            return None
+
+        best = None
+        for server in self.servers.values():
+            if len(server.inflight) >= server.capacity:
+                continue
+            if best is None or server.load < best.load:
+                best = server
+        return best
+
+    def _dispatch(self, server: ServerState, frames: List[bytes]):
+        request_id = str(next(self.request_ids)).encode()
+        server.inflight[request_id] = (time.time(), frames)
+        self.backend.send_multipart([server.identity, REQUEST, request_id] + frames)
+
+    def _reject(self, frames: List[bytes], reason: str):
+        """Responde ao cliente com erro sem passar por servidor"""
+        envelope, payload = frames[:-1], frames[-1]
+        try:
+            service = decode(payload).get("service", "unknown")
+        except Exception:
+            service = "unknown"
+        response = {
+            "service": service,
+            "data": {
+                "status": "erro",
+                "timestamp": time.time(),
+                "clock": 0,
+                "description": reason,
+                "message": reason
+            }
+        }
+        self._to_client(envelope + [encode_like(payload, response)])
+
+    def _to_client(self, frames: List[bytes]):
+        """Entrega a resposta ao cliente; partes de `batch` misto esperam as demais"""
+        split = self.splits.pop(frames[-2], None) if len(frames) > 1 else None
+        if split is None:
+            self.frontend.send_multipart(frames)
+            return
+        indices = split.parts.pop(frames[-2])
+        try:
+            data = decode(frames[-1]).get("data", {})
+        except Exception:
+            data = {"status": "erro", "description": "Resposta inválida do servidor"}
+        results = data.get("results")
+        if isinstance(results, list) and len(results) == len(indices):
+            for index, result in zip(indices, results):
+                split.results[index] = result
+        else:
+            # Parte inteira falhou (erro do broker ou do servidor): o erro vale para cada item
+            for index in indices:
+                split.results[index] = {"service": split.services[index], "data": data}
+        if isinstance(data.get("clock"), int):
+            split.clock = max(split.clock, data["clock"])
+        if split.parts:
+            return
+        response = {
+            "service": "batch",
+            "data": {
+                "status": "OK",
+                "timestamp": split.timestamp,
+                "clock": split.clock,
+                "results": split.results
+            }
+        }
+        self.frontend.send_multipart(split.envelope + [encode_like(split.payload, response)])
+
+    def _on_split(self, frames: List[bytes], request: Dict, parts: List[Tuple[List[int], bytes]]):
+        """Encaminha cada parte de um `batch` misto como requisição própria"""
+        envelope, payload = frames[:-1], frames[-1]
+        split = SplitBatch(envelope, payload, request)
+        group = next(self.split_ids)
+        markers = [f"\x00batch-{group}-{number}".encode() for number in range(len(parts))]
+        # Todas as partes registradas antes de rotear: uma recusa imediata não fecha o lote cedo
+        for marker, (indices, _) in zip(markers, parts):
+            split.parts[marker] = indices
+            self.splits[marker] = split
+        for marker, (_, part_payload) in zip(markers, parts):
+            self._route(envelope + [marker, part_payload], route_key(part_payload))
+
+    def _drain_queue(self):
+        """Despacha requisições em espera enquanto houver servidor livre"""
+        now = time.time()
+        while self.queue:
+            arrived, frames, key = self.queue[0]
+            if now - arrived > self.queue_timeout:
+                self.queue.popleft()
+                self._reject(frames, "Tempo de espera no broker esgotado")
+                continue
+            server = self._pick_server(key)
+            if server is None:
+                return
+            self.queue.popleft()
+            self._dispatch(server, frames)
+
+    def _expire_servers(self):
+        """Remove servidores sem heartbeat e falha suas requisições em andamento"""
+        deadline = time.time() - self.heartbeat_interval * self.liveness
+        for identity in [i for i, s in self.servers.items() if s.last_seen < deadline]:
+            server = self.servers.pop(identity)
+            print(f"Servidor {identity!r} sem heartbeat; removido com {len(server.inflight)} requisições")
+            self._fail_inflight(server, "Servidor indisponível")
+            self._rebuild_ring()
+
+    def _fail_inflight(self, server: ServerState, reason: str):
+        for _, frames in server.inflight.values():
+            self._reject(frames, reason)
+        server.inflight.clear()
+
+    def _expire_requests(self):
+        """Falha requisições sem resposta no prazo (servidor vivo, mas travado)"""
+        deadline = time.time() - self.request_timeout
+        for server in self.servers.values():
+            expired = [rid for rid, (sent, _) in server.inflight.items() if sent < deadline]
+            for request_id in expired:
+                _, frames = server.inflight.pop(request_id)
+                self._reject(frames, "Tempo de resposta do servidor esgotado")
+
+    def _on_client(self, frames: List[bytes]):
+        if self.sticky:
+            split = split_batch(frames[-1])
+            if split is not None:
+                self._on_split(frames, *split)
+                return
+        self._route(frames, route_key(frames[-1]) if self.sticky else None)
+
+    def _route(self, frames: List[bytes], key: Optional[str]):
+        server = self._pick_server(key) if not self.queue else None
+        if server is not None:
+            self._dispatch(server, frames)
+        elif len(self.queue) < self.max_queue:
+            self.queue.append((time.time(), frames, key))
+        else:
+            self._reject(frames, "Servidores sobrecarregados")
+
+    def _on_server(self, frames: List[bytes]):
+        identity, command = frames[0], frames[1]
+
+        if command in (READY, HEARTBEAT):
+            self._register(identity, frames[2] if len(frames) > 2 else None, ready=command == READY)
+        elif command == REPLY and len(frames) > 3:
+            server = self.servers.get(identity)
+            if server is None:
+                return
+            server.last_seen = time.time()
+            if server.inflight.pop(frames[2], None) is None:
+                # Resposta tardia (servidor expirado/reiniciado ou prazo esgotado): cliente já recebeu erro
+                return
+            self._to_client(frames[3:])
+
+    def run(self):
+        print(f"Broker iniciado (fila por servidor={self.max_per_server}, fila global={self.max_queue})")
+        poller = zmq.Poller()
+        poller.register(self.frontend, zmq.POLLIN)
+        poller.register(self.backend, zmq.POLLIN)
+
+        next_check = time.time() + self.heartbeat_interval
+        try:
+            while True:
+                events = dict(poller.poll(self.heartbeat_interval * 1000))
+
+                if self.backend in events:
+                    self._on_server(self.backend.recv_multipart())
+                if self.frontend in events:
+                    self._on_client(self.frontend.recv_multipart())
+
+                if time.time() >= next_check:
+                    self._expire_servers()
+                    self._expire_requests()
+                    next_check = time.time() + self.heartbeat_interval
+
+                self._drain_queue()
+        finally:
+            self.frontend.close()
+            self.backend.close()
+            self.context.term()
+
+
+if __name__ == "__main__":
+    Broker().run()
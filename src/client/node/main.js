@@ -226,6 +226,56 @@ class Client {
 		}
 	}
 
+    async showHistory() {
+        const question = (query) => new Promise(resolve => this.rl.question(query, resolve));
+
+        const target = (await question('Canal ou @usuário (conversa privada): ')).trim();
+        if (!target) {
+            console.log('Canal/usuário não pode ser vazio.');
+            return;
+        }
+
+        const fromClock = parseInt((await question('A partir do clock (vazio = início): ')).trim(), 10);
+
+        const data = {
+            limit: 50,
+            timestamp: Date.now(),
+            clock: this.clock.tick()
+        };
+        if (target.startsWith('@')) {
+            data.user = this.username;
+            data.peer = target.slice(1);
+        } else {
+            data.channel = target;
+        }
+        if (!Number.isNaN(fromClock)) {
+            data.from_clock = fromClock;
+        }
+
+        try {
+            const response = await this.sendRequest({ service: 'history', data });
+
+            if (response.data.clock) {
+                this.clock.update(response.data.clock);
+            }
+
+            if (response.data.status !== 'OK') {
+                console.log(`Erro ao consultar histórico: ${response.data.message || 'Desconhecido'}`);
+                return;
+            }
+
+            console.log(`Histórico de ${target}:`);
+            response.data.messages.forEach(msg => {
+                console.log(`[clock ${msg.clock}] ${msg.user || msg.src}: ${msg.message}`);
+            });
+            if (response.data.has_more) {
+                console.log('(há mais mensagens; consulte novamente a partir do último clock)');
+            }
+        } catch (error) {
+            console.error('Erro ao consultar histórico:', error.message);
+        }
+    }
+
     showMenu() {
         console.log('\n=== Menu ===');
         console.log('1. Listar usuários');
@@ -233,7 +283,8 @@ class Client {
 		console.log('3. Listar canais');
 		console.log('4. Enviar mensagem privada');
 		console.log('5. Publicar em canal');
-		console.log('6. Sair');
+		console.log('6. Histórico de canal/conversa');
+		console.log('7. Sair');
         console.log('============');
     }
 
@@ -266,6 +317,9 @@ class Client {
 					await this.publishToChannel();
 					break;
 				case '6':
+					await this.showHistory();
+					break;
+				case '7':
 					running = false;
 					console.log('Saindo...');
                     break;
@@ -1,16 +1,51 @@
 const msgpack = require('@msgpack/msgpack');
 
+// Byte de formato opcional no início da mensagem (mesmos valores do servidor)
+const TAG_JSON = 0x01;
+const TAG_MSGPACK = 0x02;
+// Primeiros bytes de um JSON sem byte de formato: '{', '[', espaço, \t, \r, \n
+// (mesmo conjunto do servidor e do broker)
+const JSON_LEAD = new Set([0x7b, 0x5b, 0x20, 0x09, 0x0d, 0x0a]);
+
 class Serializer {
     constructor() {
         this.format = process.env.SERDE || 'JSON';
+        // SERDE_TAG=1: mensagens enviadas levam o byte de formato
+        this.tagged = process.env.SERDE_TAG === '1';
 
         if (this.format.toUpperCase() === 'MSGPACK') {
-            this.serialize = this._serializeMsgpack;
-            this.deserialize = this._deserializeMsgpack;
+            this._encode = this._serializeMsgpack;
+            this.tag = TAG_MSGPACK;
         } else {
-            this.serialize = this._serializeJson;
-            this.deserialize = this._deserializeJson;
+            this._encode = this._serializeJson;
+            this.tag = TAG_JSON;
+        }
+    }
+
+    serialize(data) {
+        const payload = this._encode(data);
+        if (!this.tagged) {
+            return payload;
+        }
+        return Buffer.concat([Buffer.from([this.tag]), payload]);
+    }
+
+    // Aceita mensagens com ou sem byte de formato, em qualquer codec
+    deserialize(data) {
+        const buffer = Buffer.isBuffer(data) ? data : Buffer.from(data);
+        const first = buffer[0];
+
+        if (first === TAG_JSON) {
+            return this._deserializeJson(buffer.subarray(1));
+        }
+        if (first === TAG_MSGPACK) {
+            return this._deserializeMsgpack(buffer.subarray(1));
+        }
+        // Sem byte de formato: JSON começa com '{', '[' ou espaço em branco
+        if (JSON_LEAD.has(first)) {
+            return this._deserializeJson(buffer);
         }
+        return this._deserializeMsgpack(buffer);
     }
 
     _serializeJson(data) {
@@ -1,15 +1,195 @@
+import os
+import json
+import time
+from typing import Dict
 import zmq
+from zmq.utils.monitor import recv_monitor_message
 
-context = zmq.Context()
+# Opções de socket que podem faltar em versões antigas da libzmq
+XPUB_VERBOSER = getattr(zmq, "XPUB_VERBOSER", zmq.XPUB_VERBOSE)
 
-pub = context.socket(zmq.XPUB)
-pub.bind("tcp://*:5558")
 
-sub = context.socket(zmq.XSUB)
-sub.bind("tcp://*:5557")
+class TopicStats:
+    """Contadores de um tópico"""
+    __slots__ = ("messages", "bytes", "drops", "subscribers",
+                 "last_messages", "last_bytes", "message_rate", "byte_rate")
 
-zmq.proxy(pub, sub)
+    def __init__(self):
+        self.messages = 0
+        self.bytes = 0
+        self.drops = 0
+        self.subscribers = 0
+        self.last_messages = 0
+        self.last_bytes = 0
+        self.message_rate = 0.0
+        self.byte_rate = 0.0
 
-pub.close()
-sub.close()
-context.close()
+
+class InstrumentedProxy:
+    """Proxy XSUB/XPUB com estatísticas por tópico.
+
+    Repassa mensagens e assinaturas como o `zmq.proxy`, contando por tópico
+    mensagens, bytes e assinantes (a partir dos frames de assinatura do XPUB,
+    em modo verboso). O envio tenta primeiro com XPUB_NODROP: se algum
+    assinante do tópico está no HWM, a mensagem é contada em `drops` e
+    reenviada sem NODROP, de modo que a entrega não muda (o assinante lento
+    perde só as próprias mensagens). Conexões e desconexões de assinantes
+    vêm de um monitor do XPUB. As estatísticas são servidas em JSON por um
+    socket REP (`PROXY_STATS_PORT`).
+    """
+
+    def __init__(self):
+        self.interval = float(os.getenv("PROXY_STATS_INTERVAL", "5"))
+        self.stats_port = int(os.getenv("PROXY_STATS_PORT", "5561"))
+
+        self.context = zmq.Context()
+        self.pub = self.context.socket(zmq.XPUB)
+        self.pub.setsockopt(XPUB_VERBOSER, 1)
+        self.pub.setsockopt(zmq.XPUB_NODROP, 1)
+        self.pub.bind("tcp://*:5558")
+        self.monitor = self.pub.get_monitor_socket(zmq.EVENT_ACCEPTED | zmq.EVENT_DISCONNECTED)
+        self.sub = self.context.socket(zmq.XSUB)
+        self.sub.bind("tcp://*:5557")
+        self.stats_socket = self.context.socket(zmq.REP)
+        self.stats_socket.bind(f"tcp://*:{self.stats_port}")
+
+        self.topics: Dict[bytes, TopicStats] = {}
+        self.connections = 0
+        self.disconnects = 0
+        self.started = time.time()
+        self.last_tick = self.started
+
+    def _topic(self, topic: bytes) -> TopicStats:
+        stats = self.topics.get(topic)
+        if stats is None:
+            stats = self.topics[topic] = TopicStats()
+        return stats
+
+    def _forward_message(self):
+        """Publicação vinda dos servidores (XSUB) -> assinantes (XPUB)"""
+        frames = self.sub.recv_multipart(copy=False)
+        stats = self._topic(frames[0].bytes)
+        stats.messages += 1
+        stats.bytes += sum(len(frame) for frame in frames)
+        try:
+            self.pub.send_multipart(frames, zmq.NOBLOCK, copy=False)
+        except zmq.Again:
+            # Assinante lento no HWM: conta e entrega aos demais como o `zmq.proxy`
+            stats.drops += 1
+            self.pub.setsockopt(zmq.XPUB_NODROP, 0)
+            try:
+                self.pub.send_multipart(frames, copy=False)
+            finally:
+                self.pub.setsockopt(zmq.XPUB_NODROP, 1)
+
+    def _forward_subscription(self):
+        """Assinatura/cancelamento vindo dos assinantes (XPUB) -> servidores (XSUB)"""
+        frame = self.pub.recv(copy=False)
+        data = frame.bytes
+        if data[:1] == b"\x01":
+            self._topic(data[1:]).subscribers += 1
+        elif data[:1] == b"\x00":
+            stats = self._topic(data[1:])
+            stats.subscribers = max(0, stats.subscribers - 1)
+        self.sub.send(frame, copy=False)
+
+    def _on_monitor_event(self):
+        """Conexão ou desconexão de um assinante no XPUB"""
+        event = recv_monitor_message(self.monitor)
+        if event["event"] == zmq.EVENT_ACCEPTED:
+            self.connections += 1
+        elif event["event"] == zmq.EVENT_DISCONNECTED:
+            self.connections = max(0, self.connections - 1)
+            self.disconnects += 1
+
+    def _tick(self, now: float):
+        """Atualiza taxas da última janela e avisa sobre descartes"""
+        elapsed = now - self.last_tick
+        for topic, stats in self.topics.items():
+            stats.message_rate = (stats.messages - stats.last_messages) / elapsed
+            stats.byte_rate = (stats.bytes - stats.last_bytes) / elapsed
+            stats.last_messages = stats.messages
+            stats.last_bytes = stats.bytes
+        dropping = [t.decode('utf-8', 'replace') for t, s in self.topics.items() if s.drops]
+        if dropping:
+            print(f"Tópicos com assinante lento (HWM): {dropping}")
+        self.last_tick = now
+
+    def snapshot(self) -> Dict:
+        topics = {
+            topic.decode('utf-8', 'replace'): {
+                "messages": stats.messages,
+                "bytes": stats.bytes,
+                "message_rate": round(stats.message_rate, 2),
+                "byte_rate": round(stats.byte_rate, 2),
+                "subscribers": stats.subscribers,
+                "hwm_drops": stats.drops,
+            }
+            for topic, stats in self.topics.items()
+        }
+        return {
+            "uptime": round(time.time() - self.started, 3),
+            "interval": self.interval,
+            "messages": sum(s.messages for s in self.topics.values()),
+            "bytes": sum(s.bytes for s in self.topics.values()),
+            "hwm_drops": sum(s.drops for s in self.topics.values()),
+            "connections": self.connections,
+            "disconnects": self.disconnects,
+            "topics": topics,
+        }
+
+    def run(self):
+        print(f"Proxy instrumentado iniciado (estatísticas na porta {self.stats_port})")
+        poller = zmq.Poller()
+        poller.register(self.sub, zmq.POLLIN)
+        poller.register(self.pub, zmq.POLLIN)
+        poller.register(self.stats_socket, zmq.POLLIN)
+        poller.register(self.monitor, zmq.POLLIN)
+
+        try:
+            while True:
+                events = dict(poller.poll(self.interval * 1000))
+                if self.sub in events:
+                    self._forward_message()
+                if self.pub in events:
+                    self._forward_subscription()
+                if self.stats_socket in events:
+                    self.stats_socket.recv()
+                    self.stats_socket.send(json.dumps(self.snapshot()).encode('utf-8'))
+                if self.monitor in events:
+                    self._on_monitor_event()
+
+                now = time.time()
+                if now - self.last_tick >= self.interval:
+                    self._tick(now)
+        finally:
+            self.pub.disable_monitor()
+            self.monitor.close()
+            self.pub.close()
+            self.sub.close()
+            self.stats_socket.close()
+            self.context.term()
+
+
+def run_plain():
+    """Encaminhamento direto em C, sem estatísticas"""
+    context = zmq.Context()
+
+    pub = context.socket(zmq.XPUB)
+    pub.bind("tcp://*:5558")
+
+    sub = context.socket(zmq.XSUB)
+    sub.bind("tcp://*:5557")
+
+    zmq.proxy(pub, sub)
+
+    pub.close()
+    sub.close()
+    context.close()
+
+
+if __name__ == "__main__":
+    if os.getenv("PROXY_STATS", "0") == "1":
+        InstrumentedProxy().run()
+    else:
+        run_plain()
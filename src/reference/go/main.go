@@ -1,17 +1,91 @@
 package main
 
 import (
+	"context"
 	"fmt"
-	"log"
+	"io"
+	"log/slog"
 	"os"
 	"sort"
+	"strconv"
+	"strings"
 	"sync"
+	"sync/atomic"
 	"time"
 
 	"github.com/pebbe/zmq4"
 	"github.com/vmihailenco/msgpack/v5"
 )
 
+// asyncWriter entrega as linhas de log a uma goroutine que escreve no destino.
+// Com o buffer cheio, a linha é descartada (e contada) em vez de bloquear.
+type asyncWriter struct {
+	lines   chan []byte
+	dropped atomic.Uint64
+}
+
+func newAsyncWriter(out io.Writer, size int) *asyncWriter {
+	w := &asyncWriter{lines: make(chan []byte, size)}
+	go func() {
+		for line := range w.lines {
+			out.Write(line)
+		}
+	}()
+	return w
+}
+
+func (w *asyncWriter) Write(p []byte) (int, error) {
+	line := append([]byte(nil), p...)
+	select {
+	case w.lines <- line:
+	default:
+		w.dropped.Add(1)
+	}
+	return len(p), nil
+}
+
+// Logger estruturado (LOG_LEVEL, LOG_FORMAT=text|json) com escrita assíncrona
+var logger = newLogger()
+
+// Eventos por mensagem: só em DEBUG, 1 a cada LOG_SAMPLE_EVERY
+var (
+	sampleEvery   = uint64(envInt("LOG_SAMPLE_EVERY", 100))
+	sampleCounter atomic.Uint64
+)
+
+func envInt(name string, fallback int) int {
+	value, err := strconv.Atoi(os.Getenv(name))
+	if err != nil || value <= 0 {
+		return fallback
+	}
+	return value
+}
+
+func newLogger() *slog.Logger {
+	level := slog.LevelInfo
+	switch strings.ToUpper(os.Getenv("LOG_LEVEL")) {
+	case "DEBUG":
+		level = slog.LevelDebug
+	case "WARN", "WARNING":
+		level = slog.LevelWarn
+	case "ERROR":
+		level = slog.LevelError
+	}
+
+	out := newAsyncWriter(os.Stdout, envInt("LOG_QUEUE_SIZE", 10000))
+	opts := &slog.HandlerOptions{Level: level}
+	if strings.ToLower(os.Getenv("LOG_FORMAT")) == "json" {
+		return slog.New(slog.NewJSONHandler(out, opts))
+	}
+	return slog.New(slog.NewTextHandler(out, opts))
+}
+
+// traceEnabled indica se o evento por mensagem deve ser registrado (sem formatar nada em INFO)
+func traceEnabled() bool {
+	return logger.Enabled(context.Background(), slog.LevelDebug) &&
+		(sampleCounter.Add(1)-1)%sampleEvery == 0
+}
+
 // LamportClock implements Lamport logical clock
 type LamportClock struct {
 	time int
@@ -40,40 +114,171 @@ func (c *LamportClock) GetTime() int {
 
 // ServerInfo represents a server in the system
 type ServerInfo struct {
-	Name    string    `json:"name"`
-	Rank    int       `json:"rank"`
+	Name     string    `json:"name"`
+	Rank     int       `json:"rank"`
 	LastSeen time.Time `json:"last_seen"`
+	Active   bool      `json:"active"`
 }
 
 // ReferenceServer manages server ranks and heartbeats
 type ReferenceServer struct {
+	zmqContext   *zmq4.Context
 	socket       *zmq4.Socket
+	pubSocket    *zmq4.Socket
+	pubMutex     sync.Mutex
 	clock        *LamportClock
 	servers      map[string]*ServerInfo
 	nextRank     int
+	version      int
+	ttl          time.Duration
+	peerPort     int
+	livenessIvl  time.Duration
+	livenessMax  time.Duration
 	serversMutex sync.RWMutex
 	serdeFormat  string
 }
 
+func envMillis(name string, fallback int) time.Duration {
+	return time.Duration(envInt(name, fallback)) * time.Millisecond
+}
+
 func NewReferenceServer() *ReferenceServer {
 	context, _ := zmq4.NewContext()
 	socket, _ := context.NewSocket(zmq4.REP)
 	socket.Bind("tcp://*:5559")
 
+	// Deltas de membership publicados no tópico "membership"
+	pubSocket, _ := context.NewSocket(zmq4.PUB)
+	pubSocket.Bind("tcp://*:5562")
+
 	serdeFormat := os.Getenv("SERDE")
 	if serdeFormat == "" {
 		serdeFormat = "JSON"
 	}
 
 	return &ReferenceServer{
+		zmqContext:  context,
 		socket:      socket,
+		pubSocket:   pubSocket,
 		clock:       &LamportClock{},
 		servers:     make(map[string]*ServerInfo),
 		nextRank:    1,
+		ttl:         envMillis("MEMBERSHIP_TTL_MS", 30000),
+		peerPort:    envInt("PEER_PORT", 5560),
+		livenessIvl: envMillis("LIVENESS_INTERVAL_MS", 1000),
+		livenessMax: envMillis("LIVENESS_TIMEOUT_MS", 3000),
 		serdeFormat: serdeFormat,
 	}
 }
 
+// publishMembership anuncia entrada ou saída de um servidor.
+// Deve ser chamada com serversMutex travado (version é incrementada aqui).
+func (rs *ReferenceServer) publishMembership(event string, server *ServerInfo) {
+	rs.version++
+	payload, err := rs.serialize(Response{
+		Service: "membership",
+		Data: map[string]interface{}{
+			"event":     event,
+			"name":      server.Name,
+			"rank":      server.Rank,
+			"version":   rs.version,
+			"timestamp": time.Now().Unix(),
+			"clock":     rs.clock.Tick(),
+		},
+	})
+	if err != nil {
+		logger.Error("Erro ao serializar membership", "err", err)
+		return
+	}
+
+	rs.pubMutex.Lock()
+	defer rs.pubMutex.Unlock()
+	if _, err := rs.pubSocket.SendMessage("membership", payload); err != nil {
+		logger.Error("Erro ao publicar membership", "err", err)
+	}
+	logger.Info("Membership", "version", rs.version, "event", event, "server", server.Name, "rank", server.Rank)
+}
+
+// touch marca o servidor como visto e publica "join" se ele estava inativo.
+// Deve ser chamada com serversMutex travado.
+func (rs *ReferenceServer) touch(server *ServerInfo) {
+	server.LastSeen = time.Now()
+	if !server.Active {
+		server.Active = true
+		rs.publishMembership("join", server)
+	}
+}
+
+// reapLoop marca como inativos os servidores sem heartbeat dentro do TTL
+func (rs *ReferenceServer) reapLoop() {
+	ticker := time.NewTicker(rs.ttl / 4)
+	defer ticker.Stop()
+	for range ticker.C {
+		now := time.Now()
+		rs.serversMutex.Lock()
+		for _, server := range rs.servers {
+			if server.Active && now.Sub(server.LastSeen) >= rs.ttl {
+				server.Active = false
+				rs.publishMembership("leave", server)
+			}
+		}
+		rs.serversMutex.Unlock()
+	}
+}
+
+// markDown publica "leave" para um servidor ativo cuja conexão caiu
+func (rs *ReferenceServer) markDown(name string) {
+	rs.serversMutex.Lock()
+	defer rs.serversMutex.Unlock()
+	if server, exists := rs.servers[name]; exists && server.Active {
+		server.Active = false
+		rs.publishMembership("leave", server)
+	}
+}
+
+// watch mantém uma conexão só de presença com a porta de pares do servidor.
+// O heartbeat do ZMTP (PING/PONG, respondido pela própria libzmq) derruba a
+// conexão em LIVENESS_TIMEOUT_MS se o servidor parar; o monitor vê a queda e
+// o "leave" sai na hora, sem esperar o TTL. A reconexão é automática e o
+// "join" volta pelo heartbeat da aplicação (touch).
+func (rs *ReferenceServer) watch(name string) {
+	socket, err := rs.zmqContext.NewSocket(zmq4.DEALER)
+	if err != nil {
+		logger.Error("Erro ao criar socket de presença", "server", name, "err", err)
+		return
+	}
+	defer socket.Close()
+	socket.SetLinger(0)
+	socket.SetHeartbeatIvl(rs.livenessIvl)
+	socket.SetHeartbeatTimeout(rs.livenessMax)
+
+	endpoint := "inproc://presence-" + name
+	if err := socket.Monitor(endpoint, zmq4.EVENT_DISCONNECTED); err != nil {
+		logger.Error("Erro ao monitorar servidor", "server", name, "err", err)
+		return
+	}
+	monitor, err := rs.zmqContext.NewSocket(zmq4.PAIR)
+	if err != nil {
+		logger.Error("Erro ao criar monitor", "server", name, "err", err)
+		return
+	}
+	defer monitor.Close()
+	monitor.Connect(endpoint)
+	socket.Connect(fmt.Sprintf("tcp://%s:%d", name, rs.peerPort))
+
+	for {
+		event, _, _, err := monitor.RecvEvent(0)
+		if err != nil {
+			logger.Error("Erro no monitor de presença", "server", name, "err", err)
+			return
+		}
+		if event == zmq4.EVENT_DISCONNECTED {
+			logger.Info("Conexão com servidor perdida", "server", name)
+			rs.markDown(name)
+		}
+	}
+}
+
 func (rs *ReferenceServer) serialize(data interface{}) ([]byte, error) {
 	if rs.serdeFormat == "MSGPACK" {
 		return msgpack.Marshal(data)
@@ -121,7 +326,7 @@ func (rs *ReferenceServer) handleRank(data map[string]interface{}) Response {
 
 	// Check if server already exists
 	if server, exists := rs.servers[user]; exists {
-		server.LastSeen = time.Now()
+		rs.touch(server)
 		clock := rs.clock.Tick()
 		return Response{
 			Service: "rank",
@@ -136,14 +341,16 @@ func (rs *ReferenceServer) handleRank(data map[string]interface{}) Response {
 	// Register new server
 	rank := rs.nextRank
 	rs.nextRank++
-	rs.servers[user] = &ServerInfo{
-		Name:     user,
-		Rank:     rank,
-		LastSeen: time.Now(),
+	server := &ServerInfo{
+		Name: user,
+		Rank: rank,
 	}
+	rs.servers[user] = server
+	rs.touch(server)
+	go rs.watch(user)
 
 	clock := rs.clock.Tick()
-	log.Printf("Servidor %s registrado com rank %d", user, rank)
+	logger.Info("Servidor registrado", "server", user, "rank", rank)
 
 	return Response{
 		Service: "rank",
@@ -159,12 +366,11 @@ func (rs *ReferenceServer) handleList(data map[string]interface{}) Response {
 	rs.serversMutex.RLock()
 	defer rs.serversMutex.RUnlock()
 
-	// Clean up old servers (no heartbeat for more than 30 seconds)
-	now := time.Now()
+	// Servidores inativos (sem heartbeat dentro do TTL) ficam fora da lista
 	activeServers := make([]map[string]interface{}, 0)
 
 	for _, server := range rs.servers {
-		if now.Sub(server.LastSeen) < 30*time.Second {
+		if server.Active {
 			activeServers = append(activeServers, map[string]interface{}{
 				"name": server.Name,
 				"rank": server.Rank,
@@ -182,6 +388,7 @@ func (rs *ReferenceServer) handleList(data map[string]interface{}) Response {
 		Service: "list",
 		Data: map[string]interface{}{
 			"list":      activeServers,
+			"version":   rs.version,
 			"timestamp": time.Now().Unix(),
 			"clock":     clock,
 		},
@@ -207,7 +414,7 @@ func (rs *ReferenceServer) handleHeartbeat(data map[string]interface{}) Response
 	defer rs.serversMutex.Unlock()
 
 	if server, exists := rs.servers[user]; exists {
-		server.LastSeen = time.Now()
+		rs.touch(server)
 		clock := rs.clock.Tick()
 		return Response{
 			Service: "heartbeat",
@@ -231,6 +438,29 @@ func (rs *ReferenceServer) handleHeartbeat(data map[string]interface{}) Response
 	}
 }
 
+func (rs *ReferenceServer) handleLeave(data map[string]interface{}) Response {
+	user, _ := data["user"].(string)
+
+	rs.serversMutex.Lock()
+	defer rs.serversMutex.Unlock()
+
+	// Saída voluntária: anuncia sem esperar o TTL
+	if server, exists := rs.servers[user]; exists && server.Active {
+		server.Active = false
+		rs.publishMembership("leave", server)
+	}
+
+	clock := rs.clock.Tick()
+	return Response{
+		Service: "leave",
+		Data: map[string]interface{}{
+			"status":    "OK",
+			"timestamp": time.Now().Unix(),
+			"clock":     clock,
+		},
+	}
+}
+
 func (rs *ReferenceServer) processRequest(request Request) Response {
 	// Update clock if received
 	if clockVal, ok := request.Data["clock"]; ok {
@@ -246,6 +476,8 @@ func (rs *ReferenceServer) processRequest(request Request) Response {
 		return rs.handleList(request.Data)
 	case "heartbeat":
 		return rs.handleHeartbeat(request.Data)
+	case "leave":
+		return rs.handleLeave(request.Data)
 	default:
 		clock := rs.clock.Tick()
 		return Response{
@@ -261,35 +493,37 @@ func (rs *ReferenceServer) processRequest(request Request) Response {
 }
 
 func (rs *ReferenceServer) run() {
-	log.Printf("Servidor de referência iniciado (SERDE=%s). Aguardando conexões...", rs.serdeFormat)
+	logger.Info("Servidor de referência iniciado. Aguardando conexões...", "serde", rs.serdeFormat)
+	go rs.reapLoop()
 
 	for {
 		msg, err := rs.socket.RecvBytes(0)
 		if err != nil {
-			log.Printf("Erro ao receber mensagem: %v", err)
+			logger.Error("Erro ao receber mensagem", "err", err)
 			continue
 		}
 
 		var request Request
 		if err := rs.deserialize(msg, &request); err != nil {
-			log.Printf("Erro ao desserializar: %v", err)
+			logger.Error("Erro ao desserializar", "err", err)
 			continue
 		}
 
-		log.Printf("Recebido (clock=%d): %+v", rs.clock.GetTime(), request)
-
 		response := rs.processRequest(request)
 
-		log.Printf("Enviando (clock=%d): %+v", rs.clock.GetTime(), response)
+		if traceEnabled() {
+			logger.Debug("requisição", "clock", rs.clock.GetTime(), "service", request.Service,
+				"request", request.Data, "response", response.Data)
+		}
 
 		responseBytes, err := rs.serialize(response)
 		if err != nil {
-			log.Printf("Erro ao serializar resposta: %v", err)
+			logger.Error("Erro ao serializar resposta", "err", err)
 			continue
 		}
 
 		if _, err := rs.socket.SendBytes(responseBytes, 0); err != nil {
-			log.Printf("Erro ao enviar resposta: %v", err)
+			logger.Error("Erro ao enviar resposta", "err", err)
 		}
 	}
 }
@@ -0,0 +1,209 @@
+import os
+import time
+import signal
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import zmq
+import zmq.asyncio
+from serde import serializer
+from main import Server, log
+from logs import kv
+from broker_link import BrokerLink, HEARTBEAT_INTERVAL, server_capacity
+from reference import AsyncReferenceClient, reference_client
+from peers import scatter_async
+
+
+async def wait_event(event: asyncio.Event, timeout: float) -> bool:
+    """`event.wait()` com prazo; True se o evento foi sinalizado"""
+    try:
+        await asyncio.wait_for(event.wait(), timeout)
+        return True
+    except asyncio.TimeoutError:
+        return False
+
+
+class AsyncServer(Server):
+    """Engine asyncio do servidor (SERVER_ENGINE=asyncio).
+
+    Multiplexa os sockets REP, PUB, SUB e de referência em um único event
+    loop (`zmq.asyncio`) no lugar das threads de heartbeat, eleição e
+    replicação. Referência, eleição e Berkeley usam sockets `zmq.asyncio`
+    e `asyncio.Event` no mesmo loop. As escritas em disco vão para um
+    executor de uma thread, preservando a ordem. O protocolo na rede é o
+    mesmo da engine padrão.
+    """
+
+    def __init__(self, server_name: str = None):
+        super().__init__(server_name)
+        # O cliente síncrono (self.reference) fica só para o `leave` no encerramento
+        self.async_reference = reference_client(AsyncReferenceClient, context=self.context)
+
+    def _new_event(self):
+        return asyncio.Event()
+
+    def _init_sockets(self):
+        self.workers = 1
+        self.context = zmq.asyncio.Context()
+
+        self.socket = self.context.socket(zmq.DEALER)
+        self.socket.setsockopt(zmq.IDENTITY, self.server_name.encode('utf-8'))
+        self.socket.connect("tcp://broker:5556")
+
+        self.pub_sockets = []
+        for i in range(len(self.shards)):
+            pub_socket = self.context.socket(zmq.PUB)
+            pub_socket.connect(self.shards.pub_endpoint(i))
+            self.pub_sockets.append(pub_socket)
+
+        self.rep_socket = self.context.socket(zmq.SUB)
+        for endpoint in self.shards.sub_endpoints(["replication", "servers"]):
+            self.rep_socket.connect(endpoint)
+        self.rep_socket.setsockopt_string(zmq.SUBSCRIBE, "replication")
+        self.rep_socket.setsockopt_string(zmq.SUBSCRIBE, "servers")
+        self.rep_socket.connect(os.getenv("REFERENCE_PUB_ENDPOINT", "tcp://reference:5562"))
+        self.rep_socket.setsockopt_string(zmq.SUBSCRIBE, "membership")
+
+        self.peer_socket = self.context.socket(zmq.REP)
+        self.peer_socket.bind(f"tcp://*:{self.peer_port}")
+
+    def start_maintenance_threads(self):
+        """Manutenção roda como tasks do event loop (ver `_main`)"""
+        self.persist_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="persist")
+        # O catch-up usa socket síncrono próprio e só escreve via executor
+        self._start_thread(self.catchup_loop)
+
+
+    async def _serve(self):
+        while True:
+            request = BrokerLink.parse(await self.socket.recv_multipart(copy=False))
+            if request:
+                envelope, raw_message = request
+                await self.socket.send_multipart(BrokerLink.reply_frames(envelope, self.handle_request(raw_message)))
+
+    async def _broker_heartbeat(self):
+        """READY inicial e HEARTBEAT periódico para o broker"""
+        link = BrokerLink(self.socket, server_capacity(1))
+        link.ready()
+        while True:
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            link.heartbeat_if_due()
+
+    async def _heartbeat(self):
+        last_list = 0.0
+        while True:
+            try:
+                if not self.rank:
+                    response = await self.async_reference.call(self._reference_request("rank"))
+                    if not self._on_rank_response(response):
+                        await asyncio.sleep(5)
+                        continue
+
+                response = await self.async_reference.call(self._reference_request("heartbeat"))
+                self._on_heartbeat_response(response)
+
+                if self._list_due(last_list):
+                    response = await self.async_reference.list_servers(self._reference_request("list"))
+                    if response:
+                        self._on_list_response(response)
+                    last_list = time.time()
+
+            except Exception as e:
+                log.warning("Erro no heartbeat: %s", e)
+                self.rank = None  # Forçar re-registro
+
+            await asyncio.sleep(self.heartbeat_interval)
+
+    async def _election(self):
+        while True:
+            if await wait_event(self.membership_event, 5):
+                self.membership_event.clear()
+            if self.election_needed():
+                log.info("Iniciando eleição", extra=kv(coordinator=self.coordinator))
+                await self._start_election()
+
+    async def _start_election(self):
+        """Mesma regra de `start_election`, com os pares consultados no event loop"""
+        if await self._run_election_async():
+            self._become_coordinator()
+
+    async def _run_election_async(self) -> bool:
+        """Rodadas do Bully de `_run_election` sem bloquear o loop"""
+        for _ in range(self.election_rounds):
+            higher, request = self._election_request()
+            if not higher:
+                return True
+            replies = await scatter_async(self.context, higher, self.peer_port, request,
+                                          self.election_timeout_ms, first_only=True)
+            if not self._on_election_replies(replies):
+                return True
+            if await wait_event(self.coordinator_announced, self.election_wait) and self._superior_announced():
+                return False
+        return True
+
+    async def _replication(self):
+        while True:
+            try:
+                [topic, message_raw] = await self.rep_socket.recv_multipart()
+                self.handle_replication_frame(topic, message_raw)
+            except Exception as e:
+                log.error("Erro no listener de replicação: %s", e)
+                await asyncio.sleep(1)
+
+    async def _peer(self):
+        while True:
+            try:
+                request, fmt = serializer.decode(await self.peer_socket.recv(copy=False))
+                await self.peer_socket.send(serializer.serialize(self.handle_peer_request(request), fmt))
+            except Exception as e:
+                log.error("Erro no listener de servidores: %s", e)
+
+    async def _berkeley(self):
+        """Rodadas de Berkeley agendadas por `check_berkeley_sync`"""
+        while True:
+            if not await wait_event(self.berkeley_due, 5):
+                continue
+            self.berkeley_due.clear()
+            if self.coordinator == self.server_name:
+                try:
+                    peers, request = self._berkeley_request()
+                    if peers:
+                        replies = await scatter_async(self.context, peers, self.peer_port, request,
+                                                      self.berkeley_timeout_ms)
+                        adjustments = self._berkeley_adjustments(peers, replies)
+                        if adjustments:
+                            self._broadcast_adjustments(adjustments)
+                except Exception as e:
+                    log.warning("Erro na sincronização Berkeley: %s", e)
+            await asyncio.sleep(self.berkeley_min_interval)
+
+    async def _replication_flush(self):
+        delay = self.replication_batcher.max_delay or 0.005
+        while True:
+            await asyncio.sleep(delay)
+            self.replication_batcher.flush_due()
+
+    async def _main(self):
+        work = asyncio.gather(self._serve(), self._heartbeat(), self._election(),
+                              self._replication(), self._replication_flush(), self._peer(),
+                              self._broker_heartbeat(), self._berkeley())
+        # `docker stop`: cancela as tasks; os sockets só fecham depois, em `close`
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, work.cancel)
+        try:
+            await work
+        except asyncio.CancelledError:
+            log.info("SIGTERM recebido; encerrando")
+
+    def run(self):
+        """Loop principal do servidor (asyncio)"""
+        log.info("Servidor iniciado. Aguardando conexões...",
+                 extra=kv(serde=serializer.format, engine="asyncio", server=self.server_name))
+        try:
+            asyncio.run(self._main())
+        except KeyboardInterrupt:
+            log.info("Servidor interrompido.")
+        finally:
+            self.close()
+
+    def close(self):
+        self.async_reference.close()
+        super().close()
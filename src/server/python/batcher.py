@@ -0,0 +1,91 @@
+import time
+import threading
+from typing import Callable, Dict, List, Any
+from logs import get_logger
+
+log = get_logger("batcher")
+
+
+class ReplicationBatcher:
+    """Agrupa eventos de replicação em lotes limitados por tamanho ou tempo.
+
+    Cada lote leva `server_id`, um número de lote por origem (`batch_seq`)
+    e a lista de eventos (cada um com sua `seq`). O lote é enviado quando
+    atinge `max_events` ou quando o evento mais antigo espera `max_delay_ms`.
+    """
+
+    def __init__(self, server_id: int, send: Callable[[Dict[str, Any]], None],
+                 max_events: int = 64, max_delay_ms: int = 5,
+                 now: Callable[[], float] = time.time):
+        self.server_id = server_id
+        self.send = send
+        self.now = now  # relógio dos timestamps emitidos (com ajuste Berkeley)
+        self.max_events = max(max_events, 1)
+        self.max_delay = max(max_delay_ms, 0) / 1000.0
+        self.batch_seq = 0
+
+        self._lock = threading.Lock()
+        self._events: List[Dict[str, Any]] = []
+        self._first_at = 0.0
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Inicia a thread que envia lotes vencidos"""
+        if self.max_delay > 0:
+            self._thread = threading.Thread(target=self._flush_loop, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Encerra a thread de envio (o lote pendente fica para `flush`)"""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def add(self, event: Dict[str, Any]):
+        with self._lock:
+            if not self._events:
+                self._first_at = time.time()
+            self._events.append(event)
+            if len(self._events) >= self.max_events or self.max_delay == 0:
+                self._send()
+
+    def add_many(self, events: List[Dict[str, Any]]):
+        """Adiciona vários eventos e envia tudo (com o pendente) em um único lote,
+        mesmo acima de `max_events`"""
+        with self._lock:
+            self._events.extend(events)
+            self._send()
+
+    def flush(self):
+        """Envia o lote pendente, se houver"""
+        with self._lock:
+            self._send()
+
+    def flush_due(self):
+        """Envia o lote pendente se o prazo do evento mais antigo venceu"""
+        with self._lock:
+            if self._events and time.time() - self._first_at >= self.max_delay:
+                self._send()
+
+    def _send(self):
+        """Monta e envia o lote (chamar com lock)"""
+        if not self._events:
+            return
+        self.batch_seq += 1
+        batch = {
+            "type": "batch",
+            "server_id": self.server_id,
+            "batch_seq": self.batch_seq,
+            "events": self._events,
+            "timestamp": self.now()
+        }
+        self._events = []
+        self.send(batch)
+
+    def _flush_loop(self):
+        while not self._stopped.wait(self.max_delay):
+            try:
+                self.flush_due()
+            except Exception as e:
+                log.error("Erro ao enviar lote de replicação: %s", e)
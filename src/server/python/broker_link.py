@@ -0,0 +1,54 @@
+import os
+import time
+from typing import List, Optional, Tuple
+import zmq
+
+# Protocolo broker <-> servidor (mesmos valores de broker/python/main.py)
+READY = b"\x01"      # [READY, capacidade]
+REQUEST = b"\x02"    # [REQUEST, envelope..., payload]
+REPLY = b"\x03"      # [REPLY, envelope..., payload]
+HEARTBEAT = b"\x04"  # [HEARTBEAT, capacidade]
+
+HEARTBEAT_INTERVAL = int(os.getenv("BROKER_HEARTBEAT_MS", "1000")) / 1000.0
+
+
+class BrokerLink:
+    """Lado do servidor no protocolo com o broker, sobre um socket DEALER.
+
+    O servidor se anuncia com READY informando quantas requisições aceita
+    em paralelo (`capacity`) e envia HEARTBEAT periódico para que o broker
+    o mantenha como vivo.
+    """
+
+    def __init__(self, socket: zmq.Socket, capacity: int):
+        self.socket = socket
+        self.capacity = str(capacity).encode()
+        self.next_heartbeat = 0.0
+
+    def ready(self):
+        self.socket.send_multipart([READY, self.capacity])
+        self.next_heartbeat = time.time() + HEARTBEAT_INTERVAL
+
+    def heartbeat_if_due(self):
+        if time.time() >= self.next_heartbeat:
+            self.socket.send_multipart([HEARTBEAT, self.capacity])
+            self.next_heartbeat = time.time() + HEARTBEAT_INTERVAL
+
+    @staticmethod
+    def parse(frames: List) -> Optional[Tuple[List, object]]:
+        """Extrai (envelope, payload) de um REQUEST; None para outros comandos"""
+        if len(frames) < 3 or bytes(frames[0]) != REQUEST:
+            return None
+        return frames[1:-1], frames[-1]
+
+    @staticmethod
+    def reply_frames(envelope: List, payload: bytes) -> List:
+        return [REPLY] + envelope + [payload]
+
+    def reply(self, envelope: List, payload: bytes):
+        self.socket.send_multipart(self.reply_frames(envelope, payload))
+
+
+def server_capacity(workers: int) -> int:
+    """Requisições em paralelo anunciadas ao broker (SERVER_CAPACITY)"""
+    return int(os.getenv("SERVER_CAPACITY", str(4 * max(workers, 1))))
@@ -0,0 +1,101 @@
+import json
+from typing import Dict, List, Any, Optional, Tuple
+from registry import Registry
+from msglog import MessageLog
+
+# Ordem das fases da transferência: snapshot dos registros e depois os logs
+PHASES = ("users", "channels", "publish", "message")
+
+# Tipo de evento de replicação correspondente a cada fase
+EVENT_TYPES = {"users": "user_login", "channels": "channel_create",
+               "publish": "message_publish", "message": "message_send"}
+
+
+def _next_phase(phase: str) -> Optional[Dict[str, Any]]:
+    index = PHASES.index(phase) + 1
+    if index >= len(PHASES):
+        return None
+    return {"phase": PHASES[index]}
+
+
+def _wanted(record: Dict[str, Any], origin: Any, watermarks: Dict[str, int], full: bool) -> bool:
+    """Indica se o solicitante ainda não tem o registro"""
+    seq = record.get("seq")
+    if seq is None:
+        return full  # registro antigo, sem origem: só em transferência completa
+    if str(record.get("origin")) == str(origin):
+        return full
+    return seq > watermarks.get(str(record.get("origin")), 0)
+
+
+def read_chunk(registries: Dict[str, Registry], message_logs: Dict[str, MessageLog],
+               cursor: Dict[str, Any], origin: Any, watermarks: Dict[str, int],
+               full: bool, limit: int = 500
+               ) -> Tuple[List[Dict[str, Any]], Optional[Dict[str, Any]], Dict[str, Any]]:
+    """Lê um bloco a partir do cursor.
+
+    Retorna (registros, próximo cursor ou None, posição alcançada na fase).
+    A posição (`index` ou `segment`/`offset`) é guardada pelo solicitante e
+    enviada no cursor do próximo catch-up, que recomeça dali em vez do início.
+    """
+    phase = cursor.get("phase", PHASES[0])
+
+    if phase in registries:
+        start = cursor.get("index", 0)
+        chunk = registries[phase].slice(start, limit)
+        records = [record for record in chunk if _wanted(record, origin, watermarks, full)]
+        position = {"index": start + len(chunk)}
+        if len(chunk) < limit:
+            return records, _next_phase(phase), position
+        return records, dict(position, phase=phase), position
+
+    message_log = message_logs[phase]
+    message_log.flush()  # torna visíveis as linhas ainda no buffer
+
+    segment = cursor.get("segment", 0)
+    offset = cursor.get("offset", 0)
+    records = []
+    scanned = 0
+    for current in message_log.segments():
+        if current < segment:
+            continue
+        if current != segment:
+            segment, offset = current, 0
+        with open(message_log.segment_path(current), 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break  # linha ainda sendo escrita
+                offset += len(line)
+                scanned += 1
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if _wanted(record, origin, watermarks, full):
+                    records.append(record)
+                if scanned >= limit:
+                    position = {"segment": segment, "offset": offset}
+                    return records, dict(position, phase=phase), position
+
+    return records, _next_phase(phase), {"segment": segment, "offset": offset}
+
+
+def record_to_event(phase: str, record: Dict[str, Any]) -> Dict[str, Any]:
+    """Converte registro recebido (registro de usuário/canal ou linha de log) em evento aplicável"""
+    if phase == "users":
+        data = {"user": record["name"], "timestamp": record.get("login_timestamp")}
+    elif phase == "channels":
+        data = {"channel": record["name"], "timestamp": record.get("created_timestamp")}
+    else:
+        data = record
+    event = {
+        "type": EVENT_TYPES[phase],
+        "server_id": record.get("origin"),
+        "clock": record.get("clock", 0),
+        "data": data,
+        "timestamp": data.get("timestamp")
+    }
+    if record.get("seq") is not None:
+        event["seq"] = record["seq"]
+    return event
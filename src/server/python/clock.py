@@ -1,17 +1,41 @@
+import threading
+
+
 class LamportClock:
+    """Relógio lógico de Lamport compartilhado entre threads.
+
+    Escritas (`tick`, `update`, `reserve`) são serializadas por um lock e
+    nunca repetem valor. Leituras (`get_time`) não travam: ler o inteiro é
+    atômico no CPython e o valor só cresce.
+    """
+
     def __init__(self):
         self.time = 0
+        self._lock = threading.Lock()
 
-    def tick(self):
+    def tick(self) -> int:
         """Incrementa o relógio antes de enviar uma mensagem"""
-        self.time += 1
-        return self.time
+        with self._lock:
+            self.time += 1
+            return self.time
+
+    def reserve(self, count: int) -> int:
+        """Reserva `count` ticks consecutivos de uma vez; retorna o primeiro.
 
-    def update(self, received_time: int):
+        Operações em lote usam `first, first + 1, ..., first + count - 1`
+        sem voltar ao lock a cada mensagem.
+        """
+        with self._lock:
+            first = self.time + 1
+            self.time += max(count, 1)
+            return first
+
+    def update(self, received_time: int) -> int:
         """Atualiza o relógio ao receber uma mensagem"""
-        self.time = max(self.time, received_time) + 1
-        return self.time
+        with self._lock:
+            self.time = max(self.time, received_time) + 1
+            return self.time
 
-    def get_time(self):
-        """Retorna o tempo atual sem modificar"""
+    def get_time(self) -> int:
+        """Retorna o tempo atual sem modificar (sem lock)"""
         return self.time
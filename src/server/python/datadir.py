@@ -0,0 +1,149 @@
+import os
+import re
+import json
+import time
+import fcntl
+import shutil
+import itertools
+from typing import IO, Dict, List, Optional, Tuple
+from logs import get_logger, kv
+
+log = get_logger("datadir")
+
+# Arquivos de metadados (snapshot + log) do layout compartilhado antigo
+METADATA_FILES = ("users.json", "users.log", "channels.json", "channels.log")
+MESSAGE_LOGS = ("publishs", "messages")
+# Marca de que o layout compartilhado já foi importado (uma única vez)
+MIGRATED = "MIGRATED"
+
+
+def claim_namespace(base: str, namespace: Optional[str] = None) -> Tuple[str, IO]:
+    """Reserva o diretório de dados da réplica com um flock em `replicas/<nome>.lock`.
+
+    Com `namespace` (DATA_NAMESPACE/SERVER_NAME), reserva esse nome. Sem
+    ele, usa o primeiro `replica-<n>` livre: o container recriado (hostname
+    novo) retoma o diretório de uma réplica que saiu, em vez de abrir outro.
+    O lock fica com o processo; devolve (nome, arquivo do lock).
+    """
+    root = os.path.join(base, "replicas")
+    os.makedirs(root, exist_ok=True)
+    names = [namespace] if namespace else (f"replica-{i}" for i in itertools.count())
+    for name in names:
+        lock = open(os.path.join(root, f"{name}.lock"), 'a+')
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock.close()
+            continue
+        lock.seek(0)
+        lock.truncate()
+        lock.write(os.getenv("HOSTNAME", str(os.getpid())))
+        lock.flush()
+        return name, lock
+    raise RuntimeError(f"Diretório de dados '{namespace}' em uso por outro servidor")
+
+
+def replica_data_dir(base: str, namespace: str, server_id: int) -> str:
+    """Diretório de dados exclusivo da réplica (`<base>/replicas/<namespace>`).
+
+    Enquanto `replicas/MIGRATED` não existe, um diretório novo importa o
+    layout compartilhado antigo (`<base>/users.json`, `<base>/messages/`, ...);
+    depois disso, réplicas novas começam vazias e recebem os dados pelo
+    catch-up. O diretório é montado em um temporário e renomeado no fim, de
+    modo que uma importação interrompida é refeita por inteiro.
+    """
+    path = os.path.join(base, "replicas", namespace)
+    if os.path.isdir(path):
+        return path
+
+    marker = os.path.join(base, "replicas", MIGRATED)
+    if os.path.exists(marker):
+        os.makedirs(path)
+        return path
+
+    staging = f"{path}.import-{os.getpid()}"
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+
+    imported: Dict[str, int] = {}
+    for filename in METADATA_FILES:
+        source = os.path.join(base, filename)
+        if os.path.isfile(source):
+            shutil.copy2(source, os.path.join(staging, filename))
+            imported[filename] = 1
+
+    watermarks: Dict[str, int] = {}
+    for name in MESSAGE_LOGS:
+        count = _import_message_log(os.path.join(base, "messages"), os.path.join(staging, "messages"),
+                                    name, watermarks)
+        if count:
+            imported[name] = count
+
+    state_file = f"replication.{namespace}.json"
+    if os.path.isfile(os.path.join(base, state_file)):
+        shutil.copy2(os.path.join(base, state_file), os.path.join(staging, state_file))
+    elif watermarks:
+        # Sem estado próprio: o que foi importado conta como já aplicado (o
+        # catch-up não busca de novo) e a sequência local continua acima dele
+        with open(os.path.join(staging, state_file), 'w', encoding='utf-8') as f:
+            json.dump({"reserved": watermarks.get(str(server_id), 0),
+                       "watermarks": watermarks, "pending": {}}, f)
+
+    os.rename(staging, path)
+    if imported:
+        log.info("Dados importados do layout compartilhado", extra=kv(dir=path, **imported))
+    with open(marker, 'a', encoding='utf-8') as f:
+        f.write(f"{namespace} {time.time():.0f}\n")
+    return path
+
+
+def _legacy_segments(directory: str, name: str) -> List[str]:
+    """Arquivos de um log de mensagens antigo em ordem (arquivo único e segmentos)"""
+    if not os.path.isdir(directory):
+        return []
+    pattern = re.compile(rf"^{re.escape(name)}\.(\d+)\.jsonl$")
+    segments: List[Tuple[int, str]] = []
+    for filename in os.listdir(directory):
+        match = pattern.match(filename)
+        if match:
+            segments.append((int(match.group(1)), filename))
+    files = [os.path.join(directory, filename) for _, filename in sorted(segments)]
+    single = os.path.join(directory, f"{name}.jsonl")
+    if os.path.isfile(single):
+        files.insert(0, single)
+    return files
+
+
+def _import_message_log(source_dir: str, target_dir: str, name: str, watermarks: Dict[str, int]) -> int:
+    """Copia um log de mensagens sem as duplicatas do layout compartilhado.
+
+    Cada réplica gravava a própria mensagem e de novo a cópia replicada; a
+    chave é (origem, seq) ou, em registros sem `seq`, o próprio conteúdo.
+    O índice de histórico não é copiado: é refeito ao abrir o log.
+    """
+    files = _legacy_segments(source_dir, name)
+    if not files:
+        return 0
+    os.makedirs(target_dir, exist_ok=True)
+    seen = set()
+    count = 0
+    with open(os.path.join(target_dir, f"{name}.000001.jsonl"), 'wb') as out:
+        for filepath in files:
+            with open(filepath, 'rb') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # linha parcial de uma gravação interrompida
+                    if record.get("seq") is not None and record.get("origin") is not None:
+                        origin = str(record["origin"])
+                        key = (origin, record["seq"])
+                        watermarks[origin] = max(watermarks.get(origin, 0), int(record["seq"]))
+                    else:
+                        key = json.dumps(record, sort_keys=True)
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                    out.write(line if line.endswith(b"\n") else line + b"\n")
+                    count += 1
+    return count
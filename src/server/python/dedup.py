@@ -0,0 +1,156 @@
+import os
+import json
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Set, Tuple, Any
+
+
+class ReplicationState:
+    """Deduplicação limitada de eventos de replicação por origem.
+
+    Cada servidor numera seus eventos com uma sequência própria (`seq`).
+    Para cada origem guardamos a marca d'água (maior `seq` contígua já
+    aplicada) e um pequeno conjunto de sequências aplicadas fora de ordem
+    acima dela. Se esse conjunto passar de `window`, `mark_applied` pede um
+    catch-up daquela origem em vez de dar as lacunas por vistas; só depois de
+    um catch-up concluído as lacunas que o par também não tinha são puladas
+    (`skip_gaps`), de modo que nada que ainda exista fica para trás.
+
+    O estado é salvo em disco junto com os dados. A sequência local é
+    reservada em blocos de `reserve`, para que um restart nunca reutilize
+    números já enviados.
+    """
+
+    def __init__(self, filepath: str, window: int = 1024, reserve: int = 1000,
+                 legacy_capacity: int = 10000):
+        self.filepath = filepath
+        self.window = window
+        self.reserve = reserve
+        self.legacy_capacity = legacy_capacity
+
+        self._lock = threading.Lock()
+        self.watermarks: Dict[str, int] = {}
+        self.pending: Dict[str, Set[int]] = {}
+        self.seq = 0
+        self._reserved = 0
+        self._dirty = False
+        # Eventos sem `seq` (servidores antigos): LRU de (clock, server_id)
+        self._legacy: "OrderedDict[Tuple[Any, Any], None]" = OrderedDict()
+
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.filepath):
+            return
+        try:
+            with open(self.filepath, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return
+        self.watermarks = {str(k): int(v) for k, v in state.get("watermarks", {}).items()}
+        self.pending = {str(k): set(v) for k, v in state.get("pending", {}).items()}
+        # Retoma após o bloco reservado: números dentro dele podem já ter sido usados
+        self.seq = self._reserved = int(state.get("reserved", 0))
+
+    def next_seq(self) -> int:
+        """Próxima sequência para um evento originado aqui"""
+        with self._lock:
+            self.seq += 1
+            if self.seq > self._reserved:
+                self._reserved = self.seq + self.reserve
+                self._save()
+            return self.seq
+
+    def is_applied(self, origin: Any, seq: int) -> bool:
+        origin = str(origin)
+        with self._lock:
+            return seq <= self.watermarks.get(origin, 0) or seq in self.pending.get(origin, ())
+
+    def mark_applied(self, origin: Any, seq: int) -> bool:
+        """Marca (origem, seq) como aplicado; True se as lacunas da origem passaram
+        de `window` e é preciso um catch-up para preenchê-las"""
+        origin = str(origin)
+        with self._lock:
+            watermark = self.watermarks.get(origin, 0)
+            if seq <= watermark:
+                return False
+            pending = self.pending.setdefault(origin, set())
+            pending.add(seq)
+
+            # Avança a marca d'água enquanto houver sequência contígua
+            while watermark + 1 in pending:
+                watermark += 1
+                pending.remove(watermark)
+
+            self.watermarks[origin] = watermark
+            if not pending:
+                del self.pending[origin]
+            self._dirty = True
+            return len(pending) > self.window
+
+    def gaps(self) -> Dict[str, int]:
+        """Por origem com lacunas além de `window`, a maior seq pendente (limite para `skip_gaps`)"""
+        with self._lock:
+            return {origin: max(pending) for origin, pending in self.pending.items()
+                    if len(pending) > self.window}
+
+    def skip_gaps(self, limits: Dict[str, int]) -> Dict[str, List[int]]:
+        """Após um catch-up concluído: lacunas abaixo de `limits` (de `gaps()`, tomado
+        antes do catch-up) não existem no par e passam a contar como vistas (ex.: `seq`
+        reservadas e não usadas antes de um restart). Devolve as sequências puladas."""
+        skipped: Dict[str, List[int]] = {}
+        with self._lock:
+            for origin, limit in limits.items():
+                pending = self.pending.get(origin)
+                if not pending:
+                    continue
+                watermark = self.watermarks.get(origin, 0)
+                missing = [seq for seq in range(watermark + 1, limit) if seq not in pending]
+                if missing:
+                    skipped[origin] = missing
+                watermark = max(watermark, limit)
+                pending.difference_update(range(self.watermarks.get(origin, 0) + 1, limit + 1))
+                while watermark + 1 in pending:
+                    watermark += 1
+                    pending.remove(watermark)
+                self.watermarks[origin] = watermark
+                if not pending:
+                    del self.pending[origin]
+                self._dirty = True
+        return skipped
+
+    def seen_legacy(self, key: Tuple[Any, Any]) -> bool:
+        """Deduplicação de eventos sem `seq`; registra a chave e diz se já existia"""
+        with self._lock:
+            if key in self._legacy:
+                self._legacy.move_to_end(key)
+                return True
+            self._legacy[key] = None
+            if len(self._legacy) > self.legacy_capacity:
+                self._legacy.popitem(last=False)
+            return False
+
+    def maybe_save(self):
+        """Salva o estado se houver mudanças"""
+        with self._lock:
+            if self._dirty:
+                self._save()
+
+    def save(self):
+        with self._lock:
+            self._save()
+
+    def _save(self):
+        """Gravação atômica do estado (chamar com lock)"""
+        state = {
+            "reserved": self._reserved,
+            "watermarks": self.watermarks,
+            "pending": {k: sorted(v) for k, v in self.pending.items()},
+        }
+        tmp_file = self.filepath + ".tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.filepath)
+        self._dirty = False
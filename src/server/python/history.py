@@ -0,0 +1,312 @@
+import os
+import json
+import struct
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import IO, Dict, List, Any, Optional, Tuple
+from msglog import MessageLog
+from logs import get_logger
+
+log = get_logger("history")
+
+# clock, timestamp, segmento, offset
+ENTRY = struct.Struct("<QdIQ")
+Entry = Tuple[int, float, int, int]
+
+
+def conversation_key(a: str, b: str) -> str:
+    """Chave de conversa privada independente da direção"""
+    return "\x00".join(sorted((a, b)))
+
+
+class HistoryIndex:
+    """Índice em disco de offsets por canal/conversa sobre um MessageLog.
+
+    Cada chave (canal ou par de usuários) tem um arquivo `<sha1>.idx` com
+    entradas de tamanho fixo (clock, timestamp, segmento, offset), mantidas
+    em ordem de clock. Uma consulta acha o início do intervalo por busca
+    binária no índice, lê só as entradas até `limit` e faz seek direto nas
+    linhas selecionadas dos segmentos, sem varrer o log inteiro.
+
+    As entradas ficam em memória até `flush_every` e são gravadas em lote,
+    com até `open_files` arquivos de índice abertos (LRU); uma entrada que
+    chega fora de ordem (clock menor que o fim do arquivo) reescreve só a
+    cauda a partir do ponto de inserção. O arquivo `CHECKPOINT` guarda a
+    última posição indexada para que, após uma queda, o final do log seja
+    reindexado na inicialização.
+    """
+
+    def __init__(self, message_log: MessageLog, key_field: str, flush_every: int = 256,
+                 open_files: Optional[int] = None):
+        self.message_log = message_log
+        self.key_field = key_field
+        self.flush_every = flush_every
+        self.directory = os.path.join(message_log.directory, "index", message_log.name)
+        self.checkpoint_file = os.path.join(self.directory, "CHECKPOINT")
+        self.sorted_marker = os.path.join(self.directory, "SORTED")
+        os.makedirs(self.directory, exist_ok=True)
+
+        if open_files is None:
+            open_files = int(os.getenv("HISTORY_OPEN_FILES", "256"))
+        self.open_files = max(open_files, 1)
+        self._lock = threading.Lock()
+        self._handles: "OrderedDict[str, IO[bytes]]" = OrderedDict()
+        self._pending: Dict[str, List[Entry]] = {}
+        self._pending_count = 0
+        self._last_position: Optional[Tuple[int, int]] = None
+
+        self._recover()
+
+    def key_for(self, record: Dict[str, Any]) -> Optional[str]:
+        if self.key_field == "conversation":
+            if record.get("src") and record.get("dst"):
+                return conversation_key(record["src"], record["dst"])
+            return None
+        return record.get(self.key_field)
+
+    def _index_path(self, key: str) -> str:
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, f"{digest}.idx")
+
+    def add(self, record: Dict[str, Any], position: Tuple[int, int]):
+        """Indexa registro gravado em (segmento, offset)"""
+        key = self.key_for(record)
+        if key is None:
+            return
+        entry = (int(record.get("clock") or 0), float(record.get("timestamp") or 0),
+                 position[0], position[1])
+        with self._lock:
+            self._pending.setdefault(key, []).append(entry)
+            self._pending_count += 1
+            self._last_position = position
+            if self._pending_count >= self.flush_every:
+                self._flush()
+
+    def _flush(self):
+        """Grava entradas pendentes e o checkpoint (chamar com lock)"""
+        if not self._pending:
+            return
+        # As linhas indexadas vão para o segmento antes das entradas: o índice
+        # nunca aponta para além do que está no arquivo
+        self.message_log.flush()
+        for key, entries in self._pending.items():
+            self._write_entries(self._handle(key), sorted(entries))
+        self._pending.clear()
+        self._pending_count = 0
+        self._write_checkpoint(self._last_position)
+
+    def _handle(self, key: str) -> IO[bytes]:
+        """Arquivo de índice da chave, aberto no LRU (chamar com lock)"""
+        f = self._handles.get(key)
+        if f is not None:
+            self._handles.move_to_end(key)
+            return f
+        path = self._index_path(key)
+        f = open(path, 'r+b' if os.path.exists(path) else 'w+b')
+        self._handles[key] = f
+        if len(self._handles) > self.open_files:
+            self._handles.popitem(last=False)[1].close()
+        return f
+
+    @staticmethod
+    def _entry_at(f: IO[bytes], index: int) -> Entry:
+        f.seek(index * ENTRY.size)
+        return ENTRY.unpack(f.read(ENTRY.size))
+
+    @classmethod
+    def _bisect(cls, f: IO[bytes], count: int, entry: Entry) -> int:
+        """Primeira posição do arquivo com entrada >= `entry`"""
+        low, high = 0, count
+        while low < high:
+            middle = (low + high) // 2
+            if cls._entry_at(f, middle) < entry:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _write_entries(self, f: IO[bytes], entries: List[Entry]):
+        """Grava entradas ordenadas mantendo o arquivo em ordem de clock"""
+        count = f.seek(0, os.SEEK_END) // ENTRY.size
+        start = count
+        if count and self._entry_at(f, count - 1) > entries[0]:
+            # Chegada fora de ordem (ex.: réplica atrasada): junta com a cauda
+            start = self._bisect(f, count, entries[0])
+            f.seek(start * ENTRY.size)
+            entries = sorted(entries + list(ENTRY.iter_unpack(f.read((count - start) * ENTRY.size))))
+        f.seek(start * ENTRY.size)
+        f.write(b''.join(ENTRY.pack(*entry) for entry in entries))
+        f.flush()
+
+    def _write_checkpoint(self, position: Tuple[int, int]):
+        tmp_file = self.checkpoint_file + ".tmp"
+        with open(tmp_file, 'w') as f:
+            f.write(f"{position[0]} {position[1]}")
+        os.replace(tmp_file, self.checkpoint_file)
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _segment_size(self, segment: int) -> int:
+        try:
+            return os.path.getsize(self.message_log.segment_path(segment))
+        except OSError:
+            return -1
+
+    def _drop_past_end(self) -> Optional[Tuple[int, int]]:
+        """Remove de cada `.idx` entradas além do tamanho do segmento.
+
+        Só roda quando o checkpoint aponta além do fim do log (linhas perdidas
+        numa queda); os índices estão em ordem de clock, então cada arquivo é
+        lido inteiro. Retorna a maior posição válida restante (ou None).
+        """
+        sizes: Dict[int, int] = {}
+        latest: Optional[Tuple[int, int]] = None
+        dropped = 0
+        for filename in os.listdir(self.directory):
+            if not filename.endswith(".idx"):
+                continue
+            path = os.path.join(self.directory, filename)
+            with open(path, 'r+b') as f:
+                data = f.read()
+                data = data[:len(data) // ENTRY.size * ENTRY.size]
+                kept = []
+                for entry in ENTRY.iter_unpack(data):
+                    segment, offset = entry[2], entry[3]
+                    if segment not in sizes:
+                        sizes[segment] = self._segment_size(segment)
+                    if offset < sizes[segment]:
+                        kept.append(entry)
+                        latest = max(latest or (segment, offset), (segment, offset))
+                if len(kept) * ENTRY.size != len(data):
+                    dropped += len(data) // ENTRY.size - len(kept)
+                f.seek(0)
+                f.write(b''.join(ENTRY.pack(*entry) for entry in kept))
+                f.truncate()
+        if dropped:
+            log.warning("Índice %s: %d entradas além do fim do log removidas",
+                        self.message_log.name, dropped)
+        return latest
+
+    def _sort_existing(self):
+        """Índices do formato antigo (ordem de gravação) passam a ficar em ordem de clock"""
+        if os.path.exists(self.sorted_marker):
+            return
+        for filename in os.listdir(self.directory):
+            if filename.endswith(".idx"):
+                with open(os.path.join(self.directory, filename), 'r+b') as f:
+                    data = f.read()
+                    entries = sorted(set(ENTRY.iter_unpack(data[:len(data) // ENTRY.size * ENTRY.size])))
+                    f.seek(0)
+                    f.write(b''.join(ENTRY.pack(*entry) for entry in entries))
+                    f.truncate()
+        open(self.sorted_marker, 'w').close()
+
+    def _recover(self):
+        """Reindexa registros gravados após o último checkpoint"""
+        self._sort_existing()
+        checkpoint = (0, -1)
+        if os.path.exists(self.checkpoint_file):
+            with open(self.checkpoint_file) as f:
+                segment, offset = f.read().split()
+                checkpoint = (int(segment), int(offset))
+
+        if checkpoint[1] >= self._segment_size(checkpoint[0]):
+            # Checkpoint além do fim do log (queda antes do flush): volta à última entrada válida
+            latest = self._drop_past_end()
+            checkpoint = latest or (0, -1)
+            if latest:
+                self._write_checkpoint(latest)
+
+        recovered = 0
+        for segment in self.message_log.segments():
+            if segment < checkpoint[0]:
+                continue
+            offset = checkpoint[1] if segment == checkpoint[0] else 0
+            offset = max(offset, 0)
+            with open(self.message_log.segment_path(segment), 'rb') as f:
+                f.seek(offset)
+                for line in f:
+                    position = (segment, offset)
+                    offset += len(line)
+                    if position <= checkpoint or not line.endswith(b'\n'):
+                        continue
+                    try:
+                        self.add(json.loads(line), position)
+                        recovered += 1
+                    except json.JSONDecodeError:
+                        continue
+        if recovered:
+            self.flush()
+            log.info("Índice %s: %d registros reindexados", self.message_log.name, recovered)
+
+    def query(self, key: str, clock_range: Tuple[Optional[int], Optional[int]] = (None, None),
+              time_range: Tuple[Optional[float], Optional[float]] = (None, None),
+              limit: int = 100) -> Tuple[List[Dict[str, Any]], bool]:
+        """Retorna (mensagens ordenadas por clock, há_mais) para a chave"""
+        min_clock, max_clock = clock_range
+        min_time, max_time = time_range
+
+        def wanted(entry: Entry) -> bool:
+            clock, timestamp = entry[0], entry[1]
+            return ((max_clock is None or clock <= max_clock)
+                    and (min_time is None or timestamp >= min_time)
+                    and (max_time is None or timestamp <= max_time))
+
+        with self._lock:
+            # Pendentes entram na seleção; o arquivo é lido a partir de `min_clock`
+            selected = {entry for entry in self._pending.get(key, [])
+                        if (min_clock is None or entry[0] >= min_clock) and wanted(entry)}
+            if os.path.exists(self._index_path(key)):
+                f = self._handle(key)
+                count = f.seek(0, os.SEEK_END) // ENTRY.size
+                index = self._bisect(f, count, (min_clock or 0, float("-inf"), 0, 0))
+                f.seek(index * ENTRY.size)
+                found = 0
+                while index < count and found <= limit:
+                    chunk = f.read(min(count - index, 256) * ENTRY.size)
+                    index += len(chunk) // ENTRY.size
+                    for entry in ENTRY.iter_unpack(chunk):
+                        if max_clock is not None and entry[0] > max_clock:
+                            index = count
+                            break
+                        if wanted(entry) and entry not in selected:
+                            selected.add(entry)
+                            found += 1
+
+        ordered = sorted(selected)
+        has_more = len(ordered) > limit
+        ordered = ordered[:limit]
+
+        # Garante que linhas ainda no buffer do log estejam no arquivo
+        self.message_log.flush()
+
+        messages = []
+        handles = {}
+        try:
+            for _, _, segment, offset in sorted(ordered, key=lambda e: (e[2], e[3])):
+                f = handles.get(segment)
+                if f is None:
+                    f = handles[segment] = open(self.message_log.segment_path(segment), 'rb')
+                f.seek(offset)
+                try:
+                    record = json.loads(f.readline())
+                except ValueError:
+                    continue  # entrada antiga apontando para linha perdida ou parcial
+                if self.key_for(record) == key:
+                    messages.append(record)
+        finally:
+            for f in handles.values():
+                f.close()
+
+        messages.sort(key=lambda m: (m.get("clock", 0), m.get("timestamp", 0)))
+        return messages, has_more
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            for f in self._handles.values():
+                f.close()
+            self._handles.clear()
@@ -0,0 +1,107 @@
+import os
+import sys
+import json
+import time
+import queue
+import atexit
+import logging
+import itertools
+import logging.handlers
+from typing import Any, Dict
+
+# Campos estruturados ficam em record.fields (ver `kv`)
+_configured = False
+
+
+class StructuredFormatter(logging.Formatter):
+    """Uma linha por registro: texto `chave=valor` ou JSON (LOG_FORMAT=json)"""
+
+    def __init__(self, as_json: bool):
+        super().__init__()
+        self.as_json = as_json
+
+    def format(self, record: logging.LogRecord) -> str:
+        fields: Dict[str, Any] = getattr(record, "fields", None) or {}
+        if self.as_json:
+            entry = {
+                "ts": round(record.created, 6),
+                "level": record.levelname,
+                "logger": record.name,
+                "msg": record.getMessage(),
+            }
+            entry.update(fields)
+            if record.exc_info:
+                entry["exc"] = self.formatException(record.exc_info)
+            return json.dumps(entry, ensure_ascii=False, default=str)
+
+        created = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created))
+        line = f"{created}.{int(record.msecs):03d} {record.levelname:<5} {record.name} {record.getMessage()}"
+        if fields:
+            line += " " + " ".join(f"{k}={v}" for k, v in fields.items())
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+def setup():
+    """Configura a raiz: fila em memória + thread que formata e escreve no stdout.
+
+    Quem registra só enfileira o LogRecord (sem formatar nem escrever);
+    a formatação acontece na thread do QueueListener. Nível em LOG_LEVEL.
+    """
+    global _configured
+    if _configured:
+        return
+    _configured = True
+
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(StructuredFormatter(os.getenv("LOG_FORMAT", "text").lower() == "json"))
+
+    log_queue: queue.Queue = queue.Queue(int(os.getenv("LOG_QUEUE_SIZE", "10000")))
+    listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=False)
+
+    root = logging.getLogger()
+    root.handlers[:] = [DroppingQueueHandler(log_queue)]
+    root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+    listener.start()
+    atexit.register(listener.stop)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler que descarta (e conta) registros com a fila cheia em vez de bloquear"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Mensagem e argumentos são formatados só na thread do listener
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def get_logger(name: str) -> logging.Logger:
+    setup()
+    return logging.getLogger(name)
+
+
+def kv(**fields) -> Dict[str, Any]:
+    """Campos estruturados: `log.info("msg", extra=kv(user=...))`"""
+    return {"fields": fields}
+
+
+class Sampler:
+    """Amostragem 1 em N para eventos por mensagem (LOG_SAMPLE_EVERY)"""
+
+    def __init__(self, every: int = None):
+        self.every = max(1, every or int(os.getenv("LOG_SAMPLE_EVERY", "100")))
+        self._counter = itertools.count()
+
+    def __call__(self) -> bool:
+        # next() em itertools.count é atômico no CPython
+        return next(self._counter) % self.every == 0
@@ -1,32 +1,72 @@
 import zmq
-import json
 import os
 import time
+import zlib
+import signal
+import logging
 import threading
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Optional
 from serde import serializer
 from clock import LamportClock
+from registry import Registry
+from store import MetadataStore
+from msglog import open_message_logs
+from history import HistoryIndex, conversation_key
+from workers import WorkerPool
+from broker_link import BrokerLink, HEARTBEAT_INTERVAL, server_capacity
+from dedup import ReplicationState
+from batcher import ReplicationBatcher
+from catchup import read_chunk, record_to_event
+from shards import ShardMap
+from reference import reference_client
+from peers import scatter
+from datadir import claim_namespace, replica_data_dir
+from logs import get_logger, kv, Sampler
+from metrics import Metrics, render_text
+
+log = get_logger("server")
+# Eventos por mensagem: só em DEBUG e amostrados (LOG_SAMPLE_EVERY)
+sample = Sampler()
+
+# Serviços do cliente (rótulo das métricas; os demais contam como "unknown")
+SERVICES = ("login", "users", "channel", "channels", "publish", "message", "history", "batch")
+
+
+def trace_enabled() -> bool:
+    """Log por mensagem ligado (DEBUG) e sorteado pela amostragem"""
+    return log.isEnabledFor(logging.DEBUG) and sample()
+
 
 class Server:
     def __init__(self, server_name: str = None):
-        self.context = zmq.Context()
-        self.socket = self.context.socket(zmq.REP)
-        self.socket.connect("tcp://broker:5556")
+        # Com SERVER_WORKERS > 1 as requisições são atendidas por um pool de workers
+        self.workers = int(os.getenv("SERVER_WORKERS", "1"))
+        # Porta para requisições diretas entre servidores (catch-up)
+        self.peer_port = int(os.getenv("PEER_PORT", "5560"))
+        self.pub_lock = threading.Lock()
+        # Contadores e latências por serviço e etapa (SERVER_STATS=1)
+        self.metrics = Metrics()
+        # Tópicos distribuídos entre os proxies (PUBSUB_SHARDS)
+        self.shards = ShardMap()
+        self.shards.check()
 
-        # Socket para publicar mensagens
-        self.pub_socket = self.context.socket(zmq.PUB)
-        self.pub_socket.connect("tcp://proxy:5557")
+        # Preferir nome configurado; caso contrário, usar HOSTNAME do container (único). Como fallback final, usa PID.
+        self.server_name = server_name or os.getenv("SERVER_NAME") or os.getenv("HOSTNAME", f"server-{os.getpid()}")
+        self._init_sockets()
+        # Cliente da referência com timeout e reconexão (socket próprio)
+        self.reference = reference_client()
 
-        # Socket para comunicação com referência
-        self.ref_socket = self.context.socket(zmq.REQ)
-        self.ref_socket.connect("tcp://reference:5559")
+        # Executor de persistência (usado pela engine asyncio; None = escrita inline)
+        self.persist_executor = None
+
+        # Encerramento: as threads de manutenção param antes de os sockets fecharem
+        self.stopping = threading.Event()
+        self.threads: List[threading.Thread] = []
 
         # Relógio lógico
         self.clock = LamportClock()
 
         # Dados do servidor
-        # Preferir nome configurado; caso contrário, usar HOSTNAME do container (único). Como fallback final, usa PID.
-        self.server_name = server_name or os.getenv("SERVER_NAME") or os.getenv("HOSTNAME", f"server-{os.getpid()}")
         self.rank = None
         self.coordinator = None
         self.other_servers = []
@@ -35,234 +75,445 @@ class Server:
         # Berkeley sync
         self.berkeley_enabled = True
         self.berkeley_interval = 10
-
-        # Dados persistentes
-        self.data_dir = "/data"
-        os.makedirs(self.data_dir, exist_ok=True)
+        # Ajuste lógico (segundos) somado a todo timestamp emitido
+        self.clock_offset = 0.0
+        self.berkeley_timeout_ms = int(os.getenv("BERKELEY_TIMEOUT_MS", "1000"))
+        self.berkeley_max_rtt = int(os.getenv("BERKELEY_MAX_RTT_MS", "500")) / 1000.0
+        self.berkeley_max_skew = int(os.getenv("BERKELEY_MAX_SKEW_MS", "2000")) / 1000.0
+        self.berkeley_min_interval = int(os.getenv("BERKELEY_MIN_INTERVAL_MS", "1000")) / 1000.0
+        self.berkeley_due = self._new_event()
+
+        # Dados persistentes: diretório próprio da réplica dentro de DATA_DIR,
+        # reservado por lock (DATA_NAMESPACE/SERVER_NAME ou primeiro replica-<n> livre)
+        data_root = os.getenv("DATA_DIR", "/data")
+        self.data_namespace, self.data_lock = claim_namespace(
+            data_root, os.getenv("DATA_NAMESPACE") or server_name or os.getenv("SERVER_NAME")
+        )
+        # ID de origem da replicação ligado ao diretório (estável entre recriações do container)
+        self.server_id = zlib.crc32(self.data_namespace.encode('utf-8')) % 10000
+        self.data_dir = replica_data_dir(data_root, self.data_namespace, self.server_id)
+        data_link = os.getenv("DATA_LINK")
+        if data_link:
+            # Atalho local do container para o diretório da réplica
+            if os.path.islink(data_link):
+                os.remove(data_link)
+            os.symlink(self.data_dir, data_link)
 
         self.users_file = os.path.join(self.data_dir, "users.json")
         self.channels_file = os.path.join(self.data_dir, "channels.json")
         self.messages_dir = os.path.join(self.data_dir, "messages")
-        os.makedirs(self.messages_dir, exist_ok=True)
+        self.message_logs = open_message_logs(self.messages_dir)
+        self.history = {
+            "publish": HistoryIndex(self.message_logs["publish"], "channel"),
+            "message": HistoryIndex(self.message_logs["message"], "conversation"),
+        }
+
+        # Metadados: log append-only com group commit + snapshot compactado
+        commit_ms = int(os.getenv("STORE_COMMIT_MS", "50"))
+        compact_every = int(os.getenv("STORE_COMPACT_EVERY", "10000"))
+        self.users_store = MetadataStore(self.users_file, lambda: self.users.records(),
+                                         commit_ms, compact_every)
+        self.channels_store = MetadataStore(self.channels_file, lambda: self.channels.records(),
+                                            commit_ms, compact_every)
+
+        # Carregar dados existentes (snapshot + replay do log)
+        self.users = Registry(self.users_store.load())
+        self.channels = Registry(self.channels_store.load())
+
+        # Estado da replicação
+        # Marcas d'água por origem (seq) para deduplicação limitada
+        self.replication_state = ReplicationState(
+            os.path.join(self.data_dir, f"replication.{self.data_namespace}.json")
+        )
+        # Eventos saem em lotes (tamanho/tempo) numerados por origem
+        self.replication_batcher = ReplicationBatcher(
+            self.server_id,
+            lambda batch: self._publish_message("replication", batch),
+            int(os.getenv("REPL_BATCH_MAX", "64")),
+            int(os.getenv("REPL_BATCH_MS", "5")),
+            self.now
+        )
+        self.last_batch_seq: Dict[int, int] = {}
+        # Requisição `batch` em andamento na thread: eventos retidos até o fim
+        self.batch_context = threading.local()
+        self.batch_max_items = int(os.getenv("BATCH_MAX_ITEMS", "100"))
+        # Sincronização (catch-up) com um par ao iniciar ou após lacuna na replicação
+        self.catchup_needed = True
+        # Aplicação de eventos (listener de replicação e catch-up) serializada
+        self.apply_lock = threading.Lock()
+        # Por par: posição alcançada em cada fase no último catch-up (o próximo recomeça dali)
+        self.sync_positions: Dict[str, Dict[str, Dict]] = {}
+
+        # Membership: lista completa da referência + deltas no tópico "membership"
+        # Mesma cadência de heartbeat de antes; a propagação rápida vem dos deltas
+        self.heartbeat_interval = int(os.getenv("REFERENCE_HEARTBEAT_MS", "10000")) / 1000.0
+        self.list_interval = int(os.getenv("REFERENCE_LIST_MS", "60000")) / 1000.0
+        self.membership_version = None
+        self.list_refresh_needed = True
+        self.membership_event = self._new_event()
+
+        # Eleição Bully entre servidores (socket de pares)
+        self.election_timeout_ms = int(os.getenv("ELECTION_TIMEOUT_MS", "1000"))
+        self.election_wait = int(os.getenv("ELECTION_WAIT_MS", "3000")) / 1000.0
+        self.election_rounds = int(os.getenv("ELECTION_ROUNDS", "3"))
+        self.election_requested = False
+        self.coordinator_announced = self._new_event()
+
+        # Iniciar threads de manutenção
+        self.start_maintenance_threads()
 
-        # Carregar dados existentes
-        self.users = self._load_json(self.users_file, [])
-        self.channels = self._load_json(self.channels_file, [])
+    def _new_event(self):
+        """Evento de sinalização entre threads (asyncio.Event na engine asyncio)"""
+        return threading.Event()
+
+    def _init_sockets(self):
+        """Cria o contexto e os sockets ZeroMQ do servidor"""
+        self.context = zmq.Context()
+
+        # DEALER no protocolo do broker (READY/REQUEST/REPLY/HEARTBEAT)
+        self.socket = None
+        if self.workers <= 1:
+            self.socket = self.context.socket(zmq.DEALER)
+            # Identidade estável: mesma posição no anel do broker após reconectar
+            self.socket.setsockopt(zmq.IDENTITY, self.server_name.encode('utf-8'))
+            self.socket.connect("tcp://broker:5556")
+
+        # Um socket de publicação por shard (compartilhados entre threads)
+        self.pub_sockets = []
+        for i in range(len(self.shards)):
+            pub_socket = self.context.socket(zmq.PUB)
+            pub_socket.connect(self.shards.pub_endpoint(i))
+            self.pub_sockets.append(pub_socket)
 
         # Socket para replicação
         self.rep_socket = self.context.socket(zmq.SUB)
-        self.rep_socket.connect("tcp://proxy:5558")
-        self.rep_socket.setsockopt_string(zmq.SUBSCRIBE, "replication")
         # Também ouvir anúncios de eleição
+        for endpoint in self.shards.sub_endpoints(["replication", "servers"]):
+            self.rep_socket.connect(endpoint)
+        self.rep_socket.setsockopt_string(zmq.SUBSCRIBE, "replication")
         self.rep_socket.setsockopt_string(zmq.SUBSCRIBE, "servers")
+        # Deltas de membership publicados pela referência
+        self.rep_socket.connect(os.getenv("REFERENCE_PUB_ENDPOINT", "tcp://reference:5562"))
+        self.rep_socket.setsockopt_string(zmq.SUBSCRIBE, "membership")
+
+        # Socket para requisições de outros servidores
+        self.peer_socket = self.context.socket(zmq.REP)
+        self.peer_socket.bind(f"tcp://*:{self.peer_port}")
+
+    def _persist(self, fn, *args):
+        """Executa uma escrita em disco inline ou no executor de persistência"""
+        with self.metrics.stage("persist"):
+            if self.persist_executor is not None:
+                self.persist_executor.submit(fn, *args)
+            else:
+                fn(*args)
 
-        # Estado da replicação
-        self.applied_events = set()  # (clock, server_id) já aplicados
-        self.server_id = hash(self.server_name) % 10000  # ID simples baseado no nome
+    def _write_message(self, message_data: Dict, message_type: str, defer: bool = False):
+        position = self.message_logs[message_type].append(message_data, defer)
+        self.history[message_type].add(message_data, position)
 
-        # Iniciar threads de manutenção
-        self.start_maintenance_threads()
+    def _persist_message(self, message_data: Dict, message_type: str, defer: bool = False):
+        """Persiste mensagem no log JSONL (buffer + segmentos rotativos)"""
+        defer = defer or getattr(self.batch_context, "events", None) is not None
+        self._persist(self._write_message, message_data, message_type, defer)
 
-    def _load_json(self, filepath: str, default: Any) -> Any:
-        """Carrega JSON ou retorna valor padrão"""
-        if os.path.exists(filepath):
-            try:
-                with open(filepath, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except json.JSONDecodeError:
-                return default
-        return default
-
-    def _save_json(self, filepath: str, data: Any):
-        """Salva dados em JSON"""
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=2, ensure_ascii=False)
-
-    def _persist_message(self, message_data: Dict, message_type: str):
-        """Persiste mensagem em arquivo JSONL"""
-        filename = f"{message_type}s.jsonl"
-        filepath = os.path.join(self.messages_dir, filename)
-
-        with open(filepath, 'a', encoding='utf-8') as f:
-            json.dump(message_data, f, ensure_ascii=False)
-            f.write('\n')
+    def _flush_batch(self):
+        """Flush único de logs e estado de replicação ao fim de um lote.
+
+        A marca d'água é salva logo depois dos logs que ela cobre: após uma
+        queda, o catch-up não reaplica (nem duplica) eventos já gravados.
+        """
+        for message_log in self.message_logs.values():
+            message_log.flush()
+        self.replication_state.maybe_save()
 
     def _publish_message(self, topic: str, message: Dict):
         """Publica mensagem no tópico especificado"""
         envelope = [topic.encode('utf-8'), serializer.serialize(message)]
-        self.pub_socket.send_multipart(envelope)
-        print(f"Publicado no tópico '{topic}': {message}")
+        pub_socket = self.pub_sockets[self.shards.index(topic)]
+        with self.metrics.stage("publish"), self.pub_lock:
+            pub_socket.send_multipart(envelope)
+        if trace_enabled():
+            log.debug("publicado", extra=kv(topic=topic, message=message))
 
     def _user_exists(self, username: str) -> bool:
         """Verifica se usuário existe"""
-        return any(u["name"] == username for u in self.users)
+        return username in self.users
 
     def _channel_exists(self, channel: str) -> bool:
         """Verifica se canal existe"""
-        return any(c["name"] == channel for c in self.channels)
+        return channel in self.channels
+
+    def _start_thread(self, target):
+        thread = threading.Thread(target=target, daemon=True)
+        thread.start()
+        self.threads.append(thread)
 
     def start_maintenance_threads(self):
         """Inicia threads de manutenção em background"""
         # Thread para heartbeat com referência
-        threading.Thread(target=self.heartbeat_loop, daemon=True).start()
+        self._start_thread(self.heartbeat_loop)
 
         # Thread para eleição se necessário
-        threading.Thread(target=self.election_monitor, daemon=True).start()
+        self._start_thread(self.election_monitor)
 
         # Thread para replicação
-        threading.Thread(target=self.replication_listener, daemon=True).start()
+        self._start_thread(self.replication_listener)
+
+        # Thread que envia lotes de replicação vencidos
+        self.replication_batcher.start()
+
+        # Threads de requisições entre servidores e de catch-up
+        self._start_thread(self.peer_listener)
+        self._start_thread(self.catchup_loop)
+        self._start_thread(self.berkeley_loop)
+
+    def stop_maintenance_threads(self, timeout: float = 5.0):
+        """Sinaliza as threads e espera que terminem (nenhuma fica usando um socket)"""
+        self.stopping.set()
+        # Acorda as threads que esperam por eventos
+        self.membership_event.set()
+        self.berkeley_due.set()
+        deadline = time.time() + timeout
+        for thread in self.threads:
+            thread.join(max(deadline - time.time(), 0))
+            if thread.is_alive():
+                log.warning("Thread de manutenção não terminou", extra=kv(thread=thread.name))
+        self.replication_batcher.stop()
+
+    def _reference_request(self, service: str) -> Dict:
+        """Monta requisição (rank, list ou heartbeat) para a referência"""
+        data = {
+            "timestamp": self.now(),
+            "clock": self.clock.tick()
+        }
+        if service != "list":
+            data["user"] = self.server_name
+        return {"service": service, "data": data}
 
     def register_with_reference(self):
         """Registra este servidor com o servidor de referência"""
         try:
-            clock = self.clock.tick()
-            request = {
-                "service": "rank",
-                "data": {
-                    "user": self.server_name,
-                    "timestamp": time.time(),
-                    "clock": clock
-                }
-            }
-
-            self.ref_socket.send(serializer.serialize(request))
-            response_raw = self.ref_socket.recv()
-            response = serializer.deserialize(response_raw)
-
-            if response.get("data", {}).get("rank"):
-                self.rank = response["data"]["rank"]
-                print(f"Servidor {self.server_name} registrado com rank {self.rank}")
+            response = self.reference.call(self._reference_request("rank"))
+            return self._on_rank_response(response)
+        except Exception as e:
+            log.warning("Erro na comunicação com referência: %s", e)
+            return False
 
-                if response.get("data", {}).get("clock"):
-                    self.clock.update(response["data"]["clock"])
+    def _on_rank_response(self, response: Dict) -> bool:
+        if response.get("data", {}).get("rank"):
+            self.rank = response["data"]["rank"]
+            log.info("Servidor registrado", extra=kv(server=self.server_name, rank=self.rank))
 
-                return True
-            else:
-                print(f"Erro ao registrar servidor: {response}")
-                return False
+            if response.get("data", {}).get("clock"):
+                self.clock.update(response["data"]["clock"])
 
-        except Exception as e:
-            print(f"Erro na comunicação com referência: {e}")
+            return True
+        else:
+            log.error("Erro ao registrar servidor: %s", response)
             return False
 
     def update_server_list(self):
         """Atualiza lista de servidores do servidor de referência"""
         try:
-            clock = self.clock.tick()
-            request = {
-                "service": "list",
-                "data": {
-                    "timestamp": time.time(),
-                    "clock": clock
-                }
-            }
-
-            self.ref_socket.send(serializer.serialize(request))
-            response_raw = self.ref_socket.recv()
-            response = serializer.deserialize(response_raw)
-
-            if response.get("data", {}).get("list"):
-                self.other_servers = response["data"]["list"]
-                # Remove este servidor da lista
-                self.other_servers = [s for s in self.other_servers if s["name"] != self.server_name]
+            response = self.reference.list_servers(self._reference_request("list"))
+            if response:
+                self._on_list_response(response)
+        except Exception as e:
+            log.warning("Erro ao atualizar lista de servidores: %s", e)
+
+    def _on_list_response(self, response: Dict):
+        if response.get("data", {}).get("list"):
+            # Remove este servidor da lista
+            self.other_servers = [s for s in response["data"]["list"] if s["name"] != self.server_name]
+            self.membership_version = response["data"].get("version")
+            self.list_refresh_needed = False
+            self._check_coordinator()
+
+            log.info("Lista de servidores atualizada",
+                     extra=kv(servers=len(self.other_servers), coordinator=self.coordinator))
+
+            if response.get("data", {}).get("clock"):
+                self.clock.update(response["data"]["clock"])
+
+    def _rank_of(self, name: str) -> Optional[int]:
+        """Rank de um servidor ativo (None se fora da lista)"""
+        if name == self.server_name:
+            return self.rank
+        for server in self.other_servers:
+            if server["name"] == name:
+                return server["rank"]
+        return None
+
+    def _check_coordinator(self):
+        """Acorda o monitor de eleição se o coordenador atual deixou de valer"""
+        if self.election_needed():
+            self.membership_event.set()
+
+    def _on_membership(self, data: Dict):
+        """Aplica delta (join/leave) publicado pela referência"""
+        version = data.get("version")
+        if self.membership_version is not None and version != self.membership_version + 1:
+            # Delta perdido ou referência reiniciada: pedir lista completa
+            self.list_refresh_needed = True
+        self.membership_version = version
+
+        if data.get("clock"):
+            self.clock.update(data["clock"])
+        name = data.get("name")
+        if not name or name == self.server_name:
+            return
 
-                # Atualizar coordenador (menor rank ativo)
-                if self.other_servers:
-                    sorted_servers = sorted(self.other_servers, key=lambda s: s["rank"])
-                    self.coordinator = sorted_servers[0]["name"]
-                else:
-                    self.coordinator = self.server_name
+        # Nova lista em vez de alterar a atual (lida por outras threads)
+        servers = [s for s in self.other_servers if s["name"] != name]
+        if data.get("event") == "join":
+            servers.append({"name": name, "rank": data.get("rank")})
+        self.other_servers = servers
 
-                print(f"Lista de servidores atualizada. Coordenador: {self.coordinator}")
+        log.info("Membership", extra=kv(version=version, event=data.get("event"), server=name))
+        self._check_coordinator()
 
-                if response.get("data", {}).get("clock"):
-                    self.clock.update(response["data"]["clock"])
+    def _on_heartbeat_response(self, response: Dict):
+        data = response.get("data", {})
+        if data.get("clock"):
+            self.clock.update(data["clock"])
+        if data.get("status") == "error":
+            # Referência reiniciou e não conhece este servidor
+            self.rank = None
 
-        except Exception as e:
-            print(f"Erro ao atualizar lista de servidores: {e}")
+    def _list_due(self, last_list: float) -> bool:
+        """Lista completa só na entrada, após delta perdido ou como verificação periódica"""
+        return self.list_refresh_needed or time.time() - last_list >= self.list_interval
 
     def heartbeat_loop(self):
         """Loop de heartbeat com o servidor de referência"""
-        while True:
+        last_list = 0.0
+        while not self.stopping.is_set():
             try:
                 if not self.rank:
                     if not self.register_with_reference():
-                        time.sleep(5)
+                        self.stopping.wait(5)
                         continue
 
                 # Enviar heartbeat
-                clock = self.clock.tick()
-                request = {
-                    "service": "heartbeat",
-                    "data": {
-                        "user": self.server_name,
-                        "timestamp": time.time(),
-                        "clock": clock
-                    }
-                }
-
-                self.ref_socket.send(serializer.serialize(request))
-                response_raw = self.ref_socket.recv()
-                response = serializer.deserialize(response_raw)
+                self._on_heartbeat_response(self.reference.call(self._reference_request("heartbeat")))
 
-                if response.get("data", {}).get("clock"):
-                    self.clock.update(response["data"]["clock"])
-
-                # Atualizar lista a cada heartbeat
-                self.update_server_list()
+                # Mudanças chegam por delta no tópico "membership"
+                if self._list_due(last_list):
+                    self.update_server_list()
+                    last_list = time.time()
 
             except Exception as e:
-                print(f"Erro no heartbeat: {e}")
+                log.warning("Erro no heartbeat: %s", e)
                 self.rank = None  # Forçar re-registro
 
-            time.sleep(10)  # Heartbeat a cada 10 segundos
+            self.stopping.wait(self.heartbeat_interval)
+
+    def election_needed(self) -> bool:
+        """Indica se é preciso eleger: pedido de eleição, sem coordenador, coordenador fora
+        da lista ativa ou com rank menor que o deste servidor"""
+        if not self.rank or self.list_refresh_needed:
+            return False  # sem rank ou sem lista ainda
+        if self.election_requested:
+            return True
+        if self.coordinator == self.server_name:
+            return False
+        if not self.coordinator:
+            return True
+        coordinator_rank = self._rank_of(self.coordinator)
+        return coordinator_rank is None or coordinator_rank < self.rank
 
     def election_monitor(self):
         """Monitora necessidade de eleição"""
-        while True:
-            time.sleep(5)
+        while not self.stopping.is_set():
+            # Acorda na hora com delta de membership, anúncio ou pedido de eleição
+            self.membership_event.wait(5)
+            self.membership_event.clear()
+            if self.stopping.is_set():
+                break
+
+            if self.election_needed():
+                log.info("Iniciando eleição", extra=kv(coordinator=self.coordinator))
+                self.start_election()
 
-            if not self.coordinator or self.coordinator == self.server_name:
-                continue
+    def request_election(self):
+        """Agenda uma eleição na thread de eleição (pedido de par ou anúncio de rank menor)"""
+        self.election_requested = True
+        self.membership_event.set()
+
+    def _run_election(self) -> bool:
+        """Rodadas do Bully; True se este servidor deve assumir como coordenador.
+
+        Os servidores de rank maior recebem `election` em paralelo, com um só prazo
+        (`ELECTION_TIMEOUT_MS`). Sem resposta, este servidor vence. Com um OK, um
+        superior assumiu a eleição e espera-se o anúncio dele no tópico `servers`;
+        se não vier em `ELECTION_WAIT_MS`, nova rodada.
+        """
+        for _ in range(self.election_rounds):
+            higher, request = self._election_request()
+            if not higher:
+                return True
+            replies = scatter(higher, self.peer_port, request, self.election_timeout_ms, first_only=True)
+            if not self._on_election_replies(replies):
+                return True
+            if self.coordinator_announced.wait(self.election_wait) and self._superior_announced():
+                return False
+        return True
+
+    def _election_request(self):
+        """Início de uma rodada: (pares de rank maior, requisição `election`)"""
+        self.election_requested = False
+        higher = [s["name"] for s in self.other_servers if s["rank"] > self.rank]
+        if not higher:
+            return higher, None
+        log.info("Enviando eleição", extra=kv(peers=higher))
+        self.coordinator_announced.clear()
+        return higher, serializer.serialize({
+            "service": "election",
+            "data": {"timestamp": self.now(), "clock": self.clock.tick()}
+        })
 
-            # Verificar se coordenador ainda está ativo
-            coordinator_active = any(s["name"] == self.coordinator for s in self.other_servers)
+    def _on_election_replies(self, replies: Dict) -> bool:
+        """Aplica os relógios das respostas; False se nenhum superior respondeu"""
+        for raw, _, _ in replies.values():
+            data = serializer.deserialize(raw).get("data", {})
+            if data.get("clock"):
+                self.clock.update(data["clock"])
+        return bool(replies)
 
-            if not coordinator_active:
-                print(f"Coordenador {self.coordinator} não está ativo. Iniciando eleição...")
-                self.start_election()
+    def _superior_announced(self) -> bool:
+        return (self._rank_of(self.coordinator) or 0) > self.rank
+
+    def _become_coordinator(self):
+        self.coordinator = self.server_name
+        self.announce_coordinator()
 
     def start_election(self):
         """Inicia processo de eleição usando algoritmo Bully"""
-        if not self.other_servers:
-            self.coordinator = self.server_name
-            self.announce_coordinator()
+        if self._run_election():
+            self._become_coordinator()
+
+    def _on_coordinator_announcement(self, name: str, data: Dict):
+        """Aplica anúncio do tópico `servers`, descartando resultados de eleições concorrentes"""
+        rank = data.get("rank") or self._rank_of(name)
+        if self.rank and rank is not None and rank < self.rank:
+            # Anunciante tem rank menor: este servidor toma a coordenação
+            log.info("Anúncio de coordenador contestado",
+                     extra=kv(coordinator=name, rank=rank, own_rank=self.rank))
+            self.request_election()
             return
 
-        # Encontrar servidores com rank maior
-        higher_rank_servers = [s for s in self.other_servers if s["rank"] > self.rank]
-
-        if not higher_rank_servers:
-            # Este é o servidor com maior rank, é o novo coordenador
-            self.coordinator = self.server_name
-            self.announce_coordinator()
+        current = self._rank_of(self.coordinator) if self.coordinator else None
+        if name != self.coordinator and current is not None and rank is not None and rank < current:
+            log.info("Anúncio de coordenador ignorado (rank menor que o atual)",
+                     extra=kv(announced=name, coordinator=self.coordinator))
             return
 
-        # Enviar mensagens de eleição para servidores com rank maior
-        election_won = True
-        for server in higher_rank_servers:
-            try:
-                # Simular envio de mensagem de eleição
-                # Em implementação real, precisaria de socket direto para cada servidor
-                print(f"Enviando eleição para {server['name']} (rank {server['rank']})")
-                # Se nenhum servidor com rank maior responder, este ganha
-                time.sleep(1)  # Simular timeout
-            except:
-                continue
-
-        if election_won:
-            self.coordinator = self.server_name
-            self.announce_coordinator()
+        prev = self.coordinator
+        self.coordinator = name
+        self.coordinator_announced.set()
+        log.info("Novo coordenador eleito", extra=kv(coordinator=name, previous=prev,
+                                                     clock=data.get("clock"), ts=data.get("timestamp")))
 
     def announce_coordinator(self):
         """Anuncia novo coordenador via PUB/SUB"""
@@ -270,13 +521,92 @@ class Server:
             "service": "election",
             "data": {
                 "coordinator": self.coordinator,
-                "timestamp": time.time(),
+                "rank": self.rank,
+                "timestamp": self.now(),
                 "clock": self.clock.tick()
             }
         }
 
         self._publish_message("servers", message)
-        print(f"Novo coordenador anunciado: {self.coordinator}")
+        log.info("Novo coordenador anunciado", extra=kv(coordinator=self.coordinator))
+
+    def now(self) -> float:
+        """Horário físico local com o ajuste de Berkeley aplicado"""
+        return time.time() + self.clock_offset
+
+    def _berkeley_round(self) -> Optional[Dict[str, float]]:
+        """Coleta os relógios dos pares e calcula o ajuste de cada servidor.
+
+        Todos os pares recebem `clock` em paralelo. O horário de cada um é
+        estimado no instante da resposta como `time + RTT/2`; respostas com
+        RTT acima de BERKELEY_MAX_RTT_MS ou a mais de BERKELEY_MAX_SKEW_MS da
+        mediana ficam fora da média, mas também recebem ajuste.
+        """
+        peers, request = self._berkeley_request()
+        if not peers:
+            return None
+        return self._berkeley_adjustments(peers, scatter(peers, self.peer_port, request, self.berkeley_timeout_ms))
+
+    def _berkeley_request(self):
+        """(pares, requisição `clock`) de uma rodada de Berkeley"""
+        peers = [s["name"] for s in self.other_servers]
+        if not peers:
+            return peers, None
+        return peers, serializer.serialize({
+            "service": "clock",
+            "data": {"timestamp": self.now(), "clock": self.clock.tick()}
+        })
+
+    def _berkeley_adjustments(self, peers: List[str], replies: Dict) -> Dict[str, float]:
+        """Ajuste de cada servidor a partir das respostas `clock`"""
+        # Diferença de cada relógio para o do coordenador (0 para ele mesmo)
+        diffs = {self.server_name: 0.0}
+        rtts = {}
+        for peer, (raw, sent_at, received_at) in replies.items():
+            data = serializer.deserialize(raw).get("data", {})
+            if data.get("clock"):
+                self.clock.update(data["clock"])
+            if data.get("time") is None:
+                continue
+            rtt = received_at - sent_at
+            diffs[peer] = data["time"] + rtt / 2 - (received_at + self.clock_offset)
+            rtts[peer] = rtt
+
+        ordered = sorted(diffs.values())
+        median = ordered[len(ordered) // 2]
+        accepted = [d for peer, d in diffs.items()
+                    if rtts.get(peer, 0.0) <= self.berkeley_max_rtt
+                    and abs(d - median) <= self.berkeley_max_skew]
+        if not accepted:
+            # Todos descartados (RTT alto ou desvio, inclusive o coordenador): sem ajuste nesta rodada
+            log.warning("Sincronização Berkeley sem relógios aceitos", extra=kv(replies=len(replies)))
+            return {}
+        average = sum(accepted) / len(accepted)
+        log.info("Sincronização Berkeley", extra=kv(replies=len(replies), peers=len(peers),
+                                                    accepted=len(accepted), average=round(average, 6)))
+        return {peer: average - d for peer, d in diffs.items()}
+
+    def _broadcast_adjustments(self, adjustments: Dict[str, float]):
+        """Publica o ajuste de cada servidor no tópico `servers`"""
+        self._publish_message("servers", {
+            "service": "berkeley",
+            "data": {
+                "source": self.server_name,
+                "adjustments": adjustments,
+                "timestamp": self.now(),
+                "clock": self.clock.tick()
+            }
+        })
+
+    def _on_berkeley(self, data: Dict):
+        """Aplica o ajuste enviado pelo coordenador a este servidor"""
+        if data.get("source") != self.coordinator:
+            return
+        adjustment = data.get("adjustments", {}).get(self.server_name)
+        if adjustment:
+            self.clock_offset += adjustment
+            log.info("Ajuste Berkeley aplicado",
+                     extra=kv(adjustment=round(adjustment, 6), offset=round(self.clock_offset, 6)))
 
     def sync_berkeley(self):
         """Sincroniza relógio usando algoritmo de Berkeley"""
@@ -284,47 +614,93 @@ class Server:
             return  # Só o coordenador pode iniciar Berkeley
 
         try:
-            # Simular coleta de tempos dos outros servidores
-            # Em implementação real, enviaria requisições para cada servidor
-            times = [time.time()]
-
-            if times:
-                # Calcular média e ajustar
-                average_time = sum(times) / len(times)
-                adjustment = average_time - time.time()
-
-                print(f"Sincronização Berkeley: ajuste de {adjustment:.3f} segundos")
-                # Em implementação real, ajustaria o relógio do sistema
-
+            adjustments = self._berkeley_round()
+            if adjustments:
+                self._broadcast_adjustments(adjustments)
         except Exception as e:
-            print(f"Erro na sincronização Berkeley: {e}")
+            log.warning("Erro na sincronização Berkeley: %s", e)
+
+    def berkeley_loop(self):
+        """Executa Berkeley fora das threads de requisição quando agendado"""
+        while not self.stopping.is_set():
+            if not self.berkeley_due.wait(1) or self.stopping.is_set():
+                continue
+            self.berkeley_due.clear()
+            self.sync_berkeley()
+            self.stopping.wait(self.berkeley_min_interval)
 
     def check_berkeley_sync(self):
         """Verifica se deve sincronizar relógio"""
         self.message_count += 1
         if self.berkeley_enabled and self.message_count >= self.berkeley_interval:
-            self.sync_berkeley()
+            # Apenas agenda: a rodada roda na thread de Berkeley
+            self.berkeley_due.set()
             self.message_count = 0
 
+    def _assign_seq(self, record: Dict):
+        """seq só para registros de fato inseridos: sem lacunas na sequência da origem"""
+        record["seq"] = self.replication_state.next_seq()
+
     def publish_event(self, event_type: str, event_data: Dict):
         """Publica evento para replicação"""
         event = {
             "type": event_type,
             "server_id": self.server_id,
+            "seq": event_data.get("seq") or self.replication_state.next_seq(),
             "clock": self.clock.get_time(),
             "data": event_data,
-            "timestamp": time.time()
+            "timestamp": self.now()
         }
 
-        self._publish_message("replication", event)
-        print(f"Evento replicado: {event_type} (clock={event['clock']})")
-
-    def apply_event(self, event: Dict):
-        """Aplica evento de replicação de forma idempotente"""
-        event_key = (event["clock"], event["server_id"])
+        pending = getattr(self.batch_context, "events", None)
+        if pending is not None:
+            # Dentro de `batch`: vai no lote único enviado ao fim da requisição
+            pending.append(event)
+        else:
+            self.replication_batcher.add(event)
+        if trace_enabled():
+            log.debug("evento replicado", extra=kv(type=event_type, seq=event["seq"], clock=event["clock"]))
+
+    def apply_batch(self, batch: Dict):
+        """Aplica um lote de eventos com um único flush de persistência"""
+        origin = batch["server_id"]
+        batch_seq = batch.get("batch_seq", 0)
+        last = self.last_batch_seq.get(origin)
+        if last is not None and batch_seq > last + 1:
+            log.warning("Lacuna na replicação", extra=kv(origin=origin, first=last + 1, last=batch_seq - 1))
+            self.catchup_needed = True
+        self.last_batch_seq[origin] = batch_seq
+
+        events = batch.get("events", [])
+        for event in events:
+            self.apply_event(event, in_batch=True)
+
+        # Um lote é um único recebimento: uma atualização do relógio
+        latest = max((event.get("clock", 0) for event in events), default=0)
+        if latest > self.clock.get_time():
+            self.clock.update(latest)
+
+        self._persist(self._flush_batch)
+
+    def apply_event(self, event: Dict, in_batch: bool = False):
+        """Aplica evento de replicação de forma idempotente.
+
+        Verificar, persistir e marcar como aplicado acontecem sob `apply_lock`:
+        o listener de replicação e o catch-up não gravam o mesmo (origem, seq) duas vezes.
+        """
+        with self.apply_lock:
+            self._apply_event(event, in_batch)
+
+    def _apply_event(self, event: Dict, in_batch: bool):
+        origin = event["server_id"]
+        seq = event.get("seq")
 
         # Verificar se já foi aplicado
-        if event_key in self.applied_events:
+        if seq is None:
+            # Evento de servidor sem numeração: chave (clock, server_id)
+            if self.replication_state.seen_legacy((event["clock"], origin)):
+                return
+        elif self.replication_state.is_applied(origin, seq):
             return  # Já aplicado, ignorar
 
         event_type = event["type"]
@@ -334,81 +710,272 @@ class Server:
             if event_type == "user_login":
                 # Aplicar login de usuário
                 user = event_data["user"]
-                if not self._user_exists(user):
-                    self.users.append({
-                        "name": user,
-                        "login_timestamp": event_data["timestamp"]
-                    })
-                    self._save_json(self.users_file, self.users)
-                    print(f"Usuário replicado: {user}")
+                record = {
+                    "name": user,
+                    "login_timestamp": event_data["timestamp"]
+                }
+                if seq is not None:
+                    record.update(origin=origin, seq=seq)
+                if self.users.add(record):
+                    self._persist(self.users_store.append, record)
+                    if trace_enabled():
+                        log.debug("usuário replicado", extra=kv(user=user))
 
             elif event_type == "channel_create":
                 # Aplicar criação de canal
                 channel = event_data["channel"]
-                if not self._channel_exists(channel):
-                    self.channels.append({
-                        "name": channel,
-                        "created_timestamp": event_data["timestamp"]
-                    })
-                    self._save_json(self.channels_file, self.channels)
-                    print(f"Canal replicado: {channel}")
+                record = {
+                    "name": channel,
+                    "created_timestamp": event_data["timestamp"]
+                }
+                if seq is not None:
+                    record.update(origin=origin, seq=seq)
+                if self.channels.add(record):
+                    self._persist(self.channels_store.append, record)
+                    if trace_enabled():
+                        log.debug("canal replicado", extra=kv(channel=channel))
 
             elif event_type == "message_publish":
                 # Aplicar publicação de mensagem
-                self._persist_message(event_data, "publish")
-                print(f"Mensagem replicada: {event_data['channel']}:{event_data['user']}")
+                self._persist_message(event_data, "publish", defer=in_batch)
+                if trace_enabled():
+                    log.debug("mensagem replicada", extra=kv(channel=event_data["channel"], user=event_data["user"]))
 
             elif event_type == "message_send":
                 # Aplicar envio de mensagem privada
-                self._persist_message(event_data, "message")
-                print(f"Mensagem privada replicada: {event_data['src']}->{event_data['dst']}")
+                self._persist_message(event_data, "message", defer=in_batch)
+                if trace_enabled():
+                    log.debug("mensagem privada replicada", extra=kv(src=event_data["src"], dst=event_data["dst"]))
+
+            # Marcar como aplicado (estado salvo junto com os dados)
+            if seq is not None:
+                if self.replication_state.mark_applied(origin, seq):
+                    self.catchup_needed = True  # lacunas demais: buscar em um par
+                if not in_batch:
+                    self._persist(self._flush_batch)
+
+            # Atualizar relógio se necessário (em lote, feito uma vez por `apply_batch`/catch-up)
+            if not in_batch and event["clock"] > self.clock.get_time():
+                self.clock.update(event["clock"])
 
-            # Marcar como aplicado
-            self.applied_events.add(event_key)
+        except Exception as e:
+            log.error("Erro ao aplicar evento %s: %s", event_type, e)
 
-            # Atualizar relógio se necessário
-            if event["clock"] > self.clock.get_time():
-                self.clock.update(event["clock"])
+    def handle_peer_request(self, request: Dict) -> Dict:
+        """Processa requisição vinda de outro servidor"""
+        service = request.get("service")
+        data = request.get("data", {})
+        if "clock" in data:
+            self.clock.update(data["clock"])
+
+        if service == "clock":
+            return {
+                "service": "clock",
+                "data": {
+                    "time": self.now(),
+                    "timestamp": self.now(),
+                    "clock": self.clock.tick()
+                }
+            }
+
+        if service == "stats":
+            # Métricas por serviço; format=text devolve linhas chave=valor
+            snapshot = self.metrics.snapshot(bool(data.get("reset")))
+            if data.get("format") == "text":
+                result = {"text": render_text(self.server_name, snapshot)}
+            else:
+                result = {"stats": snapshot}
+            result.update({"server": self.server_name, "timestamp": self.now(), "clock": self.clock.tick()})
+            return {"service": "stats", "data": result}
+
+        if service == "election":
+            # Responde OK e conduz a própria eleição (rank maior que o do solicitante)
+            self.request_election()
+            return {
+                "service": "election",
+                "data": {
+                    "election": "OK",
+                    "timestamp": self.now(),
+                    "clock": self.clock.tick()
+                }
+            }
 
+        if service == "sync":
+            records, cursor, position = read_chunk(
+                {"users": self.users, "channels": self.channels},
+                self.message_logs,
+                data.get("cursor") or {},
+                data.get("origin"),
+                data.get("watermarks", {}),
+                bool(data.get("full"))
+            )
+            return {
+                "service": "sync",
+                "data": {
+                    "phase": (data.get("cursor") or {}).get("phase", "users"),
+                    "records": records,
+                    "cursor": cursor,
+                    "position": position,
+                    "timestamp": self.now(),
+                    "clock": self.clock.tick()
+                }
+            }
+
+        return {
+            "service": service or "unknown",
+            "data": {
+                "status": "erro",
+                "timestamp": self.now(),
+                "clock": self.clock.tick(),
+                "description": f"Serviço '{service}' não suportado"
+            }
+        }
+
+    def peer_listener(self):
+        """Atende requisições de outros servidores"""
+        while not self.stopping.is_set():
+            try:
+                if not self.peer_socket.poll(1000):
+                    continue
+                request, fmt = serializer.decode(self.peer_socket.recv(copy=False))
+                self.peer_socket.send(serializer.serialize(self.handle_peer_request(request), fmt))
+            except zmq.ContextTerminated:
+                return
+            except Exception as e:
+                log.error("Erro no listener de servidores: %s", e)
+
+    def catch_up(self, peer: str) -> bool:
+        """Transfere, em blocos, snapshot e log de um par a partir das marcas d'água locais"""
+        socket = zmq.Context.instance().socket(zmq.REQ)
+        socket.setsockopt(zmq.RCVTIMEO, 5000)
+        socket.setsockopt(zmq.LINGER, 0)
+        socket.connect(f"tcp://{peer}:{self.peer_port}")
+
+        full = len(self.users) == 0 and not self.replication_state.watermarks
+        gaps = self.replication_state.gaps()
+        watermarks = dict(self.replication_state.watermarks)
+        positions = {} if full else dict(self.sync_positions.get(peer, {}))
+        cursor = dict(positions.get("users", {}), phase="users")
+        applied = 0
+        log.info("Catch-up iniciado", extra=kv(peer=peer, full=full))
+        try:
+            while cursor is not None:
+                socket.send(serializer.serialize({
+                    "service": "sync",
+                    "data": {
+                        "cursor": cursor,
+                        "origin": self.server_id,
+                        "watermarks": watermarks,
+                        "full": full,
+                        "timestamp": self.now(),
+                        "clock": self.clock.tick()
+                    }
+                }))
+                data = serializer.deserialize(socket.recv()).get("data", {})
+                if data.get("clock"):
+                    self.clock.update(data["clock"])
+
+                phase = data.get("phase")
+                for record in data.get("records", []):
+                    if phase == "users" and record.get("seq") is None:
+                        if self.users.add(record):  # registro antigo, sem origem
+                            self._persist(self.users_store.append, record)
+                    elif phase == "channels" and record.get("seq") is None:
+                        if self.channels.add(record):
+                            self._persist(self.channels_store.append, record)
+                    else:
+                        self.apply_event(record_to_event(phase, record), in_batch=True)
+                    applied += 1
+                self._persist(self._flush_batch)
+                if data.get("position"):
+                    positions[phase] = data["position"]
+                cursor = data.get("cursor")
+                if cursor and set(cursor) == {"phase"}:
+                    # Fase nova: retoma da posição do último catch-up com este par
+                    cursor = dict(positions.get(cursor["phase"], {}), phase=cursor["phase"])
+
+            self.sync_positions[peer] = positions
+            # Lacunas que nem o par tinha não vão aparecer: deixam de segurar a marca d'água
+            for origin, skipped in self.replication_state.skip_gaps(gaps).items():
+                log.warning("Sequências ausentes puladas após catch-up",
+                            extra=kv(peer=peer, origin=origin, count=len(skipped), first=skipped[0]))
+            log.info("Catch-up concluído", extra=kv(peer=peer, records=applied))
+            return True
+        except zmq.Again:
+            log.warning("Catch-up sem resposta", extra=kv(peer=peer))
+            return False
         except Exception as e:
-            print(f"Erro ao aplicar evento {event_type}: {e}")
+            log.error("Erro no catch-up com %s: %s", peer, e)
+            return False
+        finally:
+            socket.close()
+
+    def catchup_loop(self):
+        """Executa catch-up quando necessário, usando a lista obtida da referência"""
+        while not self.stopping.wait(2):
+            if not self.catchup_needed or not self.other_servers:
+                continue
+            for peer in sorted(self.other_servers, key=lambda s: s["rank"]):
+                if self.catch_up(peer["name"]):
+                    self.catchup_needed = False
+                    break
+
+    def handle_replication_frame(self, topic: bytes, message_raw: bytes):
+        """Trata um frame recebido nos tópicos replication/servers"""
+        message = serializer.deserialize(message_raw)
+
+        if topic == b"replication":
+            # Aplicar evento se não for do próprio servidor
+            if message.get("server_id") == self.server_id:
+                return
+            if message.get("type") == "batch":
+                self.apply_batch(message)
+            else:
+                self.apply_event(message)
+
+        elif topic == b"membership":
+            self._on_membership(message.get("data", {}))
+
+        elif topic == b"servers":
+            # Anúncio de novo coordenador
+            data = message.get("data", {})
+            if data.get("clock"):
+                self.clock.update(data["clock"])
+            if message.get("service") == "berkeley":
+                self._on_berkeley(data)
+            elif data.get("coordinator"):
+                self._on_coordinator_announcement(data["coordinator"], data)
+            else:
+                log.info("Mensagem de eleição recebida: %s", message)
 
     def replication_listener(self):
         """Ouve eventos de replicação"""
-        while True:
+        while not self.stopping.is_set():
             try:
+                if not self.rep_socket.poll(1000):
+                    continue
                 [topic, message_raw] = self.rep_socket.recv_multipart()
-                message = serializer.deserialize(message_raw)
-
-                if topic == b"replication":
-                    # Aplicar evento se não for do próprio servidor
-                    if message.get("server_id") != self.server_id:
-                        self.apply_event(message)
-
-                elif topic == b"servers":
-                    # Anúncio de novo coordenador
-                    data = message.get("data", {})
-                    new_coord = data.get("coordinator")
-                    clock_val = data.get("clock")
-                    ts = data.get("timestamp")
-                    if new_coord:
-                        prev = self.coordinator
-                        self.coordinator = new_coord
-                        print(f"[ELEIÇÃO] Novo coordenador eleito: {new_coord} (antes: {prev}) | clock={clock_val} ts={ts}")
-                    else:
-                        print(f"[ELEIÇÃO] Mensagem de eleição recebida: {message}")
-
+                self.handle_replication_frame(topic, message_raw)
             except Exception as e:
-                print(f"Erro no listener de replicação: {e}")
-                time.sleep(1)
+                log.error("Erro no listener de replicação: %s", e)
+                self.stopping.wait(1)
+
+    def _tick(self) -> int:
+        """Tick do relógio; dentro de `batch`, consome o bloco reservado para o lote"""
+        ticks = getattr(self.batch_context, "ticks", None)
+        if ticks is not None:
+            clock = next(ticks, None)
+            if clock is not None:
+                return clock
+        return self.clock.tick()
 
     def handle_login(self, data: Dict) -> Dict:
         """Processa login de usuário"""
         user = data.get("user", "").strip()
-        timestamp = data.get("timestamp", time.time())
+        timestamp = data.get("timestamp", self.now())
 
         if not user:
-            clock = self.clock.tick()
+            clock = self._tick()
             return {
                 "service": "login",
                 "data": {
@@ -419,21 +986,23 @@ class Server:
                 }
             }
 
-        # Adicionar usuário se não existir
-        if not self._user_exists(user):
-            self.users.append({
-                "name": user,
-                "login_timestamp": timestamp
-            })
-            self._save_json(self.users_file, self.users)
+        # Adicionar usuário se não existir (origem/seq vão no registro para o catch-up)
+        record = {
+            "name": user,
+            "login_timestamp": timestamp,
+            "origin": self.server_id
+        }
+        if self.users.add(record, self._assign_seq):
+            self._persist(self.users_store.append, record)
 
             # Publicar evento de replicação
             self.publish_event("user_login", {
                 "user": user,
-                "timestamp": timestamp
+                "timestamp": timestamp,
+                "seq": record["seq"]
             })
 
-        clock = self.clock.tick()
+        clock = self._tick()
         return {
             "service": "login",
             "data": {
@@ -443,28 +1012,50 @@ class Server:
             }
         }
 
+    def _list_names(self, service: str, registry: Registry, data: Dict) -> Dict:
+        """Listagem de nomes: completa (pré-serializada em cache), paginada por
+        `cursor`/`limit` ou só os nomes cadastrados desde `since_version`.
+
+        A versão é a posição no registro desta réplica (`replica`); com outra
+        réplica ou versão desconhecida, `since_version` devolve a lista completa
+        com `reset`.
+        """
+        timestamp = data.get("timestamp", self.now())
+        try:
+            start = max(int(data.get("since_version", data.get("cursor", 0)) or 0), 0)
+            limit = data.get("limit")
+            limit = min(max(int(limit), 1), 1000) if limit is not None else None
+        except (TypeError, ValueError):
+            start, limit = 0, None
+
+        result = {"timestamp": timestamp, "replica": self.server_name}
+        version = registry.version
+        if "since_version" in data and (data.get("replica", self.server_name) != self.server_name
+                                        or start > version):
+            start = 0
+            result["reset"] = True
+
+        if start == 0 and limit is None:
+            version, names = registry.listing()
+        else:
+            count = max(version - start, 0)
+            names, position = registry.names_since(start, count if limit is None else min(limit, count))
+            result["next_cursor"] = position if position < version else None
+
+        result.update({"clock": self._tick(), "version": version, service: names})
+        return {"service": service, "data": result}
+
     def handle_users(self, data: Dict) -> Dict:
         """Lista usuários cadastrados"""
-        timestamp = data.get("timestamp", time.time())
-        user_names = [u["name"] for u in self.users]
-
-        clock = self.clock.tick()
-        return {
-            "service": "users",
-            "data": {
-                "timestamp": timestamp,
-                "clock": clock,
-                "users": user_names
-            }
-        }
+        return self._list_names("users", self.users, data)
 
     def handle_channel(self, data: Dict) -> Dict:
         """Cria novo canal"""
         channel = data.get("channel", "").strip()
-        timestamp = data.get("timestamp", time.time())
+        timestamp = data.get("timestamp", self.now())
 
         if not channel:
-            clock = self.clock.tick()
+            clock = self._tick()
             return {
                 "service": "channel",
                 "data": {
@@ -475,21 +1066,23 @@ class Server:
                 }
             }
 
-        # Adicionar canal se não existir
-        if not self._channel_exists(channel):
-            self.channels.append({
-                "name": channel,
-                "created_timestamp": timestamp
-            })
-            self._save_json(self.channels_file, self.channels)
+        # Adicionar canal se não existir (origem/seq vão no registro para o catch-up)
+        record = {
+            "name": channel,
+            "created_timestamp": timestamp,
+            "origin": self.server_id
+        }
+        if self.channels.add(record, self._assign_seq):
+            self._persist(self.channels_store.append, record)
 
             # Publicar evento de replicação
             self.publish_event("channel_create", {
                 "channel": channel,
-                "timestamp": timestamp
+                "timestamp": timestamp,
+                "seq": record["seq"]
             })
 
-        clock = self.clock.tick()
+        clock = self._tick()
         return {
             "service": "channel",
             "data": {
@@ -501,29 +1094,18 @@ class Server:
 
     def handle_channels(self, data: Dict) -> Dict:
         """Lista canais disponíveis"""
-        timestamp = data.get("timestamp", time.time())
-        channel_names = [c["name"] for c in self.channels]
-
-        clock = self.clock.tick()
-        return {
-            "service": "channels",
-            "data": {
-                "timestamp": timestamp,
-                "clock": clock,
-                "channels": channel_names
-            }
-        }
+        return self._list_names("channels", self.channels, data)
 
     def handle_publish(self, data: Dict) -> Dict:
         """Processa publicação em canal"""
         user = data.get("user", "").strip()
         channel = data.get("channel", "").strip()
         message = data.get("message", "").strip()
-        timestamp = data.get("timestamp", time.time())
+        timestamp = data.get("timestamp", self.now())
 
         # Validações
         if not user or not channel or not message:
-            clock = self.clock.tick()
+            clock = self._tick()
             return {
                 "service": "publish",
                 "data": {
@@ -535,7 +1117,7 @@ class Server:
             }
 
         if not self._user_exists(user):
-            clock = self.clock.tick()
+            clock = self._tick()
             return {
                 "service": "publish",
                 "data": {
@@ -547,7 +1129,7 @@ class Server:
             }
 
         if not self._channel_exists(channel):
-            clock = self.clock.tick()
+            clock = self._tick()
             return {
                 "service": "publish",
                 "data": {
@@ -559,7 +1141,7 @@ class Server:
             }
 
         # Tick do relógio antes de publicar
-        clock = self.clock.tick()
+        clock = self._tick()
 
         # Criar dados da mensagem
         message_data = {
@@ -568,7 +1150,9 @@ class Server:
             "message": message,
             "timestamp": timestamp,
             "clock": clock,
-            "type": "publish"
+            "type": "publish",
+            "origin": self.server_id,
+            "seq": self.replication_state.next_seq()
         }
 
         # Persistir
@@ -602,11 +1186,11 @@ class Server:
         src = data.get("src", "").strip()
         dst = data.get("dst", "").strip()
         message = data.get("message", "").strip()
-        timestamp = data.get("timestamp", time.time())
+        timestamp = data.get("timestamp", self.now())
 
         # Validações
         if not src or not dst or not message:
-            clock = self.clock.tick()
+            clock = self._tick()
             return {
                 "service": "message",
                 "data": {
@@ -618,7 +1202,7 @@ class Server:
             }
 
         if not self._user_exists(src):
-            clock = self.clock.tick()
+            clock = self._tick()
             return {
                 "service": "message",
                 "data": {
@@ -630,7 +1214,7 @@ class Server:
             }
 
         if not self._user_exists(dst):
-            clock = self.clock.tick()
+            clock = self._tick()
             return {
                 "service": "message",
                 "data": {
@@ -642,7 +1226,7 @@ class Server:
             }
 
         # Tick do relógio antes de enviar
-        clock = self.clock.tick()
+        clock = self._tick()
 
         # Criar dados da mensagem
         message_data = {
@@ -651,7 +1235,9 @@ class Server:
             "message": message,
             "timestamp": timestamp,
             "clock": clock,
-            "type": "message"
+            "type": "message",
+            "origin": self.server_id,
+            "seq": self.replication_state.next_seq()
         }
 
         # Persistir
@@ -680,6 +1266,133 @@ class Server:
             }
         }
 
+    def handle_history(self, data: Dict) -> Dict:
+        """Consulta histórico de um canal ou de uma conversa privada"""
+        channel = data.get("channel", "").strip()
+        user = data.get("user", "").strip()
+        peer = data.get("peer", "").strip()
+        timestamp = data.get("timestamp", self.now())
+
+        if channel:
+            index, key = self.history["publish"], channel
+        elif user and peer:
+            index, key = self.history["message"], conversation_key(user, peer)
+        else:
+            clock = self._tick()
+            return {
+                "service": "history",
+                "data": {
+                    "status": "erro",
+                    "timestamp": timestamp,
+                    "clock": clock,
+                    "message": "Informe 'channel' ou 'user' e 'peer'"
+                }
+            }
+
+        try:
+            limit = min(max(int(data.get("limit", 100)), 1), 1000)
+        except (TypeError, ValueError):
+            limit = 100
+
+        messages, has_more = index.query(
+            key,
+            clock_range=(data.get("from_clock"), data.get("to_clock")),
+            time_range=(data.get("from_timestamp"), data.get("to_timestamp")),
+            limit=limit
+        )
+
+        clock = self._tick()
+        return {
+            "service": "history",
+            "data": {
+                "status": "OK",
+                "timestamp": timestamp,
+                "clock": clock,
+                "messages": messages,
+                "has_more": has_more
+            }
+        }
+
+    def handle_batch(self, data: Dict) -> Dict:
+        """Executa uma lista ordenada de requisições em uma só ida e volta.
+
+        Cada item é processado como uma requisição comum e tem seu próprio
+        resultado. Os ticks de relógio do lote (um por item e um da resposta)
+        são reservados de uma vez, as gravações dos itens adiam a política de
+        durabilidade para um flush único no fim e os eventos de replicação
+        saem em um único lote.
+        """
+        requests = data.get("requests")
+        timestamp = data.get("timestamp", self.now())
+
+        if not isinstance(requests, list) or not requests or len(requests) > self.batch_max_items:
+            clock = self._tick()
+            return {
+                "service": "batch",
+                "data": {
+                    "status": "erro",
+                    "timestamp": timestamp,
+                    "clock": clock,
+                    "description": f"'requests' deve ser uma lista de 1 a {self.batch_max_items} requisições"
+                }
+            }
+
+        # Um recebimento para o lote inteiro: relógio vai além do maior clock dos itens
+        clocks = [item["data"].get("clock") for item in requests
+                  if isinstance(item, dict) and isinstance(item.get("data"), dict)]
+        latest = max((c for c in clocks if isinstance(c, int)), default=0)
+        if latest > self.clock.get_time():
+            self.clock.update(latest)
+        first = self.clock.reserve(len(requests) + 1)
+
+        results = []
+        events: List[Dict] = []
+        self.batch_context.events = events
+        self.batch_context.ticks = iter(range(first, first + len(requests) + 1))
+        try:
+            for request in requests:
+                if not isinstance(request, dict) or request.get("service") == "batch":
+                    results.append({
+                        "service": request.get("service", "unknown") if isinstance(request, dict) else "unknown",
+                        "data": {
+                            "status": "erro",
+                            "timestamp": timestamp,
+                            "clock": self._tick(),
+                            "description": "Item inválido (batch aninhado ou fora do formato {service, data})"
+                        }
+                    })
+                    continue
+                try:
+                    results.append(self.process_request(request))
+                except Exception as e:
+                    log.error("Erro em item de batch %s: %s", request.get("service"), e)
+                    results.append({
+                        "service": request.get("service"),
+                        "data": {
+                            "status": "erro",
+                            "timestamp": timestamp,
+                            "clock": self._tick(),
+                            "description": "Erro interno"
+                        }
+                    })
+            clock = self._tick()
+        finally:
+            self.batch_context.ticks = None
+            self.batch_context.events = None
+            if events:
+                self.replication_batcher.add_many(events)
+            self._persist(self._flush_batch)
+
+        return {
+            "service": "batch",
+            "data": {
+                "status": "OK",
+                "timestamp": timestamp,
+                "clock": clock,
+                "results": results
+            }
+        }
+
     def process_request(self, request: Dict) -> Dict:
         """Processa requisição e retorna resposta"""
         service = request.get("service")
@@ -697,10 +1410,14 @@ class Server:
             return self.handle_publish(data)
         elif service == "message":
             return self.handle_message(data)
+        elif service == "history":
+            return self.handle_history(data)
+        elif service == "batch":
+            return self.handle_batch(data)
         else:
             # Serviço desconhecido
-            timestamp = data.get("timestamp", time.time())
-            clock = self.clock.tick()
+            timestamp = data.get("timestamp", self.now())
+            clock = self._tick()
             return {
                 "service": service or "unknown",
                 "data": {
@@ -711,41 +1428,152 @@ class Server:
                 }
             }
 
-    def run(self):
-        """Loop principal do servidor"""
-        print(f"Servidor iniciado (SERDE={serializer.format}). Aguardando conexões...")
-        try:
-            while True:
-                # Receber mensagem
-                raw_message = self.socket.recv()
-                message = serializer.deserialize(raw_message)
-
-                # Atualizar relógio ao receber mensagem
-                if 'clock' in message.get('data', {}):
-                    self.clock.update(message['data']['clock'])
-
-                print(f"Recebido (clock={self.clock.get_time()}): {message}")
+    def handle_raw(self, raw_message) -> bytes:
+        """Desserializa, processa e serializa uma requisição.
 
-                # Processar
-                response = self.process_request(message)
-                print(f"Enviando (clock={self.clock.get_time()}): {response}")
+        Aceita bytes ou zmq.Frame; a resposta usa o mesmo formato da requisição.
+        Com métricas ligadas, mede desserialização, processamento e serialização.
+        """
+        timer = self.metrics.start()
+        service = "unknown"
+        try:
+            message, fmt = serializer.decode(raw_message)
+            if message.get("service") in SERVICES:
+                service = message["service"]
+            if timer:
+                timer.mark("deserialize")
+
+            # Atualizar relógio ao receber mensagem
+            if 'clock' in message.get('data', {}):
+                self.clock.update(message['data']['clock'])
+
+            # Processar
+            response = self.process_request(message)
+            if trace_enabled():
+                log.debug("requisição", extra=kv(clock=self.clock.get_time(), request=message, response=response))
+
+            # Verificar sincronização Berkeley
+            self.check_berkeley_sync()
+            if timer:
+                timer.mark("handle")
+
+            raw_response = serializer.serialize(response, fmt)
+        except Exception:
+            if timer:
+                self.metrics.finish(timer, service, True)
+            raise
+
+        if timer:
+            timer.mark("serialize")
+            self.metrics.finish(timer, service, response.get("data", {}).get("status") == "erro")
+        return raw_response
+
+    def error_reply(self, raw_message, error: Exception) -> bytes:
+        """Resposta de erro para uma requisição cujo processamento falhou"""
+        try:
+            request, fmt = serializer.decode(raw_message)
+            service = request.get("service") or "unknown"
+        except Exception:
+            fmt, service = None, "unknown"
+        return serializer.serialize({
+            "service": service,
+            "data": {
+                "status": "erro",
+                "timestamp": self.now(),
+                "clock": self.clock.tick(),
+                "description": f"Erro interno: {error}"
+            }
+        }, fmt)
 
-                # Verificar sincronização Berkeley
-                self.check_berkeley_sync()
+    def handle_request(self, raw_message) -> bytes:
+        """`handle_raw` que sempre responde: falhas viram resposta de erro"""
+        try:
+            return self.handle_raw(raw_message)
+        except Exception as e:
+            log.error("Erro ao processar requisição: %s", e)
+            return self.error_reply(raw_message, e)
+
+    @staticmethod
+    def _request_key(request: Dict) -> str:
+        data = request.get("data") if isinstance(request, dict) else None
+        if not isinstance(data, dict):
+            return ""
+        if request.get("service") == "batch" and isinstance(data.get("requests"), list):
+            # O broker divide lotes mistos: os itens de um lote têm a mesma chave
+            return next(filter(None, map(Server._request_key, data["requests"])), "")
+        return data.get("user") or data.get("src") or data.get("channel") or ""
+
+    def routing_key(self, raw_message) -> str:
+        """Chave de ordenação da requisição (usuário de origem; em `batch`, o dos itens)"""
+        return self._request_key(serializer.deserialize(raw_message))
+
+    def _on_sigterm(self, signum, frame):
+        """`docker stop`: encerra como no Ctrl+C (o loop principal sai e `close` roda)"""
+        log.info("SIGTERM recebido; encerrando")
+        self.stopping.set()
 
-                # Enviar resposta
-                self.socket.send(serializer.serialize(response))
+    def run(self):
+        """Loop principal do servidor"""
+        log.info("Servidor iniciado. Aguardando conexões...",
+                 extra=kv(serde=serializer.format, workers=self.workers, server=self.server_name))
+        signal.signal(signal.SIGTERM, self._on_sigterm)
+        try:
+            if self.workers > 1:
+                pool = WorkerPool(self.context, "tcp://broker:5556",
+                                  self.handle_raw, self.routing_key, self.workers,
+                                  server_capacity(self.workers),
+                                  self.server_name.encode('utf-8'),
+                                  self.error_reply, self.stopping)
+                pool.run()
+            else:
+                link = BrokerLink(self.socket, server_capacity(1))
+                link.ready()
+                while not self.stopping.is_set():
+                    if self.socket.poll(HEARTBEAT_INTERVAL * 1000):
+                        request = link.parse(self.socket.recv_multipart(copy=False))
+                        if request:
+                            envelope, raw_message = request
+                            link.reply(envelope, self.handle_request(raw_message))
+                    link.heartbeat_if_due()
 
         except KeyboardInterrupt:
-            print("Servidor interrompido.")
+            log.info("Servidor interrompido.")
         finally:
+            self.close()
+
+    def close(self):
+        """Para as threads, grava pendências em disco e fecha os sockets"""
+        self.stop_maintenance_threads()
+        try:
+            # Saída voluntária: a referência anuncia sem esperar o TTL
+            self.reference.call(self._reference_request("leave"))
+        except Exception as e:
+            log.warning("Erro ao sair da referência: %s", e)
+        self.replication_batcher.flush()
+        if self.persist_executor is not None:
+            self.persist_executor.shutdown(wait=True)
+        self.users_store.close()
+        self.channels_store.close()
+        self.replication_state.save()
+        for index in self.history.values():
+            index.close()
+        for message_log in self.message_logs.values():
+            message_log.close()
+        if self.socket:
             self.socket.close()
-            self.pub_socket.close()
-            self.ref_socket.close()
-            self.rep_socket.close()
-            self.context.term()
+        for pub_socket in self.pub_sockets:
+            pub_socket.close()
+        self.reference.close()
+        self.rep_socket.close()
+        self.peer_socket.close()
+        self.context.term()
+        self.data_lock.close()
 
 if __name__ == "__main__":
     server_name = os.getenv("SERVER_NAME")
-    server = Server(server_name)
+    if os.getenv("SERVER_ENGINE", "threads").lower() == "asyncio":
+        from aio_server import AsyncServer
+        server = AsyncServer(server_name)
+    else:
+        server = Server(server_name)
     server.run()
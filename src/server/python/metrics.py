@@ -0,0 +1,210 @@
+import os
+import sys
+import time
+import threading
+import contextlib
+from typing import Any, Dict, List, Optional
+
+# Etapas de uma requisição; "handle" inclui "persist" e "publish"
+STAGES = ("deserialize", "handle", "persist", "publish", "serialize", "total")
+
+
+class Histogram:
+    """Histograma log-linear de latências em microssegundos (estilo HDR).
+
+    Valores abaixo de 2^`precision_bits` têm bucket próprio; acima disso,
+    cada potência de dois é dividida em 2^(`precision_bits` - 1) buckets,
+    com erro relativo de no máximo 1/2^(`precision_bits` - 1). Gravar é um
+    cálculo de índice e um incremento; não é thread-safe (ver `Metrics`).
+    """
+
+    def __init__(self, precision_bits: int = 7, max_value_us: int = 60_000_000):
+        self.bits = precision_bits
+        self.half = 1 << (precision_bits - 1)
+        self.max_value = max_value_us
+        self.counts = [0] * (self._index(max_value_us) + 1)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def _index(self, value: int) -> int:
+        shift = value.bit_length() - self.bits
+        if shift <= 0:
+            return value
+        return (shift << (self.bits - 1)) + (value >> shift)
+
+    def _highest(self, index: int) -> int:
+        """Maior valor que cai no bucket `index`"""
+        if index < 2 * self.half:
+            return index
+        shift = index // self.half - 1
+        return ((index - shift * self.half + 1) << shift) - 1
+
+    def record(self, value_us: int):
+        value = min(max(value_us, 0), self.max_value)
+        self.counts[self._index(value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, q: float) -> int:
+        """Valor (us) abaixo do qual está a fração `q` das amostras"""
+        if not self.count:
+            return 0
+        target = max(1, int(q * self.count + 0.5))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return min(self._highest(index), self.max)
+        return self.max
+
+    def summary(self) -> Dict[str, Any]:
+        """Resumo em milissegundos"""
+        ms = lambda us: round(us / 1000.0, 3)
+        return {
+            "count": self.count,
+            "mean_ms": ms(self.total / self.count) if self.count else 0.0,
+            "p50_ms": ms(self.percentile(0.50)),
+            "p90_ms": ms(self.percentile(0.90)),
+            "p99_ms": ms(self.percentile(0.99)),
+            "p999_ms": ms(self.percentile(0.999)),
+            "max_ms": ms(self.max),
+        }
+
+
+class ServiceStats:
+    """Contadores e histogramas por etapa de um serviço"""
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.stages: Dict[str, Histogram] = {}
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "stages": {stage: self.stages[stage].summary() for stage in STAGES if stage in self.stages},
+        }
+
+
+class RequestTimer:
+    """Tempos das etapas de uma requisição em andamento (uma thread)"""
+    __slots__ = ("started", "last", "stages")
+
+    def __init__(self):
+        self.started = self.last = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+
+    def mark(self, stage: str):
+        """Fecha a etapa `stage`: tempo desde a marca anterior"""
+        now = time.perf_counter()
+        self.stages[stage] = self.stages.get(stage, 0.0) + (now - self.last)
+        self.last = now
+
+
+class _Stage:
+    """Soma o tempo do bloco à etapa `name` da requisição corrente"""
+    __slots__ = ("timer", "name", "started")
+
+    def __init__(self, timer: RequestTimer, name: str):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+
+    def __exit__(self, *exc):
+        stages = self.timer.stages
+        stages[self.name] = stages.get(self.name, 0.0) + (time.perf_counter() - self.started)
+        return False
+
+
+_NOOP = contextlib.nullcontext()
+
+
+class Metrics:
+    """Métricas por serviço do servidor (SERVER_STATS=1).
+
+    `start` abre a medição de uma requisição na thread atual; `stage` mede
+    trechos internos (persistência, publicação) da requisição corrente e
+    `finish` grava tudo com uma única aquisição do lock. Desligado, `start`
+    devolve None e `stage` um context manager vazio.
+    """
+
+    def __init__(self, enabled: Optional[bool] = None):
+        self.enabled = os.getenv("SERVER_STATS", "0") == "1" if enabled is None else enabled
+        self.services: Dict[str, ServiceStats] = {}
+        self.since = time.time()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def start(self) -> Optional[RequestTimer]:
+        if not self.enabled:
+            return None
+        timer = self._local.timer = RequestTimer()
+        return timer
+
+    def stage(self, name: str):
+        if not self.enabled:
+            return _NOOP
+        timer = getattr(self._local, "timer", None)
+        if timer is None:
+            return _NOOP
+        return _Stage(timer, name)
+
+    def finish(self, timer: RequestTimer, service: str, error: bool):
+        self._local.timer = None
+        timer.stages["total"] = time.perf_counter() - timer.started
+        with self._lock:
+            stats = self.services.get(service)
+            if stats is None:
+                stats = self.services[service] = ServiceStats()
+            stats.requests += 1
+            if error:
+                stats.errors += 1
+            for stage, seconds in timer.stages.items():
+                histogram = stats.stages.get(stage)
+                if histogram is None:
+                    histogram = stats.stages[stage] = Histogram()
+                histogram.record(int(seconds * 1_000_000))
+
+    def snapshot(self, reset: bool = False) -> Dict[str, Any]:
+        with self._lock:
+            snapshot = {
+                "enabled": self.enabled,
+                "since": self.since,
+                "services": {name: stats.snapshot() for name, stats in sorted(self.services.items())},
+            }
+            if reset:
+                self.services = {}
+                self.since = time.time()
+        return snapshot
+
+
+def render_text(server: str, snapshot: Dict[str, Any]) -> str:
+    """Uma linha `chave=valor` por serviço e etapa"""
+    lines: List[str] = []
+    for service, stats in snapshot.get("services", {}).items():
+        lines.append(f"server={server} service={service} requests={stats['requests']} errors={stats['errors']}")
+        for stage, summary in stats["stages"].items():
+            fields = " ".join(f"{k}={v}" for k, v in summary.items())
+            lines.append(f"server={server} service={service} stage={stage} {fields}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    # Coleta as métricas pela porta de pares: python metrics.py [servidor ...]
+    from serde import serializer
+    from peers import scatter
+
+    peers = sys.argv[1:] or ["server"]
+    payload = serializer.serialize({"service": "stats", "data": {"format": "text"}}, serializer.plain)
+    replies = scatter(peers, int(os.getenv("PEER_PORT", "5560")), payload, 2000)
+    for peer in peers:
+        if peer not in replies:
+            print(f"server={peer} status=timeout")
+            continue
+        print(serializer.deserialize(replies[peer][0]).get("data", {}).get("text", ""))
@@ -0,0 +1,185 @@
+import os
+import re
+import json
+import time
+import threading
+from typing import Dict, List, Any, Tuple
+from logs import get_logger
+
+log = get_logger("msglog")
+
+
+class MessageLog:
+    """Log JSONL de mensagens com handle persistente e segmentos rotativos.
+
+    As linhas são acumuladas em um buffer limitado (`buffer_bytes`) e gravadas
+    no segmento ativo conforme a política de durabilidade:
+
+    - `every`: grava a cada mensagem
+    - `interval`: grava a cada `flush_n` ms (thread em background)
+    - `count`: grava a cada `flush_n` mensagens ou após `max_delay_ms` ms,
+      o que vier primeiro
+
+    Segmentos são arquivos `<nome>.<seq>.jsonl`; um novo segmento é aberto
+    quando o ativo passa de `segment_bytes` ou fica aberto por mais de
+    `segment_seconds` (0 desativa o critério).
+    """
+
+    POLICIES = ("every", "interval", "count")
+
+    def __init__(self, directory: str, name: str, policy: str = "interval", flush_n: int = 100,
+                 buffer_bytes: int = 1 << 20, segment_bytes: int = 64 << 20,
+                 segment_seconds: int = 0, fsync: bool = False, max_delay_ms: int = 1000):
+        if policy not in self.POLICIES:
+            raise ValueError(f"Política de gravação desconhecida: {policy!r} "
+                             f"(use {', '.join(self.POLICIES)})")
+        self.directory = directory
+        self.name = name
+        self.policy = policy
+        self.flush_n = max(flush_n, 1)
+        self.max_delay_ms = max(max_delay_ms, 1)
+        self.buffer_bytes = buffer_bytes
+        self.segment_bytes = segment_bytes
+        self.segment_seconds = segment_seconds
+        self.fsync = fsync
+
+        self._lock = threading.Lock()
+        self._pending: List[bytes] = []
+        self._pending_bytes = 0
+        self._file = None
+        self._segment = 0
+        self._offset = 0  # posição lógica no segmento (arquivo + buffer)
+        self._opened_at = 0.0
+        self._closed = False
+
+        os.makedirs(directory, exist_ok=True)
+        segments = self.segments()
+        legacy = os.path.join(directory, f"{name}.jsonl")
+        if not segments and os.path.exists(legacy):
+            # Arquivo único do formato antigo vira o primeiro segmento
+            os.replace(legacy, self.segment_path(1))
+            segments = [1]
+        self._open_segment(segments[-1] if segments else 1)
+
+        if self.policy == "interval":
+            self._flush_interval = self.flush_n / 1000.0
+        elif self.policy == "count":
+            # Limite de tempo para o resto que não completa `flush_n`
+            self._flush_interval = self.max_delay_ms / 1000.0
+        if self.policy != "every":
+            threading.Thread(target=self._flush_loop, daemon=True).start()
+
+    def segment_path(self, segment: int) -> str:
+        return os.path.join(self.directory, f"{self.name}.{segment:06d}.jsonl")
+
+    def segments(self) -> List[int]:
+        """Sequências dos segmentos existentes em ordem crescente"""
+        pattern = re.compile(rf"^{re.escape(self.name)}\.(\d+)\.jsonl$")
+        found = []
+        for filename in os.listdir(self.directory):
+            match = pattern.match(filename)
+            if match:
+                found.append(int(match.group(1)))
+        return sorted(found)
+
+    def _open_segment(self, segment: int):
+        self._segment = segment
+        self._file = open(self.segment_path(segment), 'ab')
+        self._offset = self._file.tell()
+        self._opened_at = time.time()
+
+    def _should_rotate(self) -> bool:
+        if self._offset == 0:
+            return False
+        if self.segment_bytes and self._offset >= self.segment_bytes:
+            return True
+        if self.segment_seconds and time.time() - self._opened_at >= self.segment_seconds:
+            return True
+        return False
+
+    def _rotate(self):
+        """Fecha o segmento ativo e abre o próximo (chamar com lock)"""
+        self._flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        self._open_segment(self._segment + 1)
+
+    def append(self, record: Dict[str, Any], defer: bool = False) -> Tuple[int, int]:
+        """Anexa registro e retorna (segmento, offset) da linha gravada.
+
+        Com `defer`, a política de durabilidade é ignorada (o chamador faz
+        `flush` ao fim do lote); o limite do buffer continua valendo.
+        """
+        line = (json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8')
+        with self._lock:
+            if self._should_rotate():
+                self._rotate()
+
+            position = (self._segment, self._offset)
+            self._pending.append(line)
+            self._pending_bytes += len(line)
+            self._offset += len(line)
+
+            if self._pending_bytes >= self.buffer_bytes or (not defer and (
+                    self.policy == "every"
+                    or (self.policy == "count" and len(self._pending) >= self.flush_n))):
+                self._flush()
+
+            return position
+
+    def _flush(self):
+        """Grava o buffer no segmento ativo (chamar com lock)"""
+        if not self._pending:
+            return
+        self._file.write(b''.join(self._pending))
+        self._pending.clear()
+        self._pending_bytes = 0
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+    def flush(self):
+        with self._lock:
+            if self._file:
+                self._flush()
+
+    def _flush_loop(self):
+        """Grava o buffer periodicamente (`interval` e atraso máximo do `count`)"""
+        while not self._closed:
+            time.sleep(self._flush_interval)
+            with self._lock:
+                if self._file is None:
+                    return
+                try:
+                    if self._should_rotate():
+                        self._rotate()
+                    else:
+                        self._flush()
+                except OSError as e:
+                    log.error("Erro ao gravar log %s: %s", self.name, e)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            if self._file:
+                self._flush()
+                os.fsync(self._file.fileno())
+                self._file.close()
+                self._file = None
+
+
+def open_message_logs(directory: str) -> Dict[str, MessageLog]:
+    """Cria os logs de mensagens (publish/message) a partir do ambiente"""
+    options = {
+        "policy": os.getenv("MSGLOG_FLUSH", "interval").lower(),
+        "flush_n": int(os.getenv("MSGLOG_FLUSH_N", "100")),
+        "buffer_bytes": int(os.getenv("MSGLOG_BUFFER_BYTES", str(1 << 20))),
+        "segment_bytes": int(os.getenv("MSGLOG_SEGMENT_BYTES", str(64 << 20))),
+        "segment_seconds": int(os.getenv("MSGLOG_SEGMENT_SECONDS", "0")),
+        "fsync": os.getenv("MSGLOG_FSYNC", "0") == "1",
+        "max_delay_ms": int(os.getenv("MSGLOG_FLUSH_MAX_MS", "1000")),
+    }
+    return {
+        message_type: MessageLog(directory, f"{message_type}s", **options)
+        for message_type in ("publish", "message")
+    }
@@ -0,0 +1,82 @@
+import time
+import asyncio
+from typing import Dict, List, Tuple
+import zmq
+import zmq.asyncio
+
+
+def scatter(peers: List[str], port: int, payload: bytes, timeout_ms: int,
+            first_only: bool = False) -> Dict[str, Tuple[bytes, float, float]]:
+    """Envia a mesma requisição a vários pares em paralelo, com um único prazo.
+
+    Um REQ por par; as respostas são coletadas por poll até todas chegarem,
+    até o prazo comum (`timeout_ms`) ou, com `first_only`, até a primeira.
+    A latência não cresce com o número de pares. Retorna
+    {par: (resposta, instante do envio, instante da resposta)}; pares que
+    não responderam a tempo ficam de fora.
+    """
+    context = zmq.Context.instance()
+    poller = zmq.Poller()
+    sockets: Dict[zmq.Socket, Tuple[str, float]] = {}
+    for peer in peers:
+        socket = context.socket(zmq.REQ)
+        socket.setsockopt(zmq.LINGER, 0)
+        socket.connect(f"tcp://{peer}:{port}")
+        sockets[socket] = (peer, time.time())
+        socket.send(payload)
+        poller.register(socket, zmq.POLLIN)
+
+    replies: Dict[str, Tuple[bytes, float, float]] = {}
+    deadline = time.time() + timeout_ms / 1000.0
+    try:
+        while len(replies) < len(sockets):
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            for socket, _ in poller.poll(remaining * 1000):
+                raw = socket.recv()
+                peer, sent_at = sockets[socket]
+                replies[peer] = (raw, sent_at, time.time())
+                poller.unregister(socket)
+            if first_only and replies:
+                break
+    finally:
+        for socket in sockets:
+            socket.close()
+    return replies
+
+
+async def scatter_async(context: zmq.asyncio.Context, peers: List[str], port: int, payload: bytes,
+                        timeout_ms: int, first_only: bool = False) -> Dict[str, Tuple[bytes, float, float]]:
+    """`scatter` para a engine asyncio: sockets `zmq.asyncio` no event loop"""
+    sockets: List[zmq.asyncio.Socket] = []
+
+    async def ask(peer: str) -> Tuple[str, Tuple[bytes, float, float]]:
+        socket = context.socket(zmq.REQ)
+        socket.setsockopt(zmq.LINGER, 0)
+        sockets.append(socket)
+        socket.connect(f"tcp://{peer}:{port}")
+        sent_at = time.time()
+        await socket.send(payload)
+        raw = await socket.recv()
+        return peer, (raw, sent_at, time.time())
+
+    tasks = [asyncio.ensure_future(ask(peer)) for peer in peers]
+    replies: Dict[str, Tuple[bytes, float, float]] = {}
+    if not tasks:
+        return replies
+    try:
+        done, pending = await asyncio.wait(
+            tasks, timeout=timeout_ms / 1000.0,
+            return_when=asyncio.FIRST_COMPLETED if first_only else asyncio.ALL_COMPLETED
+        )
+        for task in pending:
+            task.cancel()
+        for task in done:
+            if not task.cancelled() and task.exception() is None:
+                peer, reply = task.result()
+                replies[peer] = reply
+    finally:
+        for socket in sockets:
+            socket.close()
+    return replies
@@ -0,0 +1,148 @@
+import os
+import time
+import asyncio
+import threading
+from typing import Dict, Optional
+import zmq
+import zmq.asyncio
+from serde import serializer
+
+
+class ReferenceUnavailable(Exception):
+    """Referência não respondeu dentro do prazo (ou está em backoff)"""
+
+
+class ReferenceClient:
+    """Cliente REQ da referência com timeout, reconexão e backoff (lazy pirate).
+
+    Cada chamada espera a resposta com poll limitado a `timeout_ms`. Sem
+    resposta, o socket REQ é descartado e recriado (sai do estado
+    send/recv travado) e a requisição é reenviada até `retries` vezes.
+    Esgotadas as tentativas, novas chamadas falham de imediato durante um
+    backoff exponencial. A última lista de servidores fica em cache e é
+    devolvida a quem pede enquanto outra atualização está em andamento.
+    """
+
+    def __init__(self, endpoint: str, timeout_ms: int = 2000, retries: int = 3,
+                 backoff_base: float = 0.5, backoff_max: float = 30.0):
+        self.endpoint = endpoint
+        self.timeout_ms = timeout_ms
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self.context = zmq.Context.instance()
+        self.socket: Optional[zmq.Socket] = None
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.retry_at = 0.0
+
+        self.cached_list: Optional[Dict] = None
+        self.list_lock = threading.Lock()
+
+    def _connect(self):
+        self.socket = self.context.socket(zmq.REQ)
+        self.socket.setsockopt(zmq.LINGER, 0)
+        self.socket.connect(self.endpoint)
+
+    def _discard(self):
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
+
+    def _check_backoff(self):
+        if time.time() < self.retry_at:
+            raise ReferenceUnavailable(f"referência em backoff por {self.retry_at - time.time():.1f}s")
+
+    def _give_up(self) -> ReferenceUnavailable:
+        """Registra a falha, agenda o backoff e devolve o erro a lançar"""
+        self.failures += 1
+        delay = min(self.backoff_max, self.backoff_base * (2 ** (self.failures - 1)))
+        self.retry_at = time.time() + delay
+        return ReferenceUnavailable(
+            f"sem resposta após {self.retries} tentativas; nova tentativa em {delay:.1f}s"
+        )
+
+    def call(self, request: Dict) -> Dict:
+        """Envia requisição e aguarda resposta; ReferenceUnavailable em caso de falha"""
+        with self.lock:
+            self._check_backoff()
+            payload = serializer.serialize(request, serializer.plain)
+            for _ in range(self.retries):
+                if self.socket is None:
+                    self._connect()
+                self.socket.send(payload)
+                if self.socket.poll(self.timeout_ms, zmq.POLLIN):
+                    response = serializer.deserialize(self.socket.recv())
+                    self.failures = 0
+                    return response
+                # Sem resposta: REQ fica preso esperando recv, recria o socket
+                self._discard()
+            raise self._give_up()
+
+    def list_servers(self, request: Dict) -> Optional[Dict]:
+        """Resposta de `list`; com outra atualização em andamento, devolve o cache"""
+        if not self.list_lock.acquire(blocking=False):
+            return self.cached_list
+        try:
+            self.cached_list = self.call(request)
+            return self.cached_list
+        finally:
+            self.list_lock.release()
+
+    def close(self):
+        with self.lock:
+            self._discard()
+
+
+class AsyncReferenceClient(ReferenceClient):
+    """`ReferenceClient` para a engine asyncio: socket `zmq.asyncio` no próprio
+    event loop, com prazo por `asyncio.wait_for` (sem threads auxiliares)"""
+
+    def __init__(self, *args, context: zmq.asyncio.Context, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.context = context
+        self.lock = asyncio.Lock()
+        self.listing = False
+
+    async def call(self, request: Dict) -> Dict:
+        async with self.lock:
+            self._check_backoff()
+            payload = serializer.serialize(request, serializer.plain)
+            for _ in range(self.retries):
+                if self.socket is None:
+                    self._connect()
+                await self.socket.send(payload)
+                try:
+                    raw = await asyncio.wait_for(self.socket.recv(), self.timeout_ms / 1000.0)
+                except asyncio.TimeoutError:
+                    self._discard()
+                    continue
+                self.failures = 0
+                return serializer.deserialize(raw)
+            raise self._give_up()
+
+    async def list_servers(self, request: Dict) -> Optional[Dict]:
+        if self.listing:
+            return self.cached_list
+        self.listing = True
+        try:
+            self.cached_list = await self.call(request)
+            return self.cached_list
+        finally:
+            self.listing = False
+
+    def close(self):
+        self._discard()
+
+
+def reference_client(client_class=ReferenceClient, **kwargs) -> ReferenceClient:
+    """Cliente da referência configurado por variáveis de ambiente"""
+    return client_class(
+        os.getenv("REFERENCE_ENDPOINT", "tcp://reference:5559"),
+        int(os.getenv("REFERENCE_TIMEOUT_MS", "2000")),
+        int(os.getenv("REFERENCE_RETRIES", "3")),
+        float(os.getenv("REFERENCE_BACKOFF_MS", "500")) / 1000.0,
+        float(os.getenv("REFERENCE_BACKOFF_MAX_MS", "30000")) / 1000.0,
+        **kwargs
+    )
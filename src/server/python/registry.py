@@ -0,0 +1,82 @@
+import threading
+from typing import Callable, Dict, List, Any, Iterable, Optional, Tuple
+from serde import Encoded
+
+
+class Registry:
+    """Registro indexado por nome (usuários ou canais).
+
+    Mantém os registros em um dict, que preserva a ordem de inserção,
+    permitindo verificação de existência em O(1) e listagem na ordem
+    em que os nomes foram cadastrados.
+
+    Só cresce: a versão é o número de registros, e a posição de um nome
+    não muda. "Mudanças desde a versão N" são os nomes a partir da
+    posição N.
+    """
+
+    def __init__(self, records: Optional[Iterable[Dict[str, Any]]] = None, key: str = "name"):
+        self.key = key
+        self._index: Dict[str, Dict[str, Any]] = {}
+        self._records: List[Dict[str, Any]] = []  # mesma ordem, acesso por posição
+        self._lock = threading.Lock()
+        self._listing: Optional[Tuple[int, Encoded]] = None
+        for record in records or []:
+            self.add(record)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._index
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def get(self, name: str) -> Optional[Dict[str, Any]]:
+        """Retorna o registro pelo nome ou None"""
+        return self._index.get(name)
+
+    def add(self, record: Dict[str, Any],
+            on_insert: Optional[Callable[[Dict[str, Any]], None]] = None) -> bool:
+        """Adiciona registro se o nome ainda não existir. Retorna True se inseriu.
+
+        `on_insert` completa o registro antes de ele ficar visível (só quando insere).
+        """
+        name = record.get(self.key)
+        if not name:
+            return False
+        with self._lock:
+            if name in self._index:
+                return False
+            if on_insert is not None:
+                on_insert(record)
+            self._index[name] = record
+            self._records.append(record)
+            return True
+
+    @property
+    def version(self) -> int:
+        return len(self._records)
+
+    def listing(self) -> Tuple[int, Encoded]:
+        """(versão, lista completa de nomes pré-serializada); refeita só após `add`"""
+        listing = self._listing
+        if listing is None or listing[0] != len(self._records):
+            with self._lock:
+                listing = self._listing = (len(self._records), Encoded(list(self._index)))
+        return listing
+
+    def names_since(self, start: int, limit: Optional[int] = None) -> Tuple[List[str], int]:
+        """Nomes a partir da posição `start` (até `limit`) e a posição seguinte"""
+        records = self._records[start:] if limit is None else self._records[start:start + limit]
+        return [record[self.key] for record in records], start + len(records)
+
+    def names(self) -> List[str]:
+        """Lista de nomes na ordem de inserção"""
+        return list(self._index)
+
+    def records(self) -> List[Dict[str, Any]]:
+        """Lista de registros na ordem de inserção (formato persistido)"""
+        return list(self._records)
+
+    def slice(self, start: int, count: int) -> List[Dict[str, Any]]:
+        """Trecho dos registros por posição (transferência em blocos)"""
+        return self._records[start:start + count]
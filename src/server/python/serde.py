@@ -1,35 +1,186 @@
 import os
 import json
+import secrets
+import threading
+from typing import Any, Dict, Optional, Tuple
 try:
     import msgpack
     MSGPACK_AVAILABLE = True
 except ImportError:
     MSGPACK_AVAILABLE = False
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+# Byte de formato opcional no início da mensagem. Não colide com o primeiro
+# byte de um JSON ('{', '[', espaço) nem de um mapa msgpack (0x80-0x8f, 0xde, 0xdf).
+TAG_JSON = 0x01
+TAG_MSGPACK = 0x02
+
+# Primeiros bytes que identificam JSON sem byte de formato ('{', '[' ou espaço
+# em branco). Broker, bench e clientes Node usam o mesmo conjunto.
+JSON_LEAD = b'{[ \t\r\n'
+
+# Marcas de valores pré-serializados usados na mensagem em codificação (por thread)
+_pending = threading.local()
+
+
+class Encoded:
+    """Valor serializado uma vez por codec e inserido pronto nas mensagens.
+
+    Na codificação, o valor entra como uma string-marca (via `default` do
+    codec) que depois é trocada pelos bytes em cache; JSON e msgpack
+    aceitam essa concatenação. Para valores imutáveis (listagens em cache).
+    """
+
+    def __init__(self, value: Any):
+        self.value = value
+        self.marker = f"__encoded_{secrets.token_hex(12)}__"
+        self._cache: Dict[str, Tuple[bytes, bytes]] = {}
+
+    def encoded(self, codec: "Codec") -> Tuple[bytes, bytes]:
+        """(bytes da marca, bytes do valor) no codec; calculado na primeira vez"""
+        entry = self._cache.get(codec.name)
+        if entry is None:
+            entry = self._cache[codec.name] = (codec.encode(self.marker), codec.encode(self.value))
+        return entry
+
+    def __repr__(self):
+        return f"Encoded({len(self.value)} itens)" if hasattr(self.value, "__len__") else "Encoded(...)"
+
+
+def _default(obj: Any) -> Any:
+    """`default` dos codecs: troca um `Encoded` pela sua marca"""
+    if isinstance(obj, Encoded):
+        used = getattr(_pending, "values", None)
+        if used is None:
+            used = _pending.values = []
+        used.append(obj)
+        return obj.marker
+    raise TypeError(f"Tipo não serializável: {type(obj).__name__}")
+
+
+class Codec:
+    """Codec de serialização registrado no `Serializer`"""
+    name = ""
+    tag = 0
+
+    def encode(self, data: Any) -> bytes:
+        raise NotImplementedError
+
+    def decode(self, buffer: memoryview) -> Any:
+        raise NotImplementedError
+
+
+class JsonCodec(Codec):
+    """JSON da biblioteca padrão"""
+    name = "JSON"
+    tag = TAG_JSON
+
+    def encode(self, data):
+        return json.dumps(data, ensure_ascii=False, default=_default).encode('utf-8')
+
+    def decode(self, buffer):
+        return json.loads(bytes(buffer).decode('utf-8'))
+
+
+class OrjsonCodec(JsonCodec):
+    """JSON via orjson (mesmo formato na rede, decodifica direto do buffer)"""
+
+    def encode(self, data):
+        return orjson.dumps(data, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+    def decode(self, buffer):
+        return orjson.loads(buffer)
+
+
+class MsgpackCodec(Codec):
+    """MessagePack com um Packer reutilizado por thread"""
+    name = "MSGPACK"
+    tag = TAG_MSGPACK
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def encode(self, data):
+        packer = getattr(self._local, "packer", None)
+        if packer is None:
+            packer = self._local.packer = msgpack.Packer(default=_default)
+        return packer.pack(data)
+
+    def decode(self, buffer):
+        # unpackb aceita o buffer diretamente (sem cópia)
+        return msgpack.unpackb(buffer, raw=False)
+
+
+Format = Tuple[Codec, bool]  # (codec, com byte de formato)
+
 
 class Serializer:
     def __init__(self):
-        self.format = os.getenv('SERDE', 'JSON').upper()
+        self.codecs: Dict[str, Codec] = {}
+        self.by_tag: Dict[int, Codec] = {}
 
-        if self.format == 'MSGPACK':
-            if not MSGPACK_AVAILABLE:
+        self.register(OrjsonCodec() if ORJSON_AVAILABLE else JsonCodec())
+        if MSGPACK_AVAILABLE:
+            self.register(MsgpackCodec())
+
+        self.format = os.getenv('SERDE', 'JSON').upper()
+        if self.format not in self.codecs:
+            if self.format == 'MSGPACK':
                 raise ImportError("MessagePack não disponível. Instale msgpack-python ou use SERDE=JSON")
-            self.serialize = self._serialize_msgpack
-            self.deserialize = self._deserialize_msgpack
-        else:
-            self.serialize = self._serialize_json
-            self.deserialize = self._deserialize_json
+            self.format = 'JSON'
+
+        # SERDE_TAG=1: mensagens emitidas levam o byte de formato
+        self.default: Format = (self.codecs[self.format], os.getenv('SERDE_TAG', '0') == '1')
+        # Sem byte de formato (referência em Go e clientes antigos)
+        self.plain: Format = (self.codecs[self.format], False)
+
+    def register(self, codec: Codec):
+        """Registra um codec pelo nome e pelo byte de formato"""
+        self.codecs[codec.name] = codec
+        self.by_tag[codec.tag] = codec
 
-    def _serialize_json(self, data):
-        return json.dumps(data, ensure_ascii=False).encode('utf-8')
+    def serialize(self, data: Any, fmt: Optional[Format] = None) -> bytes:
+        codec, tagged = fmt or self.default
+        try:
+            payload = codec.encode(data)
+        except Exception:
+            _pending.values = []
+            raise
+        used = getattr(_pending, "values", None)
+        if used:
+            # Troca as marcas de valores `Encoded` pelos bytes em cache
+            _pending.values = []
+            for value in used:
+                marker, encoded = value.encoded(codec)
+                payload = payload.replace(marker, encoded, 1)
+        if tagged:
+            return bytes((codec.tag,)) + payload
+        return payload
 
-    def _deserialize_json(self, data):
-        return json.loads(data.decode('utf-8'))
+    def decode(self, data) -> Tuple[Any, Format]:
+        """Desserializa bytes ou zmq.Frame (sem cópia) e retorna (objeto, formato usado)"""
+        buffer = memoryview(data)
+        if not buffer:
+            raise ValueError("Mensagem vazia")
 
-    def _serialize_msgpack(self, data):
-        return msgpack.packb(data)
+        first = buffer[0]
+        codec = self.by_tag.get(first)
+        if codec is not None:
+            return codec.decode(buffer[1:]), (codec, True)
+
+        # Sem byte de formato: identifica JSON pelo primeiro caractere
+        if first in JSON_LEAD:
+            codec = self.codecs['JSON']
+        else:
+            codec = self.codecs.get('MSGPACK', self.codecs['JSON'])
+        return codec.decode(buffer), (codec, False)
 
-    def _deserialize_msgpack(self, data):
-        return msgpack.unpackb(data, raw=False)
+    def deserialize(self, data) -> Any:
+        return self.decode(data)[0]
 
 # Instância global
 serializer = Serializer()
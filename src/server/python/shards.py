@@ -0,0 +1,77 @@
+import os
+import time
+import socket
+from typing import Iterable, List
+
+FNV_OFFSET = 0x811c9dc5
+FNV_PRIME = 0x01000193
+
+
+def fnv1a(data: bytes) -> int:
+    """FNV-1a de 32 bits (mesmo hash de bot/node/shards.js)"""
+    h = FNV_OFFSET
+    for byte in data:
+        h = ((h ^ byte) * FNV_PRIME) & 0xffffffff
+    return h
+
+
+class ShardMap:
+    """Distribui tópicos de pub/sub entre N proxies por hash do nome do tópico.
+
+    O shard 0 é o host `proxy` e os demais `proxy-1`, `proxy-2`, ...
+    (PUBSUB_SHARDS), ou a lista explícita em PUBSUB_HOSTS.
+    """
+
+    def __init__(self):
+        hosts = os.getenv("PUBSUB_HOSTS")
+        if hosts:
+            self.hosts: List[str] = [h.strip() for h in hosts.split(",") if h.strip()]
+        else:
+            count = max(1, int(os.getenv("PUBSUB_SHARDS", "1")))
+            self.hosts = ["proxy"] + [f"proxy-{i}" for i in range(1, count)]
+
+    def check(self, timeout: float = None):
+        """Falha se algum host de shard não resolver dentro de `timeout` segundos.
+
+        Sem o perfil `sharded`, `proxy-1`/`proxy-2` não existem e os tópicos
+        desses shards seriam perdidos em silêncio (PUBSUB_CHECK_SECONDS).
+        """
+        if timeout is None:
+            timeout = float(os.getenv("PUBSUB_CHECK_SECONDS", "10"))
+        deadline = time.time() + timeout
+        missing = list(self.hosts)
+        while True:
+            missing = [host for host in missing if not _resolves(host)]
+            if not missing or time.time() >= deadline:
+                break
+            time.sleep(0.5)
+        if missing:
+            raise RuntimeError(
+                f"Shards de pub/sub inacessíveis: {', '.join(missing)} "
+                f"(PUBSUB_SHARDS={len(self.hosts)}; use o perfil `sharded` ou ajuste PUBSUB_SHARDS)")
+
+    def __len__(self) -> int:
+        return len(self.hosts)
+
+    def index(self, topic: str) -> int:
+        if len(self.hosts) == 1:
+            return 0
+        return fnv1a(topic.encode('utf-8')) % len(self.hosts)
+
+    def pub_endpoint(self, index: int) -> str:
+        return f"tcp://{self.hosts[index]}:5557"
+
+    def sub_endpoint(self, index: int) -> str:
+        return f"tcp://{self.hosts[index]}:5558"
+
+    def sub_endpoints(self, topics: Iterable[str]) -> List[str]:
+        """Endpoints dos shards responsáveis pelos tópicos (sem repetição)"""
+        return [self.sub_endpoint(i) for i in sorted({self.index(t) for t in topics})]
+
+
+def _resolves(host: str) -> bool:
+    try:
+        socket.getaddrinfo(host, None)
+        return True
+    except socket.gaierror:
+        return False
@@ -0,0 +1,145 @@
+import os
+import json
+import time
+import threading
+from typing import Dict, List, Any, Callable, Optional
+from logs import get_logger
+
+log = get_logger("store")
+
+
+class MetadataStore:
+    """Armazenamento durável de registros (usuários/canais).
+
+    Cada novo registro é anexado a um log append-only (`<nome>.log`).
+    As escritas são agrupadas (group commit): um único flush + fsync cobre
+    todos os registros acumulados na janela `commit_ms`. Periodicamente o
+    log é compactado em um snapshot (`<nome>.json`, mesmo formato antigo de
+    lista JSON) e truncado. Na inicialização, o estado é reconstruído
+    carregando o snapshot e reaplicando o final do log.
+    """
+
+    def __init__(self, snapshot_file: str,
+                 snapshot: Optional[Callable[[], List[Dict[str, Any]]]] = None,
+                 commit_ms: int = 50, compact_every: int = 10000):
+        self.snapshot_file = snapshot_file
+        self.log_file = os.path.splitext(snapshot_file)[0] + ".log"
+        self.snapshot = snapshot
+        self.commit_interval = max(commit_ms, 0) / 1000.0
+        self.compact_every = compact_every
+
+        self._lock = threading.Lock()
+        self._commit_cond = threading.Condition(self._lock)
+        self._pending: List[str] = []
+        self._log_entries = 0
+        self._log = None
+        self._closed = False
+        self._flusher = None
+
+    def load(self) -> List[Dict[str, Any]]:
+        """Carrega snapshot + log e abre o log para novas escritas"""
+        records = self._load_snapshot()
+
+        valid_size = 0
+        if os.path.exists(self.log_file):
+            with open(self.log_file, 'rb') as f:
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        break  # escrita parcial (queda durante o append)
+                    try:
+                        records.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        break
+                    valid_size += len(line)
+                    self._log_entries += 1
+
+        self._log = open(self.log_file, 'ab')
+        # Descarta cauda corrompida para não concatenar novos registros nela
+        if self._log.tell() != valid_size:
+            self._log.truncate(valid_size)
+            self._log.seek(valid_size)
+
+        if self.commit_interval > 0:
+            self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+            self._flusher.start()
+
+        return records
+
+    def _load_snapshot(self) -> List[Dict[str, Any]]:
+        if os.path.exists(self.snapshot_file):
+            try:
+                with open(self.snapshot_file, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                    if isinstance(data, list):
+                        return data
+            except json.JSONDecodeError:
+                pass
+        return []
+
+    def append(self, record: Dict[str, Any]):
+        """Anexa registro ao log (durável ao fim da janela de commit)"""
+        line = json.dumps(record, ensure_ascii=False) + '\n'
+        with self._lock:
+            self._pending.append(line)
+            self._log_entries += 1
+            if self.commit_interval <= 0:
+                self._commit()
+                self._maybe_compact()
+            else:
+                self._commit_cond.notify()
+
+    def _commit(self):
+        """Grava registros pendentes com um único fsync (chamar com lock)"""
+        if not self._pending:
+            return
+        self._log.write(''.join(self._pending).encode('utf-8'))
+        self._pending.clear()
+        self._log.flush()
+        os.fsync(self._log.fileno())
+
+    def _maybe_compact(self):
+        """Compacta o log em snapshot quando ultrapassa o limite (chamar com lock)"""
+        if self.snapshot is None or self._log_entries < self.compact_every:
+            return
+
+        tmp_file = self.snapshot_file + ".tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(self.snapshot(), f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.snapshot_file)
+
+        self._log.truncate(0)
+        self._log.seek(0)
+        self._log_entries = 0
+
+    def _flush_loop(self):
+        """Thread de group commit"""
+        while True:
+            with self._lock:
+                while not self._pending and not self._closed:
+                    self._commit_cond.wait()
+                if self._closed:
+                    return
+
+            # Aguarda a janela para agrupar escritas concorrentes
+            time.sleep(self.commit_interval)
+
+            with self._lock:
+                if self._log is None:
+                    return
+                try:
+                    self._commit()
+                    self._maybe_compact()
+                except OSError as e:
+                    log.error("Erro ao persistir %s: %s", self.log_file, e)
+
+    def close(self):
+        """Grava pendências e fecha o log"""
+        with self._lock:
+            self._closed = True
+            self._commit_cond.notify_all()
+            if self._log:
+                self._commit()
+                self._log.close()
+                self._log = None
@@ -0,0 +1,120 @@
+import zlib
+import threading
+from typing import Callable, List, Optional
+import zmq
+from broker_link import BrokerLink, HEARTBEAT_INTERVAL
+from logs import get_logger
+
+log = get_logger("workers")
+
+READY = b"READY"
+
+
+class WorkerPool:
+    """Pool de workers (threads) atrás de um backend ROUTER/DEALER.
+
+    O dispatcher conecta um DEALER ao broker (protocolo de `BrokerLink`) e
+    repassa cada requisição a um worker DEALER pelo backend inproc. O worker é escolhido
+    por hash da chave da requisição (usuário), de modo que requisições do
+    mesmo usuário são processadas sempre pelo mesmo worker, em ordem.
+    Se o handler falhar, o worker responde com `error_handler` no mesmo
+    envelope, para que cliente e broker não fiquem esperando. Com `stopping`
+    sinalizado, dispatcher e workers saem dos loops e fecham os próprios sockets.
+    """
+
+    def __init__(self, context: zmq.Context, frontend_endpoint: str,
+                 handler: Callable[[zmq.Frame], bytes], key_fn: Callable[[zmq.Frame], str], size: int,
+                 capacity: int, identity: Optional[bytes] = None,
+                 error_handler: Optional[Callable[[zmq.Frame, Exception], bytes]] = None,
+                 stopping: Optional[threading.Event] = None):
+        self.context = context
+        self.frontend_endpoint = frontend_endpoint
+        self.handler = handler
+        self.key_fn = key_fn
+        self.size = size
+        self.capacity = capacity
+        self.identity = identity
+        self.error_handler = error_handler
+        self.stopping = stopping or threading.Event()
+        self.threads: List[threading.Thread] = []
+        self.backend_endpoint = f"inproc://workers-{id(self)}"
+        self.identities: List[bytes] = [f"worker-{i}".encode() for i in range(size)]
+
+    def _worker(self, identity: bytes):
+        """Loop de um worker: recebe [envelope..., payload] e responde no mesmo envelope"""
+        socket = self.context.socket(zmq.DEALER)
+        socket.setsockopt(zmq.IDENTITY, identity)
+        socket.connect(self.backend_endpoint)
+        socket.send(READY)
+        try:
+            while not self.stopping.is_set():
+                if not socket.poll(1000):
+                    continue
+                frames = socket.recv_multipart(copy=False)
+                envelope, payload = frames[:-1], frames[-1]
+                try:
+                    response = self.handler(payload)
+                except Exception as e:
+                    log.error("Erro no %s: %s", identity.decode(), e)
+                    if self.error_handler is None:
+                        continue
+                    response = self.error_handler(payload, e)
+                socket.send_multipart(envelope + [response])
+        except zmq.ContextTerminated:
+            pass
+        finally:
+            socket.close()
+
+    def _pick(self, payload: zmq.Frame) -> bytes:
+        try:
+            key = self.key_fn(payload)
+        except Exception:
+            key = ""
+        return self.identities[zlib.crc32(key.encode('utf-8')) % self.size]
+
+    def run(self):
+        """Dispatcher: bloqueia repassando requisições e respostas"""
+        frontend = self.context.socket(zmq.DEALER)
+        if self.identity:
+            frontend.setsockopt(zmq.IDENTITY, self.identity)
+        frontend.connect(self.frontend_endpoint)
+        link = BrokerLink(frontend, self.capacity)
+        backend = self.context.socket(zmq.ROUTER)
+        backend.bind(self.backend_endpoint)
+
+        for identity in self.identities:
+            thread = threading.Thread(target=self._worker, args=(identity,), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+        # Aguarda todos os workers conectarem antes de aceitar requisições
+        ready = set()
+        while len(ready) < self.size:
+            identity, _ = backend.recv_multipart()
+            ready.add(identity)
+
+        link.ready()
+        poller = zmq.Poller()
+        poller.register(frontend, zmq.POLLIN)
+        poller.register(backend, zmq.POLLIN)
+
+        try:
+            while not self.stopping.is_set():
+                events = dict(poller.poll(HEARTBEAT_INTERVAL * 1000))
+                if frontend in events:
+                    # Frames repassados sem cópia
+                    request = link.parse(frontend.recv_multipart(copy=False))
+                    if request:
+                        envelope, payload = request
+                        backend.send_multipart([self._pick(payload)] + envelope + [payload])
+                if backend in events:
+                    frames = backend.recv_multipart(copy=False)
+                    link.reply(frames[1:-1], frames[-1])
+                link.heartbeat_if_due()
+        finally:
+            # Cada worker fecha o próprio socket ao ver `stopping`
+            self.stopping.set()
+            for thread in self.threads:
+                thread.join(10)
+            frontend.close()
+            backend.close()
@@ -22,7 +22,7 @@ if ($loginResult -match "Login realizado com sucesso") {
 }
 
 Write-Host "`n3️⃣ Verificando dados persistidos..." -ForegroundColor Yellow
-$usersData = docker-compose exec server cat /data/users.json 2>$null
+$usersData = docker-compose exec server sh -c 'cat /replica/users.*' 2>$null
 if ($usersData -match "usuario_teste") {
     Write-Host "✅ Persistência OK - Usuário salvo" -ForegroundColor Green
 } else {
@@ -97,7 +97,7 @@ if ($publishTest -match "OK") {
 }
 
 Write-Host "`n6️⃣ Verificando mensagens persistidas..." -ForegroundColor Yellow
-$messagesData = docker-compose exec server cat /data/messages/publishs.jsonl 2>$null
+$messagesData = docker-compose exec server sh -c 'cat /replica/messages/publishs.*.jsonl' 2>$null
 if ($messagesData -match "Mensagem de teste automatizada") {
     Write-Host "✅ Mensagens OK - Dados persistidos" -ForegroundColor Green
 } else {
@@ -174,9 +174,9 @@ Write-Host "" -ForegroundColor White
 Write-Host "🏆 SISTEMA APROVADO COM 9.0/9.0 PONTOS!" -ForegroundColor Magenta
 Write-Host "" -ForegroundColor White
 Write-Host "📊 Para ver dados persistidos:" -ForegroundColor Yellow
-Write-Host "docker-compose exec server cat /data/users.json" -ForegroundColor White
-Write-Host "docker-compose exec server cat /data/channels.json" -ForegroundColor White
-Write-Host "docker-compose exec server cat /data/messages/publishs.jsonl" -ForegroundColor White
+Write-Host "docker-compose exec server sh -c 'cat /replica/users.log'" -ForegroundColor White
+Write-Host "docker-compose exec server sh -c 'cat /replica/channels.log'" -ForegroundColor White
+Write-Host "docker-compose exec server sh -c 'cat /replica/messages/publishs.*.jsonl'" -ForegroundColor White
 Write-Host "" -ForegroundColor White
 Write-Host "🎮 Para usar interativamente:" -ForegroundColor Yellow
 Write-Host "docker-compose exec client ./start.sh" -ForegroundColor White
@@ -25,7 +25,7 @@ fi
 
 echo ""
 echo "3️⃣ Verificando dados persistidos..."
-docker-compose exec server cat /data/users.json 2>/dev/null | grep -q "usuario_teste"
+docker-compose exec server sh -c 'cat /replica/users.*' 2>/dev/null | grep -q "usuario_teste"
 if [ $? -eq 0 ]; then
     echo "✅ Persistência OK - Usuário salvo"
 else
@@ -103,7 +103,7 @@ fi
 
 echo ""
 echo "6️⃣ Verificando mensagens persistidas..."
-docker-compose exec server cat /data/messages/publishs.jsonl 2>/dev/null | grep -q "Mensagem de teste automatizada"
+docker-compose exec server sh -c 'cat /replica/messages/publishs.*.jsonl' 2>/dev/null | grep -q "Mensagem de teste automatizada"
 if [ $? -eq 0 ]; then
     echo "✅ Mensagens OK - Dados persistidos"
 else
@@ -185,9 +185,9 @@ echo ""
 echo "🏆 SISTEMA APROVADO COM 9.0/9.0 PONTOS!"
 echo ""
 echo "📊 Para ver dados persistidos:"
-echo "docker-compose exec server cat /data/users.json"
-echo "docker-compose exec server cat /data/channels.json"
-echo "docker-compose exec server cat /data/messages/publishs.jsonl"
+echo "docker-compose exec server sh -c 'cat /replica/users.log'"
+echo "docker-compose exec server sh -c 'cat /replica/channels.log'"
+echo "docker-compose exec server sh -c 'cat /replica/messages/publishs.*.jsonl'"
 echo ""
 echo "🎮 Para usar interativamente:"
 echo "docker-compose exec client ./start.sh"